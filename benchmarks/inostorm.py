@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""
+Event storm benchmark of the inotify pipeline:
+DWhoInotify -> DWhoInotifyEventHandler -> DWhoInotifyPlugs.
+
+File activity is generated in a temporary directory watched by a real
+DWhoInotify instance, plugins record the delay between the filesystem
+operation and their run. Throughput, latency percentiles and memory are
+reported, as text or json to compare configurations.
+
+    python benchmarks/inostorm.py --scenario all --files 5000
+    python benchmarks/inostorm.py --plugin cpu --option max_workers=8 --json
+"""
+
+import argparse
+import gc
+import hashlib
+import json
+import logging
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from dwho.classes import inotify
+from dwho.classes.inoplugs import DWhoInoEventPlugBase, INOPLUGS
+from dwho.classes.inostats import clock
+
+LOG         = logging.getLogger('dwho.inostorm')
+
+SCENARIOS   = ('creates', 'writes', 'renames', 'deep', 'burst')
+PLUGINS     = ('noop', 'cpu')
+EVENTS      = ['create', 'close_write', 'moved_to']
+
+
+class DWhoInoStormRecorder(object): # pylint: disable=useless-object-inheritance
+    def __init__(self):
+        self.issued     = {}
+        self.latencies  = []
+        self.last       = None
+        self._lock      = threading.Lock()
+
+    def issue(self, path):
+        self.issued[path] = clock()
+
+    def record(self, path):
+        now = clock()
+        with self._lock:
+            issued = self.issued.get(path)
+            if issued is not None:
+                self.latencies.append(now - issued)
+            self.last = now
+
+    def count(self):
+        with self._lock:
+            return len(self.latencies)
+
+    def reset(self):
+        with self._lock:
+            self.issued    = {}
+            self.latencies = []
+            self.last      = None
+
+RECORDER = DWhoInoStormRecorder()
+
+
+class DWhoInoStormNoopPlug(DWhoInoEventPlugBase):
+    PLUGIN_NAME = 'bench_noop'
+
+    def run(self, cfg_path, event, filepath):
+        RECORDER.record(filepath)
+
+
+class DWhoInoStormCPUPlug(DWhoInoEventPlugBase):
+    PLUGIN_NAME = 'bench_cpu'
+
+    ROUNDS      = 1000
+
+    def run(self, cfg_path, event, filepath):
+        h = hashlib.sha256(filepath.encode('utf-8'))
+        for _ in range(self.ROUNDS):
+            h = hashlib.sha256(h.digest())
+        RECORDER.record(filepath)
+
+
+INOPLUGS.register(DWhoInoStormNoopPlug())
+INOPLUGS.register(DWhoInoStormCPUPlug())
+
+
+def write_file(path, data):
+    RECORDER.issue(path)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def scenario_creates(root, args):
+    for i in range(args.files):
+        path = os.path.join(root, "c%06d" % i)
+        RECORDER.issue(path)
+        open(path, 'wb').close()
+
+
+def scenario_writes(root, args):
+    data = b'x' * args.size
+    for i in range(args.files):
+        write_file(os.path.join(root, "w%06d" % i), data)
+
+
+def scenario_renames(root, args):
+    src = os.path.join(root, 'src')
+    dst = os.path.join(root, 'dst')
+    os.mkdir(src)
+    os.mkdir(dst)
+    time.sleep(args.settle)
+
+    data = b'x' * args.size
+    for i in range(args.files):
+        path = os.path.join(src, "r%06d" % i)
+        with open(path, 'wb') as f:
+            f.write(data)
+        xpath = os.path.join(dst, "r%06d" % i)
+        RECORDER.issue(xpath)
+        os.rename(path, xpath)
+
+
+def scenario_deep(root, args):
+    data   = b'x' * args.size
+    leaves = [root]
+
+    for _ in range(args.depth):
+        xleaves = []
+        for leaf in leaves:
+            for i in range(args.width):
+                path = os.path.join(leaf, "d%d" % i)
+                os.mkdir(path)
+                xleaves.append(path)
+        leaves = xleaves
+
+    # let the new directories be watched
+    time.sleep(args.settle)
+
+    nb = max(1, args.files // len(leaves))
+    for leaf in leaves:
+        for i in range(nb):
+            write_file(os.path.join(leaf, "f%06d" % i), data)
+
+
+def scenario_burst(root, args):
+    data = b'x' * args.size
+    nb   = max(1, args.files // args.bursts)
+
+    for burst in range(args.bursts):
+        for i in range(nb):
+            write_file(os.path.join(root, "b%03d-%06d" % (burst, i)), data)
+        time.sleep(args.burst_pause)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+
+    return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+
+def rss_kb():
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * resource.getpagesize() // 1024
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def wait_settled(settle, timeout):
+    start = clock()
+    prev  = -1
+
+    while clock() - start < timeout:
+        time.sleep(settle)
+        nb = RECORDER.count()
+        if nb == prev:
+            return True
+        prev = nb
+
+    return False
+
+
+def new_inotify(root, args):
+    options = {'plugins':     {'bench_%s' % args.plugin: True},
+               'events':      list(EVENTS),
+               'paths':       {root: {}},
+               'max_workers': args.workers}
+
+    for option in args.option:
+        (key, value) = option.split('=', 1)
+        try:
+            options[key] = json.loads(value)
+        except ValueError:
+            options[key] = value
+
+    conf = {'general': {'server_id': 'inostorm'},
+            'inotify': options}
+
+    notifier        = inotify.new_notifier(options)
+    conf['inotify'] = inotify.DWhoInotifyConfig()(notifier, options)
+    notifier.init(conf)
+
+    for plugin in INOPLUGS.values():
+        plugin.init(conf)
+
+    notifier.start()
+
+    while notifier.is_scanning():
+        time.sleep(0.1)
+
+    return notifier
+
+
+def run_scenario(name, args):
+    root = tempfile.mkdtemp(prefix = 'inostorm-', dir = args.tmpdir)
+    gc.collect()
+    rss_before = rss_kb()
+
+    RECORDER.reset()
+    notifier = new_inotify(root, args)
+
+    try:
+        start   = clock()
+        globals()["scenario_%s" % name](root, args)
+        issued  = clock() - start
+        settled = wait_settled(args.settle, args.timeout)
+        stats   = notifier.get_stats() if hasattr(notifier, 'get_stats') else {}
+    finally:
+        notifier.stop()
+        notifier.join()
+        shutil.rmtree(root, True)
+
+    latencies = sorted(RECORDER.latencies)
+    elapsed   = (RECORDER.last - start) if RECORDER.last else 0.0
+
+    return {'scenario':       name,
+            'plugin':         args.plugin,
+            'files':          args.files,
+            'events':         len(latencies),
+            'issue_time':     round(issued, 3),
+            'elapsed':        round(elapsed, 3),
+            'events_per_sec': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+            'latency_p50':    round(percentile(latencies, 50) * 1000, 3),
+            'latency_p99':    round(percentile(latencies, 99) * 1000, 3),
+            'latency_max':    round(latencies[-1] * 1000, 3) if latencies else 0.0,
+            'rss_kb':         rss_kb(),
+            'rss_delta_kb':   (rss_kb() or 0) - (rss_before or 0),
+            'maxrss_kb':      resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'settled':        settled,
+            'queue':          stats.get('queue')}
+
+
+def print_result(result):
+    print("%-8s %6d events in %7.3fs  %9.1f ev/s  p50 %8.3fms  p99 %8.3fms  max %8.3fms  rss %7dKB (%+dKB)%s"
+          % (result['scenario'],
+             result['events'],
+             result['elapsed'],
+             result['events_per_sec'],
+             result['latency_p50'],
+             result['latency_p99'],
+             result['latency_max'],
+             result['rss_kb'] or 0,
+             result['rss_delta_kb'],
+             '' if result['settled'] else '  (timeout)'))
+
+
+def argv_parse_check():
+    parser = argparse.ArgumentParser(description = __doc__.split('\n\n', 1)[0].strip())
+    parser.add_argument('--scenario', action = 'append', choices = SCENARIOS + ('all',),
+                        help = "scenario to run, repeatable (default: all)")
+    parser.add_argument('--plugin', choices = PLUGINS, default = 'noop',
+                        help = "plugin run on every event (default: %(default)s)")
+    parser.add_argument('--cpu-rounds', type = int, default = DWhoInoStormCPUPlug.ROUNDS,
+                        help = "sha256 rounds of the cpu plugin (default: %(default)s)")
+    parser.add_argument('--files', type = int, default = 2000,
+                        help = "number of files per scenario (default: %(default)s)")
+    parser.add_argument('--size', type = int, default = 64,
+                        help = "bytes written per file (default: %(default)s)")
+    parser.add_argument('--depth', type = int, default = 4,
+                        help = "depth of the deep tree (default: %(default)s)")
+    parser.add_argument('--width', type = int, default = 4,
+                        help = "subdirectories per directory of the deep tree (default: %(default)s)")
+    parser.add_argument('--bursts', type = int, default = 10,
+                        help = "number of bursts (default: %(default)s)")
+    parser.add_argument('--burst-pause', type = float, default = 0.2,
+                        help = "seconds between bursts (default: %(default)s)")
+    parser.add_argument('--workers', type = int, default = 5,
+                        help = "inotify max_workers (default: %(default)s)")
+    parser.add_argument('--option', action = 'append', default = [],
+                        help = "extra inotify section option as key=value, value parsed as json if possible")
+    parser.add_argument('--settle', type = float, default = 1.0,
+                        help = "seconds without new events before a scenario is done (default: %(default)s)")
+    parser.add_argument('--timeout', type = float, default = 300,
+                        help = "maximum seconds to wait for events per scenario (default: %(default)s)")
+    parser.add_argument('--tmpdir', default = None,
+                        help = "parent directory of the generated trees")
+    parser.add_argument('--json', action = 'store_true',
+                        help = "print results as json")
+    parser.add_argument('--verbose', action = 'store_true',
+                        help = "log dwho messages")
+
+    args = parser.parse_args()
+
+    if not args.scenario or 'all' in args.scenario:
+        args.scenario = list(SCENARIOS)
+
+    return args
+
+
+def main():
+    args = argv_parse_check()
+
+    logging.basicConfig(level  = logging.INFO if args.verbose else logging.ERROR,
+                        format = '%(asctime)s %(name)s %(levelname)s %(message)s')
+
+    DWhoInoStormCPUPlug.ROUNDS = args.cpu_rounds
+
+    results = []
+    for name in args.scenario:
+        result = run_scenario(name, args)
+        results.append(result)
+        if not args.json:
+            print_result(result)
+
+    if args.json:
+        print(json.dumps(results, indent = 2, sort_keys = True))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""dwho.classes.inoasync"""
+
+import array
+import fcntl
+import logging
+import os
+import struct
+import sys
+import termios
+import threading
+
+import pyinotify
+
+from six import ensure_str
+from six.moves import queue as _queue
+
+from dwho.classes.errors import DWhoConfigurationError
+from dwho.classes.inotify import DWHO_INOQ, MODE_ADD, MODE_REM, REQUEST_BATCH, DWhoInotify, DWhoInotifySysProcessEvent
+
+try:
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    asyncio = None
+
+LOG             = logging.getLogger('dwho.inoasync')
+
+READ_SIZE       = 65536
+
+_EVENT_HEADER   = struct.Struct('iIII')
+
+
+def decode_events(buf):
+    """
+    Decode a buffer read from an inotify fd into a list of
+    (wd, mask, cookie, name) records.
+    """
+    r       = []
+    pos     = 0
+    size    = len(buf)
+    hsize   = _EVENT_HEADER.size
+    unpack  = _EVENT_HEADER.unpack_from
+    fsenc   = sys.getfilesystemencoding()
+
+    while pos + hsize <= size:
+        (wd, mask, cookie, length) = unpack(buf, pos)
+        pos += hsize
+        name = buf[pos:pos + length].rstrip(b'\0')
+        pos += length
+        r.append((wd, mask, cookie, ensure_str(name, fsenc)))
+
+    return r
+
+
+class DWhoInotifyAsync(DWhoInotify):
+    """
+    Inotify backend driven by an asyncio event loop: the inotify fd is
+    registered with loop.add_reader and every pending event is decoded
+    from a single read(). Watch requests run on a dedicated executor and
+    add/rem/submit_request return futures instead of being polled from
+    DWHO_INOQ.
+    """
+
+    def __init__(self):
+        if asyncio is None:
+            raise DWhoConfigurationError("asyncio notifier is not available on this python version")
+
+        DWhoInotify.__init__(self)
+
+        self.loop           = None
+        self.pending        = 0
+        self.pending_lock   = threading.Lock()
+        self.scan_executor  = ThreadPoolExecutor(max_workers = 1)
+
+    def add(self, cfg_path): # pylint: disable=arguments-differ
+        return self.submit_request(MODE_ADD, cfg_path)
+
+    def rem(self, cfg_path): # pylint: disable=arguments-differ
+        return self.submit_request(MODE_REM, cfg_path)
+
+    def _done(self):
+        with self.pending_lock:
+            self.pending -= 1
+            if not self.pending:
+                self.scan_event.set()
+
+    def _process_request(self, mode, cfg_path):
+        try:
+            return self.process_request(mode, cfg_path)
+        finally:
+            self._done()
+
+    def _process_requests(self, requests):
+        try:
+            return self.process_requests(requests)
+        finally:
+            self._done()
+
+    def submit_request(self, mode, cfg_path):
+        """
+        Return a concurrent future completed once the request is done,
+        None if the notifier is not started yet. Use asyncio.wrap_future
+        or request() to await it from the event loop.
+        """
+        if self.loop is None:
+            DWHO_INOQ.put((mode, cfg_path))
+            return None
+
+        with self.pending_lock:
+            self.pending += 1
+            self.scan_event.clear()
+
+        return self.scan_executor.submit(self._process_request, mode, cfg_path)
+
+    def request(self, mode, cfg_path):
+        """
+        Awaitable version of submit_request, to be called from the
+        event loop.
+        """
+        return asyncio.wrap_future(self.submit_request(mode, cfg_path), loop = self.loop)
+
+    def _read_events(self):
+        buf = array.array('i', [0])
+        if fcntl.ioctl(self.wm.get_fd(), termios.FIONREAD, buf, 1) == -1:
+            return
+
+        try:
+            data = os.read(self.wm.get_fd(), max(buf[0], READ_SIZE))
+        except OSError as e:
+            LOG.error("Unable to read inotify events. (error: %r)", e)
+            return
+
+        for (wd, mask, cookie, name) in decode_events(data):
+            self.notifier.append_event(pyinotify._RawEvent(wd, mask, cookie, name)) # pylint: disable=protected-access
+
+        self.notifier.process_events()
+
+    def _drain_requests(self):
+        # requests queued before the loop started are processed as
+        # batches, consecutive additions sharing a single walk
+        while True:
+            requests = []
+            while len(requests) < REQUEST_BATCH:
+                try:
+                    requests.append(DWHO_INOQ.get_nowait())
+                except _queue.Empty:
+                    break
+
+            if not requests:
+                break
+
+            with self.pending_lock:
+                self.pending += 1
+                self.scan_event.clear()
+
+            self.scan_executor.submit(self._process_requests, requests)
+
+    def run(self):
+        self.init_pipeline()
+        self.notifier   = pyinotify.Notifier(self.wm, self.handler)
+        self.notifier._sys_proc_fun = DWhoInotifySysProcessEvent(self.wm, # pylint: disable=protected-access
+                                                                 self.notifier,
+                                                                 self.renamer is not None)
+        loop            = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.add_reader(self.wm.get_fd(), self._read_events)
+        self.loop       = loop
+
+        self._drain_requests()
+        if self.replay is not None:
+            # run after the paths are added
+            self.scan_executor.submit(self.replay_journal)
+        if not self.pending:
+            self.scan_event.set()
+
+        try:
+            if not self.killed:
+                loop.run_forever()
+        finally:
+            loop.remove_reader(self.wm.get_fd())
+            self.scan_executor.shutdown(wait = False)
+            self.wm.close()
+            loop.close()
+
+    def stop(self):
+        DWhoInotify.stop(self)
+        if self.loop and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.loop.stop)
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""dwho.classes.inobatch"""
+
+import logging
+import threading
+
+from dwho.classes.inoplugs import PLUGPOOL
+from dwho.classes.inostats import clock
+
+LOG     = logging.getLogger('dwho.inobatch')
+
+
+class DWhoInotifyBatch(object): # pylint: disable=useless-object-inheritance,too-few-public-methods
+    __slots__ = ('cfg_path', 'deadline', 'done', 'items', 'plugin')
+
+    def __init__(self, plugin, cfg_path, done = None):
+        self.cfg_path = cfg_path
+        self.deadline = clock() + plugin.batch_timeout
+        self.done     = done
+        self.items    = []
+        self.plugin   = plugin
+
+    def __call__(self):
+        plug = None
+        try:
+            plug = PLUGPOOL.get(self.plugin)
+
+            LOG.debug("Starting batch plugin %s. (path: %r, items: %r)",
+                      plug.PLUGIN_NAME,
+                      self.cfg_path.path,
+                      len(self.items))
+
+            plug.call_batch(self.cfg_path, self.items)
+        except Exception as e:
+            LOG.exception("Error during batch plugin. (error: %r, path: %r, items: %r)",
+                          e,
+                          self.cfg_path.path,
+                          len(self.items))
+        finally:
+            if self.done:
+                self.done(self.plugin, self.items)
+            if plug:
+                del plug
+
+
+class DWhoInotifyBatcher(threading.Thread):
+    """
+    Group events per cfg_path and plugin into micro-batches for the
+    plugins implementing run_batch. A batch is run on the worker which
+    fills it up to plugin.batch_size, or submitted to the worker pool
+    once plugin.batch_timeout is reached. done is called with the
+    plugin and the items once a batch is run.
+    """
+
+    def __init__(self, submit, name = 'inobatch', done = None):
+        threading.Thread.__init__(self)
+
+        self.daemon     = True
+        self.done       = done
+        self.killed     = False
+        self.name       = name
+        self.submit     = submit
+        self._batches   = {}
+        self._cond      = threading.Condition(threading.Lock())
+
+    def add(self, plugin, cfg_path, event, filepath):
+        """
+        Append the event to its batch, return the batch if it is full
+        and must be run by the caller, None otherwise.
+        """
+        key = (cfg_path.path, plugin.PLUGIN_NAME)
+
+        with self._cond:
+            batch = self._batches.get(key)
+            if batch is None:
+                batch = self._batches[key] = DWhoInotifyBatch(plugin, cfg_path, self.done)
+                self._cond.notify()
+
+            batch.items.append((cfg_path, event, filepath))
+
+            if len(batch.items) < plugin.batch_size:
+                return None
+
+            del self._batches[key]
+
+        return batch
+
+    def pending(self):
+        with self._cond:
+            return sum([len(x.items) for x in self._batches.values()])
+
+    def _pop_expired(self, force = False):
+        now = clock()
+        r   = []
+
+        for key, batch in list(self._batches.items()):
+            if force or batch.deadline <= now:
+                r.append(self._batches.pop(key))
+
+        return r
+
+    def run(self):
+        while not self.killed:
+            with self._cond:
+                batches = self._pop_expired()
+                if not batches:
+                    if self._batches:
+                        wait = min([x.deadline for x in self._batches.values()]) - clock()
+                        self._cond.wait(max(0.001, wait))
+                    else:
+                        self._cond.wait(0.5)
+                    continue
+
+            for batch in batches:
+                try:
+                    self.submit(batch)
+                except Exception as e:
+                    LOG.exception("Unable to submit batch. (path: %r, error: %r)",
+                                  batch.cfg_path.path,
+                                  e)
+
+    def flush(self):
+        with self._cond:
+            batches = self._pop_expired(True)
+
+        for batch in batches:
+            batch()
+
+    def stop(self):
+        with self._cond:
+            self.killed = True
+            self._cond.notify()
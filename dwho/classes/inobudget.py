@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""dwho.classes.inobudget"""
+
+import logging
+import os
+import threading
+
+from six import string_types
+
+from dwho.classes.inostats import clock
+
+LOG                     = logging.getLogger('dwho.inobudget')
+
+MAX_USER_WATCHES_FILE   = '/proc/sys/fs/inotify/max_user_watches'
+
+# disabled unless configured, e.g. watch_budget: 90%
+WATCH_BUDGET            = 0
+CHECK_INTERVAL          = 10
+HIGH_WATERMARK          = 0.9
+LOW_WATERMARK           = 0.8
+
+
+def read_max_user_watches():
+    try:
+        with open(MAX_USER_WATCHES_FILE, 'r') as f:
+            return int(f.read().strip())
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def get_watch_budget(value, nb_shards = 1):
+    """
+    Return the number of watches allowed from an int or a percentage
+    of the kernel limit, None if unlimited.
+    """
+    if value in (None, ''):
+        value = WATCH_BUDGET
+
+    if isinstance(value, string_types) and value.endswith('%'):
+        limit = read_max_user_watches()
+        if not limit:
+            return None
+        value = int(limit * float(value[:-1]) / 100)
+    else:
+        value = int(value)
+
+    if value <= 0:
+        return None
+
+    return max(1, value // max(1, nb_shards))
+
+
+class DWhoInotifyBudget(threading.Thread):
+    """
+    Keep the number of watches under the budget: the least recently
+    active subtrees (directories under a cfg_path root) are demoted to the
+    poller when the high watermark is reached, and promoted back to
+    inotify when they are active again and the low watermark allows it.
+    Subtrees which failed to be watched are polled as well.
+    """
+
+    def __init__(self, dw_inotify, poller, budget, interval = CHECK_INTERVAL):
+        threading.Thread.__init__(self)
+
+        self.activity    = {}
+        self.budget      = budget
+        self.daemon      = True
+        self.demotions   = 0
+        self.dw_inotify  = dw_inotify
+        self.interval    = interval
+        self.killed      = False
+        self.name        = 'inobudget'
+        self.poller      = poller
+        self.promotions  = 0
+        self._stop_event = threading.Event()
+
+    @property
+    def high(self):
+        return int(self.budget * HIGH_WATERMARK)
+
+    @property
+    def low(self):
+        return int(self.budget * LOW_WATERMARK)
+
+    def get_unit(self, path):
+        """
+        Return (cfg_path, unit path) of the subtree holding path.
+        """
+        (root, cfg_path) = self.dw_inotify.cfg_paths.longest_prefix(path)
+        if root is None:
+            return (None, None)
+
+        if path == root:
+            return (cfg_path, root)
+
+        return (cfg_path, os.path.join(root, path[len(root):].lstrip(os.sep).split(os.sep, 1)[0]))
+
+    def touch(self, path):
+        unit = self.get_unit(path)[1]
+        if unit is None:
+            return
+
+        self.activity[unit] = clock()
+
+    def get_stats(self):
+        return {'budget':     self.budget,
+                'watches':    len(self.dw_inotify.wm.watches),
+                'polled':     sorted(self.poller.units.keys()),
+                'demotions':  self.demotions,
+                'promotions': self.promotions}
+
+    def _candidates(self):
+        wm = self.dw_inotify.wm
+        r  = []
+
+        for roots in list(self.dw_inotify.cfg_roots.values()):
+            for root in list(roots):
+                wd = wm.get_wd(root)
+                if wd is None:
+                    continue
+                for cwd in wm.get_children(wd):
+                    path = wm.get_path(cwd)
+                    if path and path not in self.poller:
+                        r.append((self.activity.get(path, 0), path, cwd))
+
+        r.sort()
+        return r
+
+    def demote(self, path, wd = None):
+        (cfg_path, unit) = self.get_unit(path)
+        if cfg_path is None or unit != path or path in self.poller:
+            return 0
+
+        wm = self.dw_inotify.wm
+
+        # baseline first, events until rm_watch may be seen twice, not lost
+        self.poller.add(cfg_path, path)
+
+        if wd is None:
+            wd = wm.get_wd(path)
+
+        nb = 0
+        if wd is not None:
+            nb = len(wm.rm_watch(wd, rec = True))
+
+        self.demotions += 1
+        LOG.info("Subtree demoted to polling. (path: %r, watches: %r)", path, nb)
+
+        return nb
+
+    def promote(self, path):
+        unit = self.poller.get(path)
+        if unit is None:
+            return False
+
+        cfg_path = unit.cfg_path
+        wdd      = self.dw_inotify.wm.add_watch(path,
+                                                cfg_path.event_mask,
+                                                rec            = True,
+                                                auto_add       = True,
+                                                quiet          = True,
+                                                exclude_filter = cfg_path.watch_filter)
+
+        if [x for x in wdd.values() if x < 0 and x != -2]:
+            LOG.warning("Unable to promote subtree, still polled. (path: %r)", path)
+            wds = [x for x in wdd.values() if x >= 0]
+            if wds:
+                self.dw_inotify.wm.rm_watch(wds)
+            return False
+
+        # events since the last poll
+        self.poller.remove(path)
+        self.poller.poll_unit(unit)
+        self.activity[path] = clock()
+        self.promotions    += 1
+
+        LOG.info("Subtree promoted to inotify. (path: %r, watches: %r)", path, len(wdd))
+
+        return True
+
+    def check(self):
+        wm = self.dw_inotify.wm
+
+        # subtrees which couldn't be watched, e.g. ENOSPC
+        for path in wm.pop_failed():
+            (cfg_path, unit) = self.get_unit(path)
+            if cfg_path is not None and unit not in self.poller:
+                self.demote(unit)
+
+        usage = len(wm.watches)
+
+        if usage > self.high:
+            for (last, path, wd) in self._candidates(): # pylint: disable=unused-variable
+                if usage <= self.low:
+                    break
+                usage -= self.demote(path, wd)
+            return
+
+        hot = [(x.last_change, x.path, len(x.dirs)) for x in list(self.poller.units.values())
+               if x.last_change and clock() - x.last_change < 2 * self.poller.interval]
+
+        for (last, path, nb) in sorted(hot, reverse = True): # pylint: disable=unused-variable
+            if usage + nb > self.low:
+                continue
+            if self.promote(path):
+                usage = len(wm.watches)
+
+    def run(self):
+        while not self.killed:
+            self._stop_event.wait(self.interval)
+            if self.killed:
+                break
+            try:
+                self.check()
+            except Exception as e:
+                LOG.exception("Unable to check watch budget. (error: %r)", e)
+
+    def stop(self):
+        self.killed = True
+        self._stop_event.set()
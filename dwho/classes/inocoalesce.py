@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""dwho.classes.inocoalesce"""
+
+import heapq
+import itertools
+import logging
+import threading
+
+from dwho.classes.inostats import clock
+
+LOG                 = logging.getLogger('dwho.inocoalesce')
+
+COALESCE_WINDOW     = 0
+COALESCE_MAX_DELAY  = 2
+
+
+class DWhoInotifyCoalesceEntry(object): # pylint: disable=useless-object-inheritance,too-few-public-methods
+    __slots__ = ('cfg_path', 'count', 'deadline', 'event', 'filepath', 'limit', 'mask')
+
+    def __init__(self, cfg_path, event, filepath, deadline, limit):
+        self.cfg_path = cfg_path
+        self.count    = 1
+        self.deadline = deadline
+        self.event    = event
+        self.filepath = filepath
+        self.limit    = limit
+        self.mask     = event.mask
+
+
+class DWhoInotifyCoalescer(threading.Thread):
+    """
+    Hold events per pathname during a quiet window and dispatch only
+    the last one, carrying the union of the merged event masks in
+    event.coalesced_mask and their number in event.coalesced_count.
+    An entry is always dispatched at most max_delay seconds after its
+    first event.
+    """
+
+    def __init__(self, dispatch, name = 'inocoalesce'):
+        threading.Thread.__init__(self)
+
+        self.daemon     = True
+        self.dispatch   = dispatch
+        self.killed     = False
+        self.merged     = 0
+        self.name       = name
+        self._cond      = threading.Condition(threading.Lock())
+        self._entries   = {}
+        self._heap      = []
+        self._seq       = itertools.count()
+
+    @staticmethod
+    def get_key(cfg_path, filepath):
+        return (cfg_path.path,
+                tuple([plugin.PLUGIN_NAME for plugin in cfg_path.plugins]),
+                filepath)
+
+    def push(self, cfg_path, event, filepath, window, max_delay):
+        now = clock()
+        key = self.get_key(cfg_path, filepath)
+
+        with self._cond:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.count   += 1
+                entry.event    = event
+                entry.mask    |= event.mask
+                entry.deadline = min(now + window, entry.limit)
+                self.merged   += 1
+                return
+
+            entry = DWhoInotifyCoalesceEntry(cfg_path,
+                                             event,
+                                             filepath,
+                                             now + window,
+                                             now + max(window, max_delay))
+            self._entries[key] = entry
+            heapq.heappush(self._heap, (entry.deadline, next(self._seq), key))
+            self._cond.notify()
+
+    def pending(self):
+        with self._cond:
+            return len(self._entries)
+
+    def _pop_due(self):
+        r = []
+
+        while self._heap:
+            (deadline, seq, key) = self._heap[0] # pylint: disable=unused-variable
+            entry = self._entries.get(key)
+            if entry is None:
+                heapq.heappop(self._heap)
+                continue
+
+            if entry.deadline != deadline:
+                # the window has been extended since this entry was pushed
+                heapq.heapreplace(self._heap, (entry.deadline, next(self._seq), key))
+                continue
+
+            if deadline > clock():
+                break
+
+            heapq.heappop(self._heap)
+            r.append(self._entries.pop(key))
+
+        return r
+
+    def _flush(self, entries):
+        for entry in entries:
+            entry.event.coalesced_mask  = entry.mask
+            entry.event.coalesced_count = entry.count
+            try:
+                self.dispatch(entry.cfg_path, entry.event, entry.filepath)
+            except Exception as e:
+                LOG.exception("Unable to dispatch coalesced event. (filepath: %r, error: %r)",
+                              entry.filepath,
+                              e)
+
+    def run(self):
+        while not self.killed:
+            with self._cond:
+                entries = self._pop_due()
+                if not entries:
+                    if self._heap:
+                        self._cond.wait(max(0.001, self._heap[0][0] - clock()))
+                    else:
+                        self._cond.wait(0.5)
+                    continue
+
+            self._flush(entries)
+
+    def flush(self):
+        with self._cond:
+            entries = list(self._entries.values())
+            self._entries.clear()
+            self._heap = []
+
+        self._flush(entries)
+
+    def stop(self):
+        with self._cond:
+            self.killed = True
+            self._cond.notify()
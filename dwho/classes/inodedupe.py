@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""dwho.classes.inodedupe"""
+
+import collections
+import hashlib
+import logging
+import os
+import stat
+import threading
+
+import pyinotify
+
+from six.moves import cPickle as pickle
+
+from dwho.classes.inosnapshot import stat_key
+
+LOG                 = logging.getLogger('dwho.inodedupe')
+
+DEDUPE_ALGORITHM    = 'sha1'
+DEDUPE_CACHE_SIZE   = 65536
+DEDUPE_CHUNK_SIZE   = 65536
+
+# IN_CREATE is not deduped, the content is usually not written yet,
+# IN_ATTRIB neither, a chmod or chown leaves the content unchanged
+# pylint: disable=no-member
+DEDUPE_MASK         = pyinotify.IN_CLOSE_WRITE \
+                      | pyinotify.IN_MODIFY \
+                      | pyinotify.IN_MOVED_TO
+FORGET_MASK         = pyinotify.IN_DELETE \
+                      | pyinotify.IN_MOVED_FROM
+# pylint: enable=no-member
+
+
+def file_digest(filepath, algorithm = DEDUPE_ALGORITHM, chunk_size = DEDUPE_CHUNK_SIZE):
+    h = hashlib.new(algorithm)
+
+    with open(filepath, 'rb') as f:
+        while True:
+            buf = f.read(chunk_size)
+            if not buf:
+                break
+            h.update(buf)
+
+    return h.digest()
+
+
+class DWhoInotifyDedupe(object): # pylint: disable=useless-object-inheritance
+    """
+    Bounded LRU of (stat key, content digest) per file path. A file is
+    unchanged when its (inode, size, mtime) is the cached one or, when
+    rewritten, when the digest of its content is the cached one.
+    """
+
+    def __init__(self, size = DEDUPE_CACHE_SIZE, filepath = None, algorithm = DEDUPE_ALGORITHM):
+        hashlib.new(algorithm)
+
+        self.algorithm = algorithm
+        self.filepath  = filepath
+        self.hits      = 0
+        self.misses    = 0
+        self.size      = max(1, int(size))
+
+        self._cache    = collections.OrderedDict()
+        self._dirty    = False
+        self._lock     = threading.Lock()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def _get(self, path):
+        r = self._cache.get(path)
+        if r is not None:
+            # move_to_end isn't available on python 2
+            del self._cache[path]
+            self._cache[path] = r
+        return r
+
+    def _set(self, path, key, digest):
+        self._cache.pop(path, None)
+        self._cache[path] = (key, digest)
+        self._dirty       = True
+        while len(self._cache) > self.size:
+            self._cache.popitem(last = False)
+
+    def forget(self, path):
+        with self._lock:
+            if self._cache.pop(path, None) is not None:
+                self._dirty = True
+
+    def is_candidate(self, event): # pylint: disable=no-self-use
+        return not getattr(event, 'dir', False) and bool(event.mask & DEDUPE_MASK)
+
+    def unchanged(self, path):
+        """
+        Fast path: True if the stat key of path is the cached one.
+        """
+        try:
+            key = stat_key(os.stat(path))
+        except OSError:
+            return False
+
+        with self._lock:
+            r = self._get(path)
+            if r is not None and r[0] == key:
+                self.hits += 1
+                return True
+
+        return False
+
+    def changed(self, path):
+        """
+        Return False if the content of path is the cached one, otherwise
+        cache the new content digest and return True.
+        """
+        try:
+            st = os.stat(path)
+            if not stat.S_ISREG(st.st_mode):
+                self.forget(path)
+                return True
+
+            key = stat_key(st)
+            with self._lock:
+                r = self._get(path)
+                if r is not None and r[0] == key:
+                    self.hits += 1
+                    return False
+
+            digest = file_digest(path, self.algorithm)
+        except (IOError, OSError):
+            self.forget(path)
+            return True
+
+        with self._lock:
+            if r is not None and r[1] == digest:
+                self.hits += 1
+                self._set(path, key, digest)
+                return False
+
+            self.misses += 1
+            self._set(path, key, digest)
+
+        return True
+
+    def get_stats(self):
+        return {'entries': len(self._cache),
+                'size':    self.size,
+                'hits':    self.hits,
+                'misses':  self.misses}
+
+    def load(self):
+        if not self.filepath or not os.path.isfile(self.filepath):
+            return self
+
+        try:
+            with open(self.filepath, 'rb') as f:
+                (algorithm, entries) = pickle.load(f)
+        except Exception as e: # pylint: disable=broad-except
+            LOG.error("Invalid dedupe file, ignored. (filepath: %r, error: %r)", self.filepath, e)
+            return self
+
+        if algorithm != self.algorithm:
+            LOG.info("Dedupe algorithm changed, cache ignored. (filepath: %r)", self.filepath)
+            return self
+
+        with self._lock:
+            for path, key, digest in entries[-self.size:]:
+                self._cache[path] = (key, digest)
+
+        LOG.info("Dedupe cache loaded. (filepath: %r, entries: %r)", self.filepath, len(self._cache))
+
+        return self
+
+    def save(self):
+        if not self.filepath or not self._dirty:
+            return
+
+        with self._lock:
+            entries     = [(path, key, digest) for path, (key, digest) in self._cache.items()]
+            self._dirty = False
+
+        tmpfile = "%s.tmp" % self.filepath
+        with open(tmpfile, 'wb') as f:
+            pickle.dump((self.algorithm, entries), f, pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmpfile, self.filepath)
@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""dwho.classes.inoexclude"""
+
+import collections
+import fnmatch
+import logging
+import os
+import re
+import threading
+
+LOG                 = logging.getLogger('dwho.inoexclude')
+
+EXCLUDE_CACHE_SIZE  = 4096
+INCLUDE_CACHE_SIZE  = 4096
+
+# matches any number of path components in include_dirs
+GLOB_RECURSIVE      = '**'
+
+_REGEX_META         = frozenset('.^$*+?{}[]\\|()')
+_REGEX_QUANTIFIERS  = frozenset('*?{')
+
+# patterns which can't be combined without renumbering their groups
+_RE_BACKREFS        = re.compile(r'\\[1-9]|\(\?P[<=]')
+
+
+def literal_prefix(pattern):
+    """
+    Return the literal string every path matched by pattern starts
+    with, '' if unknown.
+    """
+    if '|' in pattern:
+        return ''
+
+    r = []
+    i = 1 if pattern.startswith('^') else 0
+    n = len(pattern)
+
+    while i < n:
+        c = pattern[i]
+        if c == '\\':
+            if i + 1 >= n or pattern[i + 1].isalnum():
+                break
+            c    = pattern[i + 1]
+            step = 2
+        elif c in _REGEX_META:
+            break
+        else:
+            step = 1
+
+        # the literal is optional or repeated
+        if i + step < n and pattern[i + step] in _REGEX_QUANTIFIERS:
+            break
+
+        r.append(c)
+        i += step
+
+    return ''.join(r)
+
+
+def glob_root(path):
+    """
+    Return the directory part of path without glob magic.
+    """
+    parts = []
+    for part in path.split(os.sep):
+        if any([x in part for x in '*?[']):
+            break
+        parts.append(part)
+
+    return os.sep.join(parts) or None
+
+
+class DWhoInotifyExcludeFilter(object): # pylint: disable=useless-object-inheritance
+    """
+    Drop-in replacement of pyinotify.ExcludeFilter: the patterns are
+    prefiltered by their literal prefixes then matched with a single
+    combined regex. Verdicts of directories under root are cached in
+    a bounded LRU and an excluded directory excludes all its content.
+    """
+
+    def __init__(self, patterns, root = None, cache_size = EXCLUDE_CACHE_SIZE):
+        self.patterns   = list(patterns)
+        self.root       = os.path.normpath(root) if root else None
+        self.cache_size = cache_size
+        self.prefixes   = None
+        self.regex      = None
+        self.regexes    = []
+
+        self._cache     = collections.OrderedDict()
+        self._lock      = threading.Lock()
+
+        self.compile()
+
+    def __getstate__(self):
+        # sent to shard processes, compiled again there
+        return {'patterns':   self.patterns,
+                'root':       self.root,
+                'cache_size': self.cache_size}
+
+    def __setstate__(self, state):
+        self.__init__(state['patterns'], state['root'], state['cache_size'])
+
+    def compile(self):
+        combined = []
+        prefixes = set()
+
+        for pattern in self.patterns:
+            prefixes.add(literal_prefix(pattern))
+            if _RE_BACKREFS.search(pattern):
+                self.regexes.append(re.compile(pattern, re.UNICODE))
+            else:
+                combined.append(pattern)
+
+        if '' not in prefixes:
+            self.prefixes = tuple(prefixes)
+
+        if not combined:
+            return
+
+        try:
+            self.regex = re.compile('|'.join(["(?:%s)" % x for x in combined]), re.UNICODE)
+        except (AssertionError, OverflowError, re.error) as e:
+            LOG.warning("Unable to combine exclude patterns, matching them one by one. (error: %r)", e)
+            self.regexes.extend([re.compile(x, re.UNICODE) for x in combined])
+
+    def match(self, path):
+        if self.prefixes is not None and not path.startswith(self.prefixes):
+            return False
+
+        if self.regex is not None and self.regex.match(path):
+            return True
+
+        for regex in self.regexes:
+            if regex.match(path):
+                return True
+
+        return False
+
+    def _under_root(self, path):
+        return self.root is not None \
+            and len(path) > len(self.root) \
+            and path.startswith(self.root) \
+            and path[len(self.root)] == os.sep
+
+    def is_dir_excluded(self, path):
+        with self._lock:
+            r = self._cache.get(path)
+            if r is not None:
+                # move_to_end isn't available on python 2
+                del self._cache[path]
+                self._cache[path] = r
+                return r
+
+        parent = os.path.dirname(path)
+        r = (self._under_root(path) and self.is_dir_excluded(parent)) \
+            or self.match(path)
+
+        with self._lock:
+            self._cache[path] = r
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last = False)
+
+        return r
+
+    def __call__(self, path):
+        if self._under_root(path) and self.is_dir_excluded(os.path.dirname(path)):
+            return True
+
+        return self.match(path)
+
+
+def split_path(path):
+    return [x for x in path.split(os.sep) if x]
+
+
+def compile_component(pattern):
+    if pattern == GLOB_RECURSIVE:
+        return GLOB_RECURSIVE
+
+    if not any([x in pattern for x in '*?[']):
+        return pattern
+
+    return re.compile(fnmatch.translate(pattern)).match
+
+
+def match_components(parts, pattern, i = 0, j = 0):
+    """
+    Match the path components parts[i:] against the compiled pattern
+    components pattern[j:]. Return True if the pattern matches the
+    path or one of its parents, None if the path is a parent of the
+    directories the pattern may match, False otherwise.
+    """
+    while j < len(pattern):
+        if pattern[j] == GLOB_RECURSIVE:
+            if j + 1 == len(pattern):
+                return True
+            # ** matches zero component, or one more
+            while i <= len(parts):
+                x = match_components(parts, pattern, i, j + 1)
+                if x:
+                    return True
+                i += 1
+            return None
+
+        if i == len(parts):
+            return None
+
+        component = pattern[j]
+        if callable(component):
+            if not component(parts[i]):
+                return False
+        elif component != parts[i]:
+            return False
+
+        i += 1
+        j += 1
+
+    return True
+
+
+class DWhoInotifyIncludeFilter(object): # pylint: disable=useless-object-inheritance
+    """
+    include_files: glob patterns matched against the file names.
+    include_dirs: glob patterns of directories relative to the path,
+    matched component by component, ** matching any number of them.
+    A matched directory includes its whole content, the directories
+    which can't lead to a matched directory are pruned. Verdicts of
+    directories are cached in a bounded LRU.
+    """
+
+    def __init__(self, path, files = None, dirs = None, cache_size = INCLUDE_CACHE_SIZE):
+        self.path       = path
+        self.files      = list(files or ())
+        self.dirs       = list(dirs or ())
+        self.cache_size = cache_size
+        self.files_re   = None
+        self.dirs_re    = []
+
+        self._cache     = collections.OrderedDict()
+        self._lock      = threading.Lock()
+
+        self.compile()
+
+    def __getstate__(self):
+        # sent to shard processes, compiled again there
+        return {'path':       self.path,
+                'files':      self.files,
+                'dirs':       self.dirs,
+                'cache_size': self.cache_size}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'], state['files'], state['dirs'], state['cache_size'])
+
+    def compile(self):
+        if self.files:
+            self.files_re = re.compile('|'.join(["(?:%s)" % fnmatch.translate(x) for x in self.files]))
+
+        root = split_path(self.path)
+        for pattern in self.dirs:
+            self.dirs_re.append([compile_component(x) for x in root + split_path(pattern)])
+
+    @property
+    def patterns(self):
+        return (tuple(self.files), tuple(self.dirs))
+
+    def dir_verdict(self, path):
+        """
+        Return True if the directory is included, None if it may contain
+        an included directory, False otherwise.
+        """
+        with self._lock:
+            if path in self._cache:
+                r = self._cache.pop(path)
+                self._cache[path] = r
+                return r
+
+        r     = False
+        parts = split_path(path)
+        for pattern in self.dirs_re:
+            x = match_components(parts, pattern)
+            if x:
+                r = True
+                break
+            if x is None:
+                r = None
+
+        with self._lock:
+            self._cache[path] = r
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last = False)
+
+        return r
+
+    def prune(self, path):
+        """
+        Return True if the directory can't contain an included file.
+        """
+        return bool(self.dirs_re) and self.dir_verdict(path) is False
+
+    def match(self, path, isdir = False):
+        # include_files only applies to files, the directory events are
+        # included by include_dirs alone
+        if isdir:
+            return bool(self.dirs_re) and self.dir_verdict(path) is True
+
+        if self.files_re is not None and not self.files_re.match(os.path.basename(path)):
+            return False
+
+        return not self.dirs_re or self.dir_verdict(os.path.dirname(path)) is True
+
+    def __call__(self, path, isdir = False):
+        return self.match(path, isdir)
+
+
+class DWhoInotifyWatchFilter(object): # pylint: disable=useless-object-inheritance,too-few-public-methods
+    """
+    Directory filter of the watches of a path: the excluded directories
+    and the ones pruned by the include patterns.
+    """
+
+    __slots__ = ('exclude_filter', 'include_filter')
+
+    def __init__(self, exclude_filter, include_filter):
+        self.exclude_filter = exclude_filter
+        self.include_filter = include_filter
+
+    def __call__(self, path):
+        if self.exclude_filter is not None and self.exclude_filter(path):
+            return True
+
+        return self.include_filter.prune(path)
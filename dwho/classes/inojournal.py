@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""dwho.classes.inojournal"""
+
+import json
+import logging
+import os
+import struct
+import threading
+import zlib
+
+from six import iteritems
+from six.moves import cPickle as pickle
+
+from dwho.classes.inoproc import event_record
+from dwho.classes.inostats import clock
+
+LOG                         = logging.getLogger('dwho.inojournal')
+
+JOURNAL_SEGMENT_SIZE        = 64 * 1024 * 1024
+JOURNAL_MAX_PENDING         = 10000
+JOURNAL_CHECKPOINT_INTERVAL = 1.0
+JOURNAL_COMMIT_DELAY        = 0.002
+
+SEGMENT_SUFFIX              = '.journal'
+CHECKPOINT_FILE             = 'checkpoint.json'
+
+# payload size, payload crc32
+_HEADER                     = struct.Struct('>II')
+
+
+def segment_name(seq):
+    return "%020d%s" % (seq, SEGMENT_SUFFIX)
+
+
+def read_segment(filepath):
+    """
+    Yield the (seq, path, plugins, record, filepath) entries of a segment
+    up to the first torn or corrupted one.
+    """
+    with open(filepath, 'rb') as f:
+        while True:
+            header = f.read(_HEADER.size)
+            if not header:
+                return
+
+            if len(header) == _HEADER.size:
+                (size, crc) = _HEADER.unpack(header)
+                payload     = f.read(size)
+                if len(payload) == size and zlib.crc32(payload) & 0xffffffff == crc:
+                    yield pickle.loads(payload)
+                    continue
+
+            LOG.warning("Torn journal entry, segment truncated. (filepath: %r, offset: %r)",
+                        filepath, f.tell())
+            return
+
+
+def fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class DWhoInotifyJournalSegment(object): # pylint: disable=useless-object-inheritance,too-few-public-methods
+    __slots__ = ('filepath', 'first', 'last', 'size')
+
+    def __init__(self, filepath, first, last = 0, size = 0):
+        self.filepath = filepath
+        self.first    = first
+        self.last     = last
+        self.size     = size
+
+
+class DWhoInotifyJournal(threading.Thread):
+    """
+    Append-only journal of the dispatched events, in segments rotated
+    at segment_size. A task is handed to submit once its entry is
+    written and fsynced, the entries appended meanwhile sharing the
+    next fsync, the writer waiting commit_delay for more entries to
+    share it. Plugins report the entries they are done with, per
+    plugin offsets are checkpointed and the segments every plugin is
+    done with are removed. On startup, load() returns the entries some
+    plugins weren't done with: plugins run at least once.
+    """
+
+    def __init__(self, path, submit, segment_size = JOURNAL_SEGMENT_SIZE, max_pending = JOURNAL_MAX_PENDING,
+                 checkpoint_interval = JOURNAL_CHECKPOINT_INTERVAL, commit_delay = JOURNAL_COMMIT_DELAY,
+                 name = 'inojournal'):
+        threading.Thread.__init__(self)
+
+        self.daemon                 = True
+        self.killed                 = False
+        self.name                   = name
+        self.path                   = path
+        self.submit                 = submit
+        self.segment_size           = int(segment_size)
+        self.max_pending            = max(1, int(max_pending))
+        self.checkpoint_interval    = float(checkpoint_interval)
+        self.commit_delay           = float(commit_delay)
+
+        self.seq                    = 0
+        self.committed              = 0
+        self.commits                = 0
+        self.entries                = 0
+
+        self._buffer                = []
+        self._cond                  = threading.Condition(threading.Lock())
+        self._lock                  = threading.Lock()
+        self._fd                    = None
+        self._segments              = []
+        # plugin name -> seqs not done
+        self._pending               = {}
+        # segments of the previous run, kept until replayed entries
+        # are journaled again
+        self._replay_until          = None
+
+    def load(self):
+        """
+        Return the (seq, path, plugins, record, filepath) entries of the
+        previous runs not done, plugins being limited to those not done.
+        """
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        # plugins missing from the checkpoint are done up to committed
+        committed = 0
+        offsets   = {}
+        cpfile    = os.path.join(self.path, CHECKPOINT_FILE)
+        if os.path.isfile(cpfile):
+            try:
+                with open(cpfile, 'r') as f:
+                    checkpoint = json.load(f)
+                committed = int(checkpoint['committed'])
+                offsets   = dict(checkpoint['plugins'])
+            except (IOError, OSError, KeyError, TypeError, ValueError) as e:
+                LOG.error("Invalid journal checkpoint, every entry is replayed. (filepath: %r, error: %r)",
+                          cpfile, e)
+
+        r = []
+        for name in sorted(os.listdir(self.path)):
+            if not name.endswith(SEGMENT_SUFFIX):
+                continue
+
+            filepath = os.path.join(self.path, name)
+            segment  = DWhoInotifyJournalSegment(filepath, int(name[:-len(SEGMENT_SUFFIX)]))
+            for entry in read_segment(filepath):
+                segment.last = entry[0]
+                plugins      = [x for x in entry[2] if offsets.get(x, committed) < entry[0]]
+                if plugins:
+                    r.append((entry[0], entry[1], plugins, entry[3], entry[4]))
+
+            self.seq = max(self.seq, segment.last, segment.first)
+            self._segments.append(segment)
+
+        self.committed = self.seq
+
+        if self._segments:
+            self._replay_until = self.seq
+            LOG.info("Journal loaded. (path: %r, segments: %r, entries: %r)",
+                     self.path, len(self._segments), len(r))
+
+        return r
+
+    def replayed(self):
+        """
+        The entries returned by load() are dispatched again, the former
+        segments are removed once they are committed.
+        """
+        with self._cond:
+            if self._replay_until is not None:
+                self._replay_until = self.seq
+                self._cond.notify()
+
+    def append(self, task, plugins):
+        with self._cond:
+            while len(self._buffer) >= self.max_pending and not self.killed:
+                self._cond.wait(0.5)
+
+            self.seq += 1
+            seq       = self.seq
+            task.event.journal_seq = seq
+
+            with self._lock:
+                for name in plugins:
+                    self._pending.setdefault(name, set()).add(seq)
+
+            self._buffer.append((seq, task, plugins))
+            # the writer only waits on an empty buffer
+            if len(self._buffer) == 1:
+                self._cond.notify_all()
+
+        return seq
+
+    def done(self, seq, plugins):
+        if seq is None:
+            return
+
+        with self._lock:
+            for name in plugins:
+                pending = self._pending.get(name)
+                if pending is not None:
+                    pending.discard(seq)
+
+    def pending(self):
+        with self._lock:
+            return sum([len(x) for x in self._pending.values()])
+
+    def get_offsets(self):
+        """
+        Return the seq up to which every entry is done, per plugin with
+        entries not done.
+        """
+        r = {}
+
+        with self._lock:
+            for name, pending in iteritems(self._pending):
+                if pending:
+                    r[name] = min(pending) - 1
+
+        return r
+
+    def __open_segment(self, seq):
+        filepath = os.path.join(self.path, segment_name(seq))
+        self._fd = os.open(filepath, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._segments.append(DWhoInotifyJournalSegment(filepath, seq))
+        fsync_dir(self.path)
+
+    def __close_segment(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __write(self, batch):
+        chunks = []
+        for seq, task, plugins in batch:
+            payload = pickle.dumps((seq,
+                                    task.cfg_path.path,
+                                    plugins,
+                                    event_record(task.event),
+                                    task.filepath),
+                                   pickle.HIGHEST_PROTOCOL)
+            chunks.append(_HEADER.pack(len(payload), zlib.crc32(payload) & 0xffffffff))
+            chunks.append(payload)
+
+        if self._fd is None:
+            self.__open_segment(batch[0][0])
+
+        data = b''.join(chunks)
+        while data:
+            data = data[os.write(self._fd, data):]
+        os.fsync(self._fd)
+
+        segment       = self._segments[-1]
+        segment.last  = batch[-1][0]
+        segment.size += sum([len(x) for x in chunks])
+
+        self.committed = batch[-1][0]
+        self.commits  += 1
+        self.entries  += len(batch)
+
+        if segment.size >= self.segment_size:
+            self.__close_segment()
+
+    def checkpoint(self):
+        if self._replay_until is not None:
+            if self.committed < self._replay_until:
+                # entries of the former segments aren't journaled again yet
+                return
+            self._replay_until = None
+
+        committed = self.committed
+        offsets   = self.get_offsets()
+
+        tmpfile = os.path.join(self.path, "%s.tmp" % CHECKPOINT_FILE)
+        with open(tmpfile, 'w') as f:
+            json.dump({'committed': committed,
+                       'plugins':   offsets},
+                      f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmpfile, os.path.join(self.path, CHECKPOINT_FILE))
+
+        # the current segment is kept
+        low = min([committed] + list(offsets.values()))
+        for segment in list(self._segments[:-1]):
+            if segment.last > low:
+                break
+            try:
+                os.unlink(segment.filepath)
+            except OSError as e:
+                LOG.error("Unable to remove journal segment. (filepath: %r, error: %r)", segment.filepath, e)
+            self._segments.remove(segment)
+
+    def run(self):
+        last_checkpoint = clock()
+
+        while True:
+            with self._cond:
+                if not self._buffer and not self.killed:
+                    self._cond.wait(self.checkpoint_interval)
+                # appenders don't notify a non-empty buffer: group commit
+                if self._buffer and self.commit_delay > 0 and not self.killed \
+                   and len(self._buffer) < self.max_pending:
+                    self._cond.wait(self.commit_delay)
+                batch        = self._buffer
+                self._buffer = []
+                killed       = self.killed
+                self._cond.notify_all()
+
+            if batch:
+                try:
+                    self.__write(batch)
+                except (IOError, OSError) as e:
+                    LOG.error("Unable to write journal, entries not journaled. (path: %r, entries: %r, error: %r)",
+                              self.path, len(batch), e)
+                    self.__close_segment()
+
+                # entries not submitted are replayed on next start
+                for seq, task, plugins in batch:
+                    if killed:
+                        break
+                    try:
+                        self.submit(task)
+                    except Exception as e: # pylint: disable=broad-except
+                        LOG.error("Unable to submit journaled event. (seq: %r, error: %r)", seq, e)
+
+            if killed or clock() - last_checkpoint >= self.checkpoint_interval:
+                try:
+                    self.checkpoint()
+                except (IOError, OSError) as e:
+                    LOG.error("Unable to checkpoint journal. (path: %r, error: %r)", self.path, e)
+                last_checkpoint = clock()
+
+            if killed:
+                with self._cond:
+                    if self._buffer:
+                        continue
+                break
+
+        self.__close_segment()
+
+    def flush(self, timeout = None):
+        """
+        Wait until every appended entry is committed.
+        """
+        deadline = None if timeout is None else clock() + timeout
+
+        with self._cond:
+            while self._buffer or self.committed < self.seq:
+                if self.killed or not self.is_alive():
+                    return False
+                if deadline is not None and clock() >= deadline:
+                    return False
+                self._cond.wait(0.05)
+
+        return True
+
+    def get_stats(self):
+        return {'seq':       self.seq,
+                'committed': self.committed,
+                'buffered':  len(self._buffer),
+                'pending':   self.pending(),
+                'commits':   self.commits,
+                'entries':   self.entries,
+                'segments':  len(self._segments)}
+
+    def stop(self):
+        with self._cond:
+            self.killed = True
+            self._cond.notify_all()
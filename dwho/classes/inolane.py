@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""dwho.classes.inolane"""
+
+import hashlib
+import logging
+import os
+
+from six import ensure_binary
+
+from sonicprobe.libs.workerpool import WorkerPool
+
+from dwho.classes.inoqueue import DWhoInotifyDispatchQueue
+
+LOG             = logging.getLogger('dwho.inolane')
+
+ORDERING_DIR    = 'dir'
+ORDERING_FILE   = 'file'
+ORDERING_NONE   = 'none'
+ORDERINGS       = (ORDERING_DIR,
+                   ORDERING_FILE,
+                   ORDERING_NONE)
+ORDERING        = ORDERING_NONE
+
+
+def get_task_key(target, ordering = ORDERING_FILE):
+    """
+    Return the ordering key of a dispatched task: the event pathname, or
+    its parent directory, for plugins tasks, the cfg_path for batches.
+    """
+    event = getattr(target, 'event', None)
+    if event is None:
+        cfg_path = getattr(target, 'cfg_path', None)
+        return cfg_path.path if cfg_path else None
+
+    pathname = getattr(event, 'pathname', None) or target.filepath
+
+    if ordering == ORDERING_DIR:
+        return os.path.dirname(pathname)
+
+    return pathname
+
+
+class DWhoInotifyLanes(object): # pylint: disable=useless-object-inheritance
+    """
+    Keyed executor with the WorkerPool interface: tasks are hashed on
+    their key to a lane of a single worker, keeping the events of a file
+    (or of a directory) ordered while different keys run in parallel.
+    """
+
+    def __init__(self, nb_lanes, queue_size, queue_policy, ordering = ORDERING_FILE,
+                 life_time = None, name = 'inoworker', max_tasks = None, queue_class = DWhoInotifyDispatchQueue):
+        self.ordering   = ordering
+        self.lanes      = []
+
+        for i in range(max(1, int(nb_lanes))):
+            self.lanes.append(WorkerPool(queue       = queue_class(queue_size, queue_policy),
+                                         max_workers = 1,
+                                         life_time   = life_time,
+                                         name        = "%s:%d" % (name, i + 1),
+                                         max_tasks   = max_tasks))
+
+    def get_lane(self, target):
+        key = get_task_key(target, self.ordering)
+        if key is None or len(self.lanes) == 1:
+            return self.lanes[0]
+
+        # stable hash, hash() may be randomized per process
+        return self.lanes[int(hashlib.md5(ensure_binary(key)).hexdigest()[:8], 16) % len(self.lanes)]
+
+    def run(self, target, *args, **kwargs):
+        return self.get_lane(target).run(target, *args, **kwargs)
+
+    def count_workers(self):
+        return sum([lane.count_workers() for lane in self.lanes])
+
+    def count_working(self):
+        return sum([lane.count_working() for lane in self.lanes])
+
+    def killall(self, wait = None):
+        for lane in self.lanes:
+            lane.killall(0)
+
+        if wait == 0:
+            return
+
+        for lane in self.lanes:
+            lane.kill_event.wait(wait)
+
+    def stats(self):
+        lanes = [lane.tasks.stats() for lane in self.lanes]
+
+        return {'lanes':     len(lanes),
+                'ordering':  self.ordering,
+                'depths':    [x['depth'] for x in lanes],
+                'depth':     sum([x['depth'] for x in lanes]),
+                'maxsize':   lanes[0]['maxsize'],
+                'max_depth': max([x['max_depth'] for x in lanes]),
+                'policy':    lanes[0]['policy'],
+                'dropped':   sum([x['dropped'] for x in lanes]),
+                'coalesced': sum([x['coalesced'] for x in lanes])}
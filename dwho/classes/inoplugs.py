@@ -4,18 +4,30 @@
 """dwho.classes.inoplugs"""
 
 import abc
+import copy
 import logging
 import os
+import threading
 
 from socket import getfqdn
 
-from six import iterkeys
+import pyinotify
+
+from six import get_unbound_function, iterkeys
 
 from dwho.classes.abstract import DWhoAbstractDB
+from dwho.classes.errors import DWhoConfigurationError
+from dwho.classes.inorate import RATE_LIMIT
 
-CACHE_EXPIRE    = -1
-LOCK_TIMEOUT    = 60
-LOG             = logging.getLogger('dwho.inoplugs')
+BATCH_SIZE        = 100
+BATCH_TIMEOUT     = 1
+CACHE_EXPIRE      = -1
+EXECUTOR_PROCESS  = 'process'
+EXECUTOR_THREAD   = 'thread'
+EXECUTORS         = (EXECUTOR_PROCESS,
+                     EXECUTOR_THREAD)
+LOCK_TIMEOUT      = 60
+LOG               = logging.getLogger('dwho.inoplugs')
 
 
 class DWhoInoPlugs(dict):
@@ -32,6 +44,36 @@ class DWhoInoPlugs(dict):
 INOPLUGS = DWhoInoPlugs()
 
 
+class DWhoInoPlugPool(object): # pylint: disable=useless-object-inheritance
+    """
+    Per-thread copies of the registered plugins: a worker copies a
+    plugin on its first event only, then reuses that copy after a call
+    to its reset hook.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def get(self, plugin):
+        plugs = getattr(self._local, 'plugs', None)
+        if plugs is None:
+            plugs = self._local.plugs = {}
+
+        entry = plugs.get(plugin.PLUGIN_NAME)
+        # a plugin registered again gets a new copy
+        if entry is None or entry[0] is not plugin:
+            entry = plugs[plugin.PLUGIN_NAME] = (plugin, copy.copy(plugin))
+        elif hasattr(entry[1], 'reset'):
+            entry[1].reset()
+
+        return entry[1]
+
+    def clear(self):
+        self._local.plugs = {}
+
+PLUGPOOL = DWhoInoPlugPool()
+
+
 class DWhoInotifyEventBase(object): # pylint: disable=useless-object-inheritance
     __metaclass__ = abc.ABCMeta
 
@@ -132,12 +174,25 @@ class DWhoInoPluginSQLBase(DWhoInoPlugBase, DWhoAbstractDB):
 
 
 class DWhoInoEventPlugBase(DWhoInoPlugBase, DWhoInotifyEventBase):
+    """
+    Base class of the inotify event plugins. When coalescing is enabled
+    (coalesce_window, the coalesce queue policy or a rate limit), run
+    gets only the last event of a pathname: event.mask and
+    event.maskname are the ones of this event, the union of the merged
+    masks is returned by get_event_mask.
+    """
+
     __metaclass__ = abc.ABCMeta
 
     def __init__(self):
-        self.cfg_path = None
-        self.inoconf  = None
-        self.inopaths = None
+        self.batch_size    = BATCH_SIZE
+        self.batch_timeout = BATCH_TIMEOUT
+        self.cfg_path      = None
+        self.executor      = EXECUTOR_THREAD
+        self.inoconf       = None
+        self.inopaths      = None
+        self.rate_limit    = RATE_LIMIT
+        self.rate_burst    = None
 
         DWhoInoPlugBase.__init__(self)
         DWhoInotifyEventBase.__init__(self)
@@ -146,11 +201,43 @@ class DWhoInoEventPlugBase(DWhoInoPlugBase, DWhoInotifyEventBase):
         DWhoInoPlugBase.init(self, config)
         DWhoInotifyEventBase.init(self, config)
 
-        self.inoconf  = self.config['inotify']
-        self.inopaths = self.config['inotify']['paths']
+        self.inoconf       = self.config['inotify']
+        self.inopaths      = self.config['inotify']['paths']
+        self.batch_size    = int(self.inoconf.get('batch_size') or BATCH_SIZE)
+        self.batch_timeout = float(self.inoconf.get('batch_timeout') or BATCH_TIMEOUT)
+
+        if isinstance(self.plugconf, dict):
+            if self.plugconf.get('batch_size'):
+                self.batch_size    = int(self.plugconf['batch_size'])
+            if self.plugconf.get('batch_timeout'):
+                self.batch_timeout = float(self.plugconf['batch_timeout'])
+            if self.plugconf.get('executor'):
+                if self.plugconf['executor'] not in EXECUTORS:
+                    raise DWhoConfigurationError("Invalid executor: %r. (plugin: %r, allowed: %r)"
+                                                 % (self.plugconf['executor'],
+                                                    self.PLUGIN_NAME,
+                                                    EXECUTORS))
+                self.executor      = self.plugconf['executor']
+            if self.plugconf.get('rate_limit'):
+                self.rate_limit    = float(self.plugconf['rate_limit'])
+                self.rate_burst    = float(self.plugconf.get('rate_burst') or 0) or None
 
         return self
 
+    def reset(self):
+        """
+        Clear the per-event state of a pooled copy before it handles
+        another event. Override it, calling this one, if run stores
+        other attributes.
+        """
+        self.cfg_path = None
+        self.event    = None
+        self.filepath = None
+
+    def has_batch(self):
+        return get_unbound_function(self.__class__.run_batch) \
+            is not get_unbound_function(DWhoInoEventPlugBase.run_batch)
+
     def get_event_params(self):
         if hasattr(self.event, 'plugins') \
            and isinstance(self.event.plugins, dict) \
@@ -159,6 +246,14 @@ class DWhoInoEventPlugBase(DWhoInoPlugBase, DWhoInotifyEventBase):
 
         return {}
 
+    @staticmethod
+    def get_event_mask(event):
+        """
+        Return the union of the masks of the events coalesced into
+        event, event.mask if none was.
+        """
+        return getattr(event, 'coalesced_mask', event.mask)
+
     def _get_path_all_options(self):
         if not self.cfg_path \
            or self.cfg_path.path not in self.inopaths \
@@ -182,6 +277,37 @@ class DWhoInoEventPlugBase(DWhoInoPlugBase, DWhoInotifyEventBase):
     def run(self, cfg_path, event, filepath):
         """Do the action."""
 
+    def run_batch(self, items):
+        """
+        Do the action on a list of (cfg_path, event, filepath) of the same
+        cfg_path. Override it to process micro-batches at once, otherwise
+        run is called for each item.
+        """
+        for cfg_path, event, filepath in items:
+            self(cfg_path, event, filepath)
+
+    @staticmethod
+    def get_moved_from_event(event, src):
+        """
+        Return the IN_MOVED_FROM event of a rename event.
+        """
+        # pylint: disable=no-member
+        return pyinotify.Event({'wd':     getattr(event, 'wd', -1),
+                                'mask':   pyinotify.IN_MOVED_FROM | (event.mask & pyinotify.IN_ISDIR),
+                                'cookie': getattr(event, 'cookie', 0),
+                                'path':   os.path.dirname(src),
+                                'name':   os.path.basename(src),
+                                'dir':    getattr(event, 'dir', False)})
+
+    def run_rename(self, cfg_path, event, src, dst):
+        """
+        Do the action on src renamed to dst, event being the IN_MOVED_TO
+        one. Override it to handle a rename at once, otherwise run is
+        called with the IN_MOVED_FROM then with the IN_MOVED_TO event.
+        """
+        self.run(cfg_path, self.get_moved_from_event(event, src), src)
+        return self.run(cfg_path, event, dst)
+
     def realdstpath(self, event, filepath, prefix = None): # pylint: disable=unused-argument
         r            = filepath
         path_options = self._get_path_options()
@@ -201,4 +327,10 @@ class DWhoInoEventPlugBase(DWhoInoPlugBase, DWhoInotifyEventBase):
 
     def __call__(self, cfg_path, event, filepath):
         self.cfg_path = cfg_path
+        if getattr(event, 'renamed', False):
+            return self.run_rename(cfg_path, event, event.src_pathname, filepath)
         return self.run(cfg_path, event, filepath)
+
+    def call_batch(self, cfg_path, items):
+        self.cfg_path = cfg_path
+        return self.run_batch(items)
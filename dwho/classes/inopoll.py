@@ -0,0 +1,414 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""dwho.classes.inopoll"""
+
+import logging
+import os
+import threading
+import time
+
+import pyinotify
+
+from six.moves import cPickle as pickle
+from six.moves import queue as _queue
+
+from dwho.classes.inosnapshot import stat_key
+from dwho.classes.inostats import clock
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+LOG                 = logging.getLogger('dwho.inopoll')
+
+BACKEND_INOTIFY     = 'inotify'
+BACKEND_POLL        = 'poll'
+BACKENDS            = (BACKEND_INOTIFY,
+                       BACKEND_POLL)
+
+POLL_INTERVAL       = 30
+POLL_WORKERS        = 1
+INDEX_SYNC_INTERVAL = 60
+
+# directory mtime granularity margin
+MTIME_MARGIN        = 1
+
+
+def list_dir(path):
+    """
+    Return (files, subdirs) of path as ({name: stat key}, set(names)),
+    symlinks are reported as files.
+    """
+    files   = {}
+    subdirs = set()
+
+    if scandir is not None:
+        for entry in scandir(path):
+            try:
+                if entry.is_dir(follow_symlinks = False):
+                    subdirs.add(entry.name)
+                else:
+                    files[entry.name] = stat_key(entry.stat(follow_symlinks = False))
+            except OSError:
+                continue
+        return (files, subdirs)
+
+    for name in os.listdir(path):
+        xpath = os.path.join(path, name)
+        try:
+            st = os.lstat(xpath)
+        except OSError:
+            continue
+        if os.path.isdir(xpath) and not os.path.islink(xpath):
+            subdirs.add(name)
+        else:
+            files[name] = stat_key(st)
+
+    return (files, subdirs)
+
+
+class DWhoInotifyPollDir(object): # pylint: disable=useless-object-inheritance,too-few-public-methods
+    __slots__ = ('files', 'listed_at', 'mtime', 'subdirs')
+
+    def __init__(self, mtime, files, subdirs, listed_at = None):
+        self.files     = files
+        self.listed_at = listed_at or time.time()
+        self.mtime     = mtime
+        self.subdirs   = subdirs
+
+
+class DWhoInotifyPollUnit(object): # pylint: disable=useless-object-inheritance,too-few-public-methods
+    __slots__ = ('cfg_path', 'changes', 'dirs', 'interval', 'last_change', 'next_poll', 'path')
+
+    def __init__(self, cfg_path, path, interval):
+        self.cfg_path    = cfg_path
+        self.changes     = 0
+        self.dirs        = {}
+        self.interval    = interval
+        self.last_change = 0
+        self.next_poll   = clock() + interval
+        self.path        = path
+
+
+class DWhoInotifyPoller(threading.Thread):
+    """
+    Poll the subtrees which are not watched by inotify, either configured
+    with backend: poll or demoted by the watch budget, and emit synthetic
+    events for the differences. Directories are only listed again when
+    their mtime changed, files are compared on (inode, size, mtime).
+    """
+
+    def __init__(self, handler, is_watched, interval = POLL_INTERVAL, workers = POLL_WORKERS,
+                 index_file = None, name = 'inopoll'):
+        threading.Thread.__init__(self)
+
+        self.daemon      = True
+        self.handler     = handler
+        self.index_file  = index_file
+        self.interval    = interval
+        self.is_watched  = is_watched
+        self.killed      = False
+        self.name        = name
+        self.units       = {}
+        self.workers     = max(1, int(workers))
+        self._dirty      = False
+        self._index      = {}
+        self._lock       = threading.RLock()
+        self._poll_lock  = threading.Lock()
+        self._stop_event = threading.Event()
+        self._synced_at  = clock()
+
+    def load_index(self):
+        if not self.index_file or not os.path.isfile(self.index_file):
+            return self
+
+        try:
+            with open(self.index_file, 'rb') as f:
+                self._index = pickle.load(f)
+        except Exception as e: # pylint: disable=broad-except
+            LOG.error("Invalid poll index file, ignored. (filepath: %r, error: %r)", self.index_file, e)
+            self._index = {}
+
+        return self
+
+    def sync_index(self, force = False):
+        """
+        Write the state of backend: poll subtrees to the index file, atomically.
+        """
+        if not self.index_file \
+           or not (self._dirty or force) \
+           or (not force and clock() - self._synced_at < INDEX_SYNC_INTERVAL):
+            return
+
+        with self._lock:
+            index = {}
+            for path, unit in self.units.items():
+                if getattr(unit.cfg_path, 'backend', None) == BACKEND_POLL:
+                    index[path] = dict([(k, (v.mtime, v.files, v.subdirs, v.listed_at))
+                                        for k, v in list(unit.dirs.items())])
+            self._dirty     = False
+            self._synced_at = clock()
+
+        tmpfile = "%s.tmp" % self.index_file
+        with open(tmpfile, 'wb') as f:
+            pickle.dump(index, f, pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmpfile, self.index_file)
+
+    def add(self, cfg_path, path, interval = None):
+        """
+        Start polling path. Its persisted state, if any, is the previous
+        state and changes since are emitted, otherwise its current state
+        is the baseline.
+        """
+        unit  = DWhoInotifyPollUnit(cfg_path, path, interval or self.interval)
+        index = self._index.pop(path, None)
+
+        if index:
+            for dirpath, (mtime, files, subdirs, listed_at) in index.items():
+                unit.dirs[dirpath] = DWhoInotifyPollDir(mtime, files, subdirs, listed_at)
+            self.poll_unit(unit)
+        else:
+            self.poll_unit(unit, baseline = True)
+
+        with self._lock:
+            self.units[path] = unit
+            self._dirty      = True
+
+        LOG.info("Polling subtree. (path: %r, directories: %r, interval: %r)",
+                 path,
+                 len(unit.dirs),
+                 unit.interval)
+
+        # the next poll may be sooner
+        self._stop_event.set()
+
+        return unit
+
+    def remove(self, path):
+        with self._lock:
+            self._dirty = True
+            return self.units.pop(path, None)
+
+    def get(self, path):
+        with self._lock:
+            return self.units.get(path)
+
+    def __contains__(self, path):
+        return path in self.units
+
+    def count_dirs(self):
+        with self._lock:
+            return sum([len(x.dirs) for x in self.units.values()])
+
+    def _emit(self, unit, xmask, dirpath, name, isdir = False):
+        xmask &= unit.cfg_path.event_mask
+        if xmask:
+            self.handler.emit(self.handler.synthetic_event(xmask, dirpath, name, isdir))
+
+    def _emit_file(self, unit, dirpath, name, created):
+        # pylint: disable=no-member
+        if created:
+            self._emit(unit, pyinotify.IN_CREATE, dirpath, name)
+            self._emit(unit, pyinotify.IN_CLOSE_WRITE, dirpath, name)
+        elif unit.cfg_path.event_mask & pyinotify.IN_CLOSE_WRITE:
+            self._emit(unit, pyinotify.IN_CLOSE_WRITE, dirpath, name)
+        else:
+            self._emit(unit, pyinotify.IN_MODIFY, dirpath, name)
+
+    def _forget_dir(self, unit, dirpath, baseline):
+        pdir = unit.dirs.pop(dirpath, None)
+        if pdir is None:
+            return 0
+
+        nb = 0
+        if not baseline:
+            for name in pdir.files:
+                self._emit(unit, pyinotify.IN_DELETE, dirpath, name) # pylint: disable=no-member
+                nb += 1
+
+        for name in pdir.subdirs:
+            nb += self._forget_dir(unit, os.path.join(dirpath, name), baseline)
+
+        return nb
+
+    def _poll_dir(self, unit, dirpath, baseline):
+        old = unit.dirs.get(dirpath)
+
+        try:
+            mtime = os.stat(dirpath).st_mtime
+        except OSError:
+            return (self._forget_dir(unit, dirpath, baseline), ())
+
+        if old is not None and mtime == old.mtime and mtime < old.listed_at - MTIME_MARGIN:
+            # same entries, only look for modified files
+            nb = 0
+            for name, key in list(old.files.items()):
+                try:
+                    nkey = stat_key(os.lstat(os.path.join(dirpath, name)))
+                except OSError:
+                    # removed in the meantime, seen on next listing
+                    continue
+                if nkey != key:
+                    old.files[name] = nkey
+                    nb += 1
+                    if not baseline:
+                        self._emit_file(unit, dirpath, name, False)
+            return (nb, old.subdirs)
+
+        try:
+            (files, subdirs) = list_dir(dirpath)
+        except OSError:
+            return (self._forget_dir(unit, dirpath, baseline), ())
+
+        nb      = 0
+        ofiles  = old.files if old is not None else {}
+
+        for name, key in files.items():
+            okey = ofiles.get(name)
+            if okey == key:
+                continue
+            nb += 1
+            if not baseline:
+                self._emit_file(unit, dirpath, name, okey is None)
+
+        for name in ofiles:
+            if name not in files:
+                nb += 1
+                if not baseline:
+                    self._emit(unit, pyinotify.IN_DELETE, dirpath, name) # pylint: disable=no-member
+
+        if old is not None:
+            # pylint: disable=no-member
+            for name in old.subdirs - subdirs:
+                nb += self._forget_dir(unit, os.path.join(dirpath, name), baseline) + 1
+                if not baseline:
+                    self._emit(unit, pyinotify.IN_DELETE, dirpath, name, True)
+            for name in subdirs - old.subdirs:
+                nb += 1
+                if not baseline:
+                    self._emit(unit, pyinotify.IN_CREATE, dirpath, name, True)
+
+        unit.dirs[dirpath] = DWhoInotifyPollDir(mtime, files, subdirs)
+
+        return (nb, subdirs)
+
+    def _subdirs(self, unit, dirpath, subdirs, baseline):
+        r = []
+        for name in subdirs:
+            subdir = os.path.join(dirpath, name)
+            if unit.cfg_path.watch_filter and unit.cfg_path.watch_filter(subdir):
+                continue
+            # baseline of a subtree which is about to be unwatched
+            if not baseline and self.is_watched(subdir):
+                continue
+            r.append(subdir)
+        return r
+
+    def _poll_worker(self, unit, baseline, tasks, results):
+        while True:
+            dirpath = tasks.get()
+            try:
+                if dirpath is None:
+                    return
+                (nb, subdirs) = self._poll_dir(unit, dirpath, baseline)
+                results.append(nb)
+                for subdir in self._subdirs(unit, dirpath, subdirs, baseline):
+                    tasks.put(subdir)
+            except Exception as e: # pylint: disable=broad-except
+                LOG.exception("Unable to poll directory. (path: %r, error: %r)", dirpath, e)
+            finally:
+                tasks.task_done()
+
+    def poll_unit(self, unit, baseline = False):
+        with self._poll_lock:
+            nb = self._poll_unit(unit, baseline)
+
+        unit.next_poll = clock() + unit.interval
+
+        if nb:
+            self._dirty = True
+            if not baseline:
+                unit.changes     += nb
+                unit.last_change  = clock()
+
+        return nb
+
+    def _poll_unit(self, unit, baseline):
+        if self.workers < 2:
+            nb    = 0
+            stack = [unit.path]
+
+            while stack:
+                dirpath = stack.pop()
+                (xnb, subdirs) = self._poll_dir(unit, dirpath, baseline)
+                nb += xnb
+                stack.extend(self._subdirs(unit, dirpath, subdirs, baseline))
+
+            return nb
+
+        # several directories at once to hide the latency of network filesystems
+        tasks   = _queue.Queue()
+        results = []
+        threads = []
+
+        tasks.put(unit.path)
+        for i in range(self.workers):
+            thread = threading.Thread(target = self._poll_worker,
+                                      args   = (unit, baseline, tasks, results),
+                                      name   = "%s:%d" % (self.name, i + 1))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        tasks.join()
+        for thread in threads:
+            tasks.put(None)
+        for thread in threads:
+            thread.join()
+
+        return sum(results)
+
+    def poll(self):
+        now = clock()
+
+        with self._lock:
+            units = [x for x in self.units.values() if x.next_poll <= now]
+
+        for unit in units:
+            if self.killed:
+                break
+            try:
+                self.poll_unit(unit)
+            except Exception as e:
+                LOG.exception("Unable to poll subtree. (path: %r, error: %r)", unit.path, e)
+
+        try:
+            self.sync_index()
+        except Exception as e:
+            LOG.exception("Unable to write poll index. (filepath: %r, error: %r)", self.index_file, e)
+
+    def run(self):
+        while not self.killed:
+            with self._lock:
+                wait = min([x.next_poll for x in self.units.values()] or [clock() + self.interval])
+
+            self._stop_event.wait(max(0.01, wait - clock()))
+            self._stop_event.clear()
+            if not self.killed:
+                self.poll()
+
+        try:
+            self.sync_index(True)
+        except Exception as e:
+            LOG.exception("Unable to write poll index. (filepath: %r, error: %r)", self.index_file, e)
+
+    def stop(self):
+        self.killed = True
+        self._stop_event.set()
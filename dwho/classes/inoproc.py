@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""dwho.classes.inoproc"""
+
+import importlib
+import logging
+import multiprocessing
+import signal
+import threading
+import traceback
+
+import pyinotify
+
+from six import integer_types, iteritems, string_types
+
+from sonicprobe import helpers
+
+from dwho.classes.inoplugs import EXECUTOR_PROCESS, INOPLUGS, PLUGPOOL
+
+LOG                 = logging.getLogger('dwho.inoproc')
+
+EXECUTOR_WORKERS    = 'auto'
+
+# workers are not forked from the notifier process: a lock held by one
+# of its threads at fork time would never be released in the worker
+if hasattr(multiprocessing, 'get_context'):
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        _MP = multiprocessing.get_context('forkserver')
+    else:
+        _MP = multiprocessing.get_context('spawn')
+else:
+    _MP = multiprocessing
+
+# returned by a pool worker without the cfg_path of a key
+_MISSING            = 'missing-cfg-path'
+
+# cfg_path attributes not sent to the pool workers
+_CFG_PATH_SKIP      = ('plugins', '_watch_filter')
+
+_RECORD_TYPES       = integer_types + string_types + (bool, float, type(None))
+
+# plugin instance of the current pool worker
+_PLUGIN             = None
+
+# path -> (key, cfg_path) of the current pool worker, the filters of a
+# cfg_path are compiled once per worker
+_CFG_PATHS          = {}
+
+
+def event_record(event):
+    """
+    Return the picklable attributes of an event, the event is rebuilt
+    from them with pyinotify.Event in the pool worker.
+    """
+    r = {}
+
+    for key, value in iteritems(vars(event)):
+        if isinstance(value, _RECORD_TYPES):
+            r[key] = value
+
+    return r
+
+
+def cfg_path_state(cfg_path):
+    """
+    Return the attributes of a cfg_path seen by the pool workers.
+    """
+    return dict([(key, value) for key, value in iteritems(vars(cfg_path))
+                 if key not in _CFG_PATH_SKIP])
+
+
+def load_plugin(name, module, config):
+    """
+    Initialize again a plugin in a child process, its connections are
+    not shared with the parent.
+    """
+    # plugins are registered when their module is imported
+    if name not in INOPLUGS:
+        importlib.import_module(module)
+
+    plugin             = INOPLUGS[name]
+    plugin.initialized = False
+    plugin.init(config)
+    plugin.safe_init()
+
+    return plugin
+
+
+def _init_worker(name, module, config):
+    global _PLUGIN # pylint: disable=global-statement
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    _PLUGIN = load_plugin(name, module, config)
+
+    # copies inherited from the parent were made before init
+    PLUGPOOL.clear()
+
+
+def _run_worker(key, record, filepath, cfg_path = None):
+    if cfg_path is not None:
+        _CFG_PATHS[key[0]] = (key, cfg_path)
+    else:
+        cached = _CFG_PATHS.get(key[0])
+        if cached is None or cached[0] != key:
+            return (_MISSING, None)
+        cfg_path = cached[1]
+
+    plug = PLUGPOOL.get(_PLUGIN)
+
+    try:
+        r = plug(cfg_path, pyinotify.Event(record), filepath)
+    except Exception as e: # pylint: disable=broad-except
+        return (repr(e), traceback.format_exc())
+
+    if r is not None:
+        r = repr(r)
+
+    return (None, r)
+
+
+class DWhoInotifyProcessExecutor(object): # pylint: disable=useless-object-inheritance
+    """
+    Warm process pools for the plugins configured with executor: process,
+    plugins are initialized once per pool worker and called with a
+    picklable event record to get around the GIL. Events carry a key of
+    their cfg_path, sent once to each worker and again when it changes.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.pools  = {}
+        self._keys  = {}
+        self._lock  = threading.Lock()
+        self._seq   = 0
+
+    def get_key(self, cfg_path):
+        state = cfg_path_state(cfg_path)
+
+        with self._lock:
+            entry = self._keys.get(cfg_path.path)
+            if entry is not None and entry[1] == state:
+                return entry[0]
+
+            self._seq += 1
+            key        = (cfg_path.path, self._seq)
+            self._keys[cfg_path.path] = (key, state)
+
+        return key
+
+    def start(self):
+        for name, plugin in iteritems(INOPLUGS):
+            if not plugin.enabled or getattr(plugin, 'executor', None) != EXECUTOR_PROCESS:
+                continue
+
+            workers = None
+            if isinstance(plugin.plugconf, dict):
+                workers = plugin.plugconf.get('executor_workers')
+
+            nb = helpers.get_nb_workers(workers or EXECUTOR_WORKERS,
+                                        xmin    = 1,
+                                        default = 1)
+
+            self.pools[name] = _MP.Pool(processes   = nb,
+                                        initializer = _init_worker,
+                                        initargs    = (name, type(plugin).__module__, self.config))
+
+            LOG.info("Process executor started. (plugin: %r, workers: %r)", name, nb)
+
+        return self
+
+    def __contains__(self, name):
+        return name in self.pools
+
+    def __call__(self, plugin, cfg_path, event, filepath):
+        pool       = self.pools[plugin.PLUGIN_NAME]
+        key        = self.get_key(cfg_path)
+        record     = event_record(event)
+        (error, r) = pool.apply(_run_worker, (key, record, filepath))
+
+        if error == _MISSING:
+            (error, r) = pool.apply(_run_worker, (key, record, filepath, cfg_path))
+
+        if error:
+            LOG.error("Error during plugin %s in process executor. (error: %s, filename: %r)\n%s",
+                      plugin.PLUGIN_NAME,
+                      error,
+                      filepath,
+                      r)
+        elif r is not None:
+            LOG.debug("Plugin %s returned %s. (filename: %r)",
+                      plugin.PLUGIN_NAME,
+                      r,
+                      filepath)
+
+    def stop(self):
+        for pool in self.pools.values():
+            pool.terminate()
+
+        for pool in self.pools.values():
+            pool.join()
+
+        self.pools = {}
+        self._keys = {}
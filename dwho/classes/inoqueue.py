@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""dwho.classes.inoqueue"""
+
+import logging
+
+from collections import deque
+
+from six.moves import queue as _queue
+
+LOG                 = logging.getLogger('dwho.inoqueue')
+
+POLICY_BLOCK        = 'block'
+POLICY_DROP_OLDEST  = 'drop-oldest'
+POLICY_COALESCE     = 'coalesce'
+
+QUEUE_POLICIES      = (POLICY_BLOCK,
+                       POLICY_DROP_OLDEST,
+                       POLICY_COALESCE)
+
+QUEUE_SIZE          = 0
+QUEUE_POLICY        = POLICY_BLOCK
+
+SCHEDULING_FAIR     = 'fair'
+SCHEDULING_FIFO     = 'fifo'
+SCHEDULINGS         = (SCHEDULING_FAIR,
+                       SCHEDULING_FIFO)
+SCHEDULING          = SCHEDULING_FAIR
+
+WEIGHT              = 1
+
+
+def get_task_key(item):
+    """
+    Return the coalescing key of a WorkerPool task, None if the task
+    does not carry an inotify event (e.g. WorkerExit).
+    """
+    if not isinstance(item, (list, tuple)) or not item:
+        return None
+
+    target = item[0]
+    if not hasattr(target, 'filepath') or not hasattr(target, 'cfg_path'):
+        return None
+
+    return (target.cfg_path.path, target.filepath)
+
+
+def get_task_flow(item):
+    """
+    Return the cfg_path of a WorkerPool task, None for the tasks without
+    cfg_path (e.g. WorkerExit).
+    """
+    if not isinstance(item, (list, tuple)) or not item:
+        return None
+
+    return getattr(item[0], 'cfg_path', None)
+
+
+def discard_task(item):
+    """
+    Tell the task of an event it won't run, e.g. for the journal.
+    """
+    discard = getattr(item[0], 'discard', None)
+    if discard is None:
+        return
+
+    try:
+        discard()
+    except Exception as e: # pylint: disable=broad-except
+        LOG.error("Unable to discard task. (error: %r)", e)
+
+
+class DWhoInotifyDispatchQueue(_queue.Queue):
+    """
+    Queue of the inoworker pool. When bounded and full, a new task:
+      - block: waits for a free slot (WorkerPool retries until then)
+      - drop-oldest: evicts the oldest queued event task
+      - coalesce: replaces the queued task of the same pathname,
+                  otherwise waits like block
+    """
+
+    def __init__(self, maxsize = QUEUE_SIZE, policy = QUEUE_POLICY):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError("Invalid queue policy: %r" % policy)
+
+        _queue.Queue.__init__(self, maxsize)
+
+        self.policy     = policy
+        self.coalesced  = 0
+        self.dropped    = 0
+        self.max_depth  = 0
+        self._keys      = {}
+
+    def _track(self, item):
+        key = get_task_key(item)
+        if key is not None:
+            # mutable so that a coalesced task can be replaced in place
+            item = list(item)
+            self._keys[key] = item
+        return item
+
+    def _untrack(self, item):
+        key = get_task_key(item)
+        if key is not None and self._keys.get(key) is item:
+            del self._keys[key]
+
+    def _put(self, item):
+        self.queue.append(self._track(item))
+
+        depth = len(self.queue)
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def _get(self):
+        item = self.queue.popleft()
+        self._untrack(item)
+        return item
+
+    def _drop_oldest(self):
+        for i, item in enumerate(self.queue):
+            key = get_task_key(item)
+            if key is None:
+                continue
+
+            del self.queue[i]
+            if self._keys.get(key) is item:
+                del self._keys[key]
+            self.unfinished_tasks -= 1
+            self.dropped += 1
+            LOG.warning("Dispatch queue full, dropped oldest event. (filepath: %r)",
+                        item[0].filepath)
+            discard_task(item)
+            return True
+
+        return False
+
+    def _coalesce(self, item):
+        key = get_task_key(item)
+        if key is None:
+            return False
+
+        queued = self._keys.get(key)
+        if queued is None:
+            return False
+
+        old_event = queued[0].event
+        new_event = item[0].event
+        new_event.coalesced_mask  = getattr(old_event, 'coalesced_mask', old_event.mask) \
+                                    | getattr(new_event, 'coalesced_mask', new_event.mask)
+        new_event.coalesced_count = getattr(old_event, 'coalesced_count', 1) \
+                                    + getattr(new_event, 'coalesced_count', 1)
+        superseded      = queued[0]
+        queued[0]       = item[0]
+        self.coalesced += 1
+        discard_task([superseded])
+        return True
+
+    def put(self, item, block = True, timeout = None):
+        if self.maxsize <= 0 \
+           or self.policy == POLICY_BLOCK \
+           or get_task_key(item) is None:
+            return _queue.Queue.put(self, item, block, timeout)
+
+        with self.not_full:
+            if self._qsize() >= self.maxsize:
+                if self.policy == POLICY_COALESCE:
+                    if self._coalesce(item):
+                        return None
+                elif self.policy == POLICY_DROP_OLDEST:
+                    self._drop_oldest()
+
+        return _queue.Queue.put(self, item, block, timeout)
+
+    def stats(self):
+        with self.mutex:
+            return {'depth':     self._qsize(),
+                    'maxsize':   self.maxsize,
+                    'max_depth': self.max_depth,
+                    'policy':    self.policy,
+                    'dropped':   self.dropped,
+                    'coalesced': self.coalesced}
+
+
+class DWhoInotifyFlow(object): # pylint: disable=useless-object-inheritance,too-few-public-methods
+    __slots__ = ('credit', 'items', 'name', 'weight')
+
+    def __init__(self, name, weight):
+        self.credit = weight
+        self.items  = deque()
+        self.name   = name
+        self.weight = weight
+
+
+class DWhoInotifyFairQueue(DWhoInotifyDispatchQueue):
+    """
+    Dispatch queue with a FIFO per cfg_path, served by weighted deficit
+    round robin: a backlogged cfg_path gets weight tasks per round, so a
+    path flooded with events can't starve the others. drop-oldest evicts
+    from the longest backlog.
+    """
+
+    def _init(self, maxsize):
+        self.queue      = None
+        self._flows     = {}
+        self._active    = deque()
+        self._size      = 0
+
+    def _qsize(self):
+        return self._size
+
+    def _put(self, item):
+        cfg_path = get_task_flow(item)
+        name     = cfg_path.path if cfg_path is not None else None
+        flow     = self._flows.get(name)
+        if flow is None:
+            weight = getattr(cfg_path, 'weight', None) or WEIGHT
+            flow   = self._flows[name] = DWhoInotifyFlow(name, weight)
+
+        if not flow.items:
+            flow.credit = flow.weight
+            self._active.append(flow)
+
+        flow.items.append(self._track(item))
+        self._size += 1
+
+        if self._size > self.max_depth:
+            self.max_depth = self._size
+
+    def _next_flow(self):
+        while True:
+            flow = self._active[0]
+            if flow.credit >= 1:
+                return flow
+            flow.credit += flow.weight
+            self._active.rotate(-1)
+
+    def _pop(self, flow):
+        item        = flow.items.popleft()
+        self._size -= 1
+
+        if not flow.items:
+            self._active.remove(flow)
+            del self._flows[flow.name]
+
+        self._untrack(item)
+        return item
+
+    def _get(self):
+        flow         = self._next_flow()
+        flow.credit -= 1
+        item         = self._pop(flow)
+
+        if flow.items and flow.credit < 1:
+            flow.credit += flow.weight
+            self._active.rotate(-1)
+
+        return item
+
+    def _drop_oldest(self):
+        flows = sorted(self._active, key = lambda x: len(x.items), reverse = True)
+        for flow in flows:
+            if get_task_key(flow.items[0]) is None:
+                continue
+
+            item = self._pop(flow)
+            self.unfinished_tasks -= 1
+            self.dropped += 1
+            LOG.warning("Dispatch queue full, dropped oldest event. (filepath: %r)",
+                        item[0].filepath)
+            discard_task(item)
+            return True
+
+        return False
+
+    def stats(self):
+        r = DWhoInotifyDispatchQueue.stats(self)
+
+        with self.mutex:
+            r['flows'] = dict([(x.name, len(x.items)) for x in self._active])
+
+        return r
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""dwho.classes.inorate"""
+
+import copy
+import logging
+import threading
+
+from collections import OrderedDict
+
+from dwho.classes.inostats import clock
+
+LOG             = logging.getLogger('dwho.inorate')
+
+RATE_LIMIT      = 0
+
+
+def has_rate_limit(conf):
+    """
+    Return True if the inotify section sets a rate limit on a path or
+    on a plugin.
+    """
+    if conf.get('rate_limit'):
+        return True
+
+    for value in (conf.get('paths') or {}).values():
+        if isinstance(value, dict) and value.get('rate_limit'):
+            return True
+
+    for value in (conf.get('plugins') or {}).values():
+        if isinstance(value, dict) and value.get('rate_limit'):
+            return True
+
+    return False
+
+
+def get_burst(rate, burst = None):
+    if burst:
+        return max(1.0, float(burst))
+
+    return max(1.0, float(rate))
+
+
+class DWhoInotifyRateEntry(object): # pylint: disable=useless-object-inheritance,too-few-public-methods
+    __slots__ = ('cfg_path', 'count', 'event', 'filepath', 'mask')
+
+    def __init__(self, cfg_path, event, filepath):
+        self.cfg_path = cfg_path
+        self.count    = getattr(event, 'coalesced_count', 1)
+        self.event    = event
+        self.filepath = filepath
+        self.mask     = getattr(event, 'coalesced_mask', event.mask)
+
+
+class DWhoInotifyTokenBucket(object): # pylint: disable=useless-object-inheritance
+    """
+    rate tokens per second up to burst, events over the limit are
+    deferred in FIFO order and coalesced per pathname.
+    """
+
+    __slots__ = ('burst', 'deferred', 'name', 'plugin', 'rate', 'tokens', 'updated')
+
+    def __init__(self, name, rate, burst = None, plugin = None):
+        self.burst    = get_burst(rate, burst)
+        self.deferred = OrderedDict()
+        self.name     = name
+        self.plugin   = plugin
+        self.rate     = float(rate)
+        self.tokens   = self.burst
+        self.updated  = clock()
+
+    def configure(self, rate, burst = None):
+        self.rate   = float(rate)
+        self.burst  = get_burst(rate, burst)
+        self.tokens = min(self.tokens, self.burst)
+
+    def refill(self, now):
+        if now > self.updated:
+            self.tokens  = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def take(self, now):
+        self.refill(now)
+        if self.tokens < 1:
+            return False
+
+        self.tokens -= 1
+        return True
+
+    def delay(self, now):
+        self.refill(now)
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class DWhoInotifyRateLimiter(threading.Thread):
+    """
+    Token buckets per cfg_path (rate_limit, rate_burst of the path) and
+    per plugin (rate_limit, rate_burst of the plugin configuration).
+    Events over a path limit are deferred, events over a plugin limit
+    are deferred for this plugin only, the other plugins run at once.
+    Deferred events of a pathname are coalesced like the coalescer
+    does, and dispatched again once their bucket has tokens.
+    """
+
+    def __init__(self, dispatch, name = 'inorate'):
+        threading.Thread.__init__(self)
+
+        self.daemon     = True
+        self.dispatch   = dispatch
+        self.killed     = False
+        self.merged     = 0
+        self.deferred   = 0
+        self.name       = name
+        self._buckets   = {}
+        self._cond      = threading.Condition(threading.Lock())
+
+    def __get_bucket(self, key, rate, burst, plugin = None):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = DWhoInotifyTokenBucket(key[1], rate, burst, plugin)
+        elif bucket.rate != rate or bucket.burst != get_burst(rate, burst):
+            bucket.configure(rate, burst)
+
+        return bucket
+
+    def __take(self, bucket, cfg_path, event, filepath, now):
+        # a backlog keeps the events of a bucket in order
+        if not bucket.deferred and bucket.take(now):
+            return True
+
+        key   = (cfg_path.path, filepath)
+        entry = bucket.deferred.get(key)
+        if entry is not None:
+            entry.count   += getattr(event, 'coalesced_count', 1)
+            entry.event    = event
+            entry.mask    |= getattr(event, 'coalesced_mask', event.mask)
+            self.merged   += 1
+            return False
+
+        if bucket.plugin is not None:
+            cfg_path         = copy.copy(cfg_path)
+            cfg_path.plugins = [bucket.plugin]
+
+        bucket.deferred[key] = DWhoInotifyRateEntry(cfg_path, event, filepath)
+        self.deferred       += 1
+        self._cond.notify()
+
+        return False
+
+    def admit(self, cfg_path, event, filepath, bucket = None):
+        """
+        Return the cfg_path to dispatch the event to at once, restricted
+        to the plugins under their limit, None if the event is deferred.
+        bucket is the bucket releasing a deferred event.
+        """
+        now      = clock()
+        deferred = []
+
+        with self._cond:
+            if bucket is None and getattr(cfg_path, 'rate_limit', None):
+                if not self.__take(self.__get_bucket(('path', cfg_path.path),
+                                                     cfg_path.rate_limit,
+                                                     cfg_path.rate_burst),
+                                   cfg_path, event, filepath, now):
+                    return None
+
+            if bucket is not None and bucket.plugin is not None:
+                return cfg_path
+
+            for plugin in cfg_path.plugins:
+                if not getattr(plugin, 'rate_limit', None):
+                    continue
+
+                if not self.__take(self.__get_bucket(('plugin', plugin.PLUGIN_NAME),
+                                                     plugin.rate_limit,
+                                                     plugin.rate_burst,
+                                                     plugin),
+                                   cfg_path, event, filepath, now):
+                    deferred.append(plugin)
+
+        if not deferred:
+            return cfg_path
+
+        if len(deferred) == len(cfg_path.plugins):
+            return None
+
+        r         = copy.copy(cfg_path)
+        r.plugins = [x for x in cfg_path.plugins if x not in deferred]
+
+        return r
+
+    def pending(self):
+        with self._cond:
+            return sum([len(x.deferred) for x in self._buckets.values()])
+
+    def get_stats(self):
+        with self._cond:
+            return {'deferred': self.deferred,
+                    'merged':   self.merged,
+                    'buckets':  dict([("%s:%s" % key, {'rate':    bucket.rate,
+                                                       'burst':   bucket.burst,
+                                                       'tokens':  round(bucket.tokens, 2),
+                                                       'pending': len(bucket.deferred)})
+                                      for key, bucket in self._buckets.items()])}
+
+    def _pop_released(self):
+        now  = clock()
+        wait = None
+        r    = []
+
+        for bucket in self._buckets.values():
+            while bucket.deferred and bucket.take(now):
+                r.append((bucket, bucket.deferred.popitem(last = False)[1]))
+
+            if bucket.deferred:
+                delay = bucket.delay(now)
+                if wait is None or delay < wait:
+                    wait = delay
+
+        return (r, wait)
+
+    def _flush(self, entries):
+        for bucket, entry in entries:
+            entry.event.coalesced_mask  = entry.mask
+            entry.event.coalesced_count = entry.count
+            try:
+                self.dispatch(entry.cfg_path, entry.event, entry.filepath, bucket)
+            except Exception as e:
+                LOG.exception("Unable to dispatch deferred event. (filepath: %r, error: %r)",
+                              entry.filepath,
+                              e)
+
+    def run(self):
+        while not self.killed:
+            with self._cond:
+                (entries, wait) = self._pop_released()
+                if not entries:
+                    self._cond.wait(0.5 if wait is None else max(0.001, wait))
+                    continue
+
+            self._flush(entries)
+
+    def flush(self):
+        # an event released by its path bucket may be deferred again by
+        # a plugin bucket
+        while True:
+            with self._cond:
+                entries = []
+                for bucket in self._buckets.values():
+                    entries.extend([(bucket, x) for x in bucket.deferred.values()])
+                    bucket.deferred.clear()
+
+            if not entries:
+                break
+
+            self._flush(entries)
+
+    def stop(self):
+        with self._cond:
+            self.killed = True
+            self._cond.notify()
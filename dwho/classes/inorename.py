@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""dwho.classes.inorename"""
+
+import collections
+import logging
+import threading
+
+from dwho.classes.inostats import clock
+
+LOG                 = logging.getLogger('dwho.inorename')
+
+RENAME_WINDOW       = 0.5
+
+
+class DWhoInotifyRenameEntry(object): # pylint: disable=useless-object-inheritance,too-few-public-methods
+    __slots__ = ('deadline', 'event')
+
+    def __init__(self, event, deadline):
+        self.deadline = deadline
+        self.event    = event
+
+
+class DWhoInotifyRenamer(threading.Thread):
+    """
+    Hold IN_MOVED_FROM events by cookie until their IN_MOVED_TO is read
+    so that both are dispatched as a single rename. Events not paired
+    within the window are passed to expire, e.g. moved out of the
+    watched trees.
+    """
+
+    def __init__(self, expire, window = RENAME_WINDOW, name = 'inorename'):
+        threading.Thread.__init__(self)
+
+        self.daemon     = True
+        self.expire     = expire
+        self.killed     = False
+        self.name       = name
+        self.paired     = 0
+        self.window     = window
+        self._cond      = threading.Condition(threading.Lock())
+        # same window for every entry, insertion order is deadline order
+        self._entries   = collections.OrderedDict()
+
+    def push(self, event):
+        with self._cond:
+            self._entries[event.cookie] = DWhoInotifyRenameEntry(event, clock() + self.window)
+            self._cond.notify()
+
+    def pop(self, cookie):
+        with self._cond:
+            entry = self._entries.pop(cookie, None)
+            if entry is None:
+                return None
+            self.paired += 1
+            return entry.event
+
+    def pending(self):
+        with self._cond:
+            return len(self._entries)
+
+    def _pop_due(self):
+        r   = []
+        now = clock()
+
+        for cookie, entry in list(self._entries.items()):
+            if entry.deadline > now:
+                break
+            del self._entries[cookie]
+            r.append(entry.event)
+
+        return r
+
+    def _flush(self, events):
+        for event in events:
+            try:
+                self.expire(event)
+            except Exception as e:
+                LOG.exception("Unable to dispatch unpaired event. (event: %r, error: %r)", event, e)
+
+    def run(self):
+        while not self.killed:
+            with self._cond:
+                events = self._pop_due()
+                if not events:
+                    if self._entries:
+                        entry = next(iter(self._entries.values()))
+                        self._cond.wait(max(0.001, entry.deadline - clock()))
+                    else:
+                        self._cond.wait(0.5)
+                    continue
+
+            self._flush(events)
+
+    def flush(self):
+        with self._cond:
+            events = [x.event for x in self._entries.values()]
+            self._entries.clear()
+
+        self._flush(events)
+
+    def stop(self):
+        with self._cond:
+            self.killed = True
+            self._cond.notify()
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""dwho.classes.inoshard"""
+
+import hashlib
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+from six import ensure_binary, iteritems
+from six.moves import cPickle as pickle
+from six.moves import queue as _queue
+
+from dwho.classes.inoplugs import INOPLUGS, PLUGPOOL
+from dwho.classes.inoproc import load_plugin
+from dwho.classes.inotify import MODE_ADD, MODE_RELOAD, MODE_REM, DWhoInotifyConfig
+
+LOG                 = logging.getLogger('dwho.inoshard')
+
+CHECK_INTERVAL      = 1
+RESTART_DELAY       = 1
+RESTART_DELAY_MAX   = 60
+
+# shards are not forked from the supervisor process: a lock held by one
+# of its threads at fork time would never be released in the shard
+if hasattr(multiprocessing, 'get_context'):
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        _MP = multiprocessing.get_context('forkserver')
+    else:
+        _MP = multiprocessing.get_context('spawn')
+else:
+    _MP = multiprocessing
+
+
+def get_shard(cfg_path, nb_shards):
+    if cfg_path.shard is not None:
+        return cfg_path.shard % nb_shards
+
+    # stable across processes and restarts unlike hash(), and spread
+    # better than crc32 for the power of two modulos
+    return int(hashlib.md5(ensure_binary(cfg_path.path)).hexdigest()[:8], 16) % nb_shards
+
+
+def _supervisor_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+def _shard_main(index, notifier_class, config, plugins, cfg_paths, requests, scanned, ppid): # pylint: disable=too-many-arguments
+    """
+    Entry point of a shard process: it owns its inotify fd, watch
+    manager and worker pool.
+    """
+    notifier = notifier_class()
+
+    def stop(signum, stack_frame): # pylint: disable=unused-argument
+        notifier.stop()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    if config['inotify'].get('journal_dir'):
+        # a journal per shard, entries are replayed by the shard owning them
+        config['inotify']['journal_dir'] = os.path.join(config['inotify']['journal_dir'],
+                                                        "shard-%d" % index)
+
+    for name, module in plugins:
+        try:
+            load_plugin(name, module, config)
+        except Exception as e: # pylint: disable=broad-except
+            LOG.error("Unable to load plugin in shard. (shard: %r, plugin: %r, error: %r)",
+                      index, name, e)
+
+    # copies inherited from the parent were made before init
+    PLUGPOOL.clear()
+
+    notifier.name = "inotify:%d" % index
+    notifier.init(config)
+
+    # cfg_paths refer to their plugins by name, they are loaded once
+    # the plugins are registered
+    for cfg_path in pickle.loads(cfg_paths):
+        notifier.add(cfg_path)
+
+    notifier.start()
+
+    while notifier.is_alive():
+        try:
+            request = requests.get(True, 0.5)
+        except _queue.Empty:
+            request = False
+        except (EOFError, IOError, OSError):
+            request = None
+
+        if not _supervisor_alive(ppid):
+            # supervisor is gone
+            request = None
+
+        if request is None:
+            notifier.stop()
+            break
+
+        if request:
+            (mode, cfg_path) = request
+            if mode == MODE_ADD:
+                notifier.add(cfg_path)
+            elif mode == MODE_REM:
+                notifier.rem(cfg_path)
+            else:
+                notifier.submit_request(mode, cfg_path)
+
+        if notifier.is_scanning():
+            scanned.clear()
+        else:
+            scanned.set()
+
+    notifier.join()
+
+
+class DWhoInotifyShard(object): # pylint: disable=useless-object-inheritance,too-few-public-methods
+    def __init__(self, index):
+        self.cfg_paths      = {}
+        self.index          = index
+        self.process        = None
+        self.requests       = None
+        self.restarts       = 0
+        self.restart_at     = 0
+        self.restart_delay  = RESTART_DELAY
+        self.scanned        = _MP.Event()
+
+
+class DWhoInotifySupervisor(threading.Thread):
+    """
+    Shard the configured inotify paths across child processes, each one
+    running its own notifier. Crashed shards are restarted with an
+    exponential backoff.
+    """
+
+    def __init__(self, nb_shards, notifier_class):
+        threading.Thread.__init__(self)
+
+        self.config         = None
+        self.killed         = False
+        self.name           = 'inosupervisor'
+        self.notifier_class = notifier_class
+        self.shards         = [DWhoInotifyShard(i) for i in range(nb_shards)]
+        self._lock          = threading.Lock()
+
+    def init(self, config):
+        self.config = config
+        return self
+
+    def _request(self, mode, cfg_path):
+        shard = self.shards[get_shard(cfg_path, len(self.shards))]
+
+        with self._lock:
+            if mode == MODE_ADD:
+                shard.cfg_paths[cfg_path.path] = cfg_path
+            else:
+                shard.cfg_paths.pop(cfg_path.path, None)
+
+            if shard.process and shard.process.is_alive():
+                shard.scanned.clear()
+                shard.requests.put((mode, cfg_path))
+
+    def reload(self, conf):
+        """
+        Parse the inotify section conf and send every shard its new
+        paths, the shards apply the differences.
+        """
+        (conf, cfg_paths) = DWhoInotifyConfig().load(conf)
+        shards            = [[] for x in self.shards] # pylint: disable=unused-variable
+
+        for cfg_path in cfg_paths:
+            shards[get_shard(cfg_path, len(self.shards))].append(cfg_path)
+
+        if self.config is not None:
+            # restarted shards get the new paths options
+            self.config['inotify']['paths'] = conf['paths']
+
+        with self._lock:
+            for shard in self.shards:
+                shard.cfg_paths = dict([(x.path, x) for x in shards[shard.index]])
+                if shard.process and shard.process.is_alive():
+                    shard.scanned.clear()
+                    shard.requests.put((MODE_RELOAD, (conf, shards[shard.index])))
+
+        return len(cfg_paths)
+
+    def add(self, cfg_path):
+        self._request(MODE_ADD, cfg_path)
+
+    def rem(self, cfg_path):
+        self._request(MODE_REM, cfg_path)
+
+    def is_scanning(self):
+        for shard in self.shards:
+            if shard.cfg_paths and not shard.scanned.is_set():
+                return True
+        return False
+
+    def get_shards(self):
+        r = []
+        for shard in self.shards:
+            r.append({'index':     shard.index,
+                      'pid':       shard.process.pid if shard.process else None,
+                      'alive':     bool(shard.process and shard.process.is_alive()),
+                      'paths':     list(shard.cfg_paths.keys()),
+                      'restarts':  shard.restarts})
+        return r
+
+    def get_stats(self):
+        # pipeline stats are kept in each shard process
+        return {'shards': self.get_shards()}
+
+    def _start_shard(self, shard):
+        with self._lock:
+            shard.scanned.clear()
+            shard.requests  = _MP.Queue()
+            shard.process   = _MP.Process(target = _shard_main,
+                                          name   = "inoshard:%d" % shard.index,
+                                          args   = (shard.index,
+                                                    self.notifier_class,
+                                                    self.config,
+                                                    [(name, type(plugin).__module__)
+                                                     for name, plugin in iteritems(INOPLUGS)],
+                                                    pickle.dumps(list(shard.cfg_paths.values()),
+                                                                 pickle.HIGHEST_PROTOCOL),
+                                                    shard.requests,
+                                                    shard.scanned,
+                                                    os.getpid()))
+            # not daemonic, shards may need their own child processes
+            shard.process.daemon = False
+            shard.process.start()
+
+        LOG.info("Shard started. (shard: %r, pid: %r, paths: %r)",
+                 shard.index,
+                 shard.process.pid,
+                 list(shard.cfg_paths.keys()))
+
+    def _check_shard(self, shard):
+        if shard.process.is_alive():
+            if time.time() - shard.restart_at > RESTART_DELAY_MAX:
+                shard.restart_delay = RESTART_DELAY
+            return
+
+        now = time.time()
+        if not shard.restart_at or now >= shard.restart_at + shard.restart_delay:
+            LOG.error("Shard died, restarting. (shard: %r, pid: %r, exitcode: %r)",
+                      shard.index,
+                      shard.process.pid,
+                      shard.process.exitcode)
+            if shard.restart_at:
+                shard.restart_delay = min(shard.restart_delay * 2, RESTART_DELAY_MAX)
+            shard.restart_at = now
+            shard.restarts  += 1
+            self._start_shard(shard)
+
+    def run(self):
+        for shard in self.shards:
+            self._start_shard(shard)
+
+        while not self.killed:
+            time.sleep(CHECK_INTERVAL)
+            for shard in self.shards:
+                if self.killed:
+                    break
+                self._check_shard(shard)
+
+    def stop(self):
+        self.killed = True
+
+        for shard in self.shards:
+            if not shard.process or not shard.process.is_alive():
+                continue
+            try:
+                shard.requests.put(None)
+            except Exception: # pylint: disable=broad-except
+                pass
+
+        for shard in self.shards:
+            if not shard.process:
+                continue
+            shard.process.join(5)
+            if shard.process.is_alive():
+                os.kill(shard.process.pid, signal.SIGTERM)
+                shard.process.join(5)
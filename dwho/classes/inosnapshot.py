@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""dwho.classes.inosnapshot"""
+
+import array
+import logging
+import os
+import struct
+import sys
+import threading
+
+import pyinotify
+
+from six import ensure_binary, ensure_str
+
+from dwho.classes.inotrie import DWhoInotifyPathTrie
+
+LOG                 = logging.getLogger('dwho.inosnapshot')
+
+SNAPSHOT_MAGIC      = b'DWHOSNP1'
+SYNC_INTERVAL       = 5
+
+OP_SET              = 1
+OP_DEL              = 2
+
+# op, inode, size, mtime_ns, path length
+_RECORD             = struct.Struct('<BQQqH')
+
+# pylint: disable=no-member
+UPDATE_MASK         = pyinotify.IN_CREATE \
+                      | pyinotify.IN_CLOSE_WRITE \
+                      | pyinotify.IN_MODIFY \
+                      | pyinotify.IN_ATTRIB \
+                      | pyinotify.IN_MOVED_TO
+DELETE_MASK         = pyinotify.IN_DELETE \
+                      | pyinotify.IN_MOVED_FROM
+# pylint: enable=no-member
+
+
+def stat_key(st):
+    mtime_ns = getattr(st, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(st.st_mtime * 1000000000)
+
+    return (st.st_ino, st.st_size, mtime_ns)
+
+
+class DWhoInotifySnapshot(threading.Thread):
+    """
+    On-disk snapshot of the watched files as (path, inode, size, mtime).
+    Entries are kept in arrays indexed by a slot per path, the slots are
+    stored in a path trie to list the paths under a root, and persisted
+    as an append-only file of fixed size records, compacted when it
+    contains too many obsolete records.
+    """
+
+    def __init__(self, filepath, sync_interval = SYNC_INTERVAL, name = 'inosnapshot'):
+        threading.Thread.__init__(self)
+
+        self.daemon         = True
+        self.filepath       = filepath
+        self.killed         = False
+        self.loaded         = False
+        self.name           = name
+        self.sync_interval  = sync_interval
+
+        self.index          = DWhoInotifyPathTrie()
+        self.paths          = []
+        self.inodes         = array.array('Q')
+        self.sizes          = array.array('Q')
+        self.mtimes         = array.array('q')
+
+        self._buffer        = []
+        self._free          = []
+        self._lock          = threading.RLock()
+        self._nb_records    = 0
+        self._pending       = {}
+        self._stop_event    = threading.Event()
+        self._fsenc         = sys.getfilesystemencoding()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, path):
+        return path in self.index
+
+    def get(self, path):
+        with self._lock:
+            slot = self.index.get(path)
+            if slot is None:
+                return None
+            return (self.inodes[slot], self.sizes[slot], self.mtimes[slot])
+
+    def _set(self, path, key):
+        slot = self.index.get(path)
+        if slot is None:
+            if self._free:
+                slot = self._free.pop()
+                self.paths[slot] = path
+                (self.inodes[slot], self.sizes[slot], self.mtimes[slot]) = key
+            else:
+                slot = len(self.paths)
+                self.paths.append(path)
+                self.inodes.append(key[0])
+                self.sizes.append(key[1])
+                self.mtimes.append(key[2])
+            self.index[path] = slot
+        elif (self.inodes[slot], self.sizes[slot], self.mtimes[slot]) == key:
+            return False
+        else:
+            (self.inodes[slot], self.sizes[slot], self.mtimes[slot]) = key
+
+        return True
+
+    def _del(self, path):
+        slot = self.index.get(path)
+        if slot is None:
+            return False
+
+        del self.index[path]
+        self.paths[slot] = None
+        self._free.append(slot)
+        return True
+
+    def _encode(self, op, path, key = (0, 0, 0)):
+        bpath = ensure_binary(path, self._fsenc)
+        return _RECORD.pack(op, key[0], key[1], key[2], len(bpath)) + bpath
+
+    def set(self, path, key):
+        with self._lock:
+            if self._set(path, key):
+                self._buffer.append(self._encode(OP_SET, path, key))
+
+    def delete(self, path):
+        with self._lock:
+            if self._del(path):
+                self._buffer.append(self._encode(OP_DEL, path))
+
+    def paths_under(self, root):
+        with self._lock:
+            return [x for x, slot in self.index.items(root) if x != root] # pylint: disable=unused-variable
+
+    def has_paths_under(self, root):
+        with self._lock:
+            return self.index.has_descendants(root)
+
+    def update(self, event):
+        """
+        Record an event, the file is stat'ed later by the sync thread.
+        """
+        if not hasattr(event, 'pathname') or event.mask & pyinotify.IN_ISDIR: # pylint: disable=no-member
+            return
+
+        if event.mask & UPDATE_MASK:
+            with self._lock:
+                self._pending[event.pathname] = True
+        elif event.mask & DELETE_MASK:
+            with self._lock:
+                self._pending[event.pathname] = False
+
+    def load(self):
+        if not os.path.isfile(self.filepath):
+            return self
+
+        with open(self.filepath, 'rb') as f:
+            data = f.read()
+
+        if not data.startswith(SNAPSHOT_MAGIC):
+            LOG.error("Invalid snapshot file, ignored. (filepath: %r)", self.filepath)
+            return self
+
+        pos     = len(SNAPSHOT_MAGIC)
+        size    = len(data)
+        rsize   = _RECORD.size
+        unpack  = _RECORD.unpack_from
+        nb      = 0
+
+        with self._lock:
+            while pos + rsize <= size:
+                (op, ino, fsize, mtime, plen) = unpack(data, pos)
+                pos += rsize
+                if pos + plen > size:
+                    # truncated by a crash during a write
+                    break
+                path = ensure_str(data[pos:pos + plen], self._fsenc)
+                pos += plen
+                nb  += 1
+                if op == OP_SET:
+                    self._set(path, (ino, fsize, mtime))
+                elif op == OP_DEL:
+                    self._del(path)
+
+            self._nb_records = nb
+            self.loaded      = True
+
+        LOG.info("Snapshot loaded. (filepath: %r, entries: %r, records: %r)",
+                 self.filepath,
+                 len(self.index),
+                 nb)
+
+        return self
+
+    def _compact(self):
+        tmpfile = "%s.tmp" % self.filepath
+        with open(tmpfile, 'wb') as f:
+            f.write(SNAPSHOT_MAGIC)
+            for path, slot in self.index.items():
+                f.write(self._encode(OP_SET,
+                                     path,
+                                     (self.inodes[slot], self.sizes[slot], self.mtimes[slot])))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmpfile, self.filepath)
+
+        self._nb_records = len(self.index)
+        self._buffer     = []
+
+    def _process_pending(self):
+        with self._lock:
+            pending       = self._pending
+            self._pending = {}
+
+        for path, exists in pending.items():
+            if exists:
+                try:
+                    self.set(path, stat_key(os.lstat(path)))
+                    continue
+                except OSError:
+                    pass
+            self.delete(path)
+
+    def sync(self):
+        self._process_pending()
+
+        with self._lock:
+            if not self._buffer:
+                return
+
+            nb = self._nb_records + len(self._buffer)
+            if nb > 1024 and nb > 2 * len(self.index):
+                self._compact()
+                return
+
+            mode = 'ab' if os.path.isfile(self.filepath) else 'wb'
+            with open(self.filepath, mode) as f:
+                if mode == 'wb':
+                    f.write(SNAPSHOT_MAGIC)
+                f.write(b''.join(self._buffer))
+                f.flush()
+                os.fsync(f.fileno())
+
+            self._nb_records = nb
+            self._buffer     = []
+
+    def run(self):
+        while not self.killed:
+            self._stop_event.wait(self.sync_interval)
+            try:
+                self.sync()
+            except Exception as e:
+                LOG.exception("Unable to sync snapshot. (filepath: %r, error: %r)",
+                              self.filepath,
+                              e)
+
+    def stop(self):
+        self.killed = True
+        self._stop_event.set()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""dwho.classes.inostats"""
+
+import logging
+import threading
+import time
+
+LOG             = logging.getLogger('dwho.inostats')
+
+# bucket i counts durations in [2^(i-1), 2^i[ microseconds
+NB_BUCKETS      = 32
+PERCENTILES     = (50, 90, 99)
+
+STAGE_DISPATCH  = 'dispatch'
+STAGE_LATENCY   = 'latency'
+STAGE_PLUGIN    = 'plugin'
+STAGE_RUN       = 'run'
+STAGE_WAIT      = 'wait'
+
+clock           = getattr(time, 'monotonic', time.time)
+
+
+class DWhoInotifyHistogram(object): # pylint: disable=useless-object-inheritance
+    """
+    Duration histogram with power of two microseconds buckets.
+    """
+    __slots__ = ('buckets', 'count', 'max', 'total', '_lock')
+
+    def __init__(self):
+        self.buckets = [0] * NB_BUCKETS
+        self.count   = 0
+        self.max     = 0.0
+        self.total   = 0.0
+        self._lock   = threading.Lock()
+
+    def add(self, seconds):
+        usec = int(seconds * 1000000)
+        idx  = min(usec.bit_length() if usec > 0 else 0, NB_BUCKETS - 1)
+
+        with self._lock:
+            self.buckets[idx] += 1
+            self.count        += 1
+            self.total        += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def percentile(self, pct, buckets = None, count = None):
+        """
+        Upper bound in seconds of the bucket holding the percentile.
+        """
+        if buckets is None:
+            (buckets, count) = (self.buckets, self.count)
+
+        if not count:
+            return 0.0
+
+        rank = count * pct / 100.0
+        seen = 0
+        for idx, nb in enumerate(buckets):
+            seen += nb
+            if seen >= rank:
+                return (1 << idx) / 1000000.0
+
+        return self.max
+
+    def get_stats(self):
+        with self._lock:
+            buckets = list(self.buckets)
+            count   = self.count
+            total   = self.total
+            xmax    = self.max
+
+        r = {'count': count,
+             'mean':  total / count if count else 0.0,
+             'max':   xmax}
+
+        for pct in PERCENTILES:
+            r["p%d" % pct] = min(self.percentile(pct, buckets, count), xmax)
+
+        return r
+
+
+class DWhoInotifyStats(object): # pylint: disable=useless-object-inheritance
+    """
+    Histograms of the event pipeline stages, keyed by cfg_path or by
+    plugin name.
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self._lock      = threading.Lock()
+
+    def observe(self, stage, key, seconds):
+        histogram = self.histograms.get((stage, key))
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault((stage, key), DWhoInotifyHistogram())
+
+        histogram.add(max(0.0, seconds))
+
+    def get_stats(self):
+        r = {}
+
+        with self._lock:
+            histograms = list(self.histograms.items())
+
+        for (stage, key), histogram in histograms:
+            r.setdefault(stage, {})[key] = histogram.get_stats()
+
+        return r
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
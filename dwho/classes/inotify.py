@@ -4,22 +4,67 @@
 """dwho.classes.inotify"""
 
 import copy
+import errno
 import glob
 import logging
 import os
 import sys
 import threading
+import time
 
 import pyinotify
 
-from six import ensure_str, iterkeys, iteritems, string_types, text_type
+from six import ensure_str, iteritems, string_types, text_type
 from six.moves import queue as _queue
 
 from sonicprobe import helpers
 from sonicprobe.libs.workerpool import WorkerPool
 
 from dwho.classes.errors import DWhoConfigurationError, DWhoInotifyError
-from dwho.classes.inoplugs import CACHE_EXPIRE, INOPLUGS, LOCK_TIMEOUT
+from dwho.classes.inobatch import DWhoInotifyBatcher
+from dwho.classes.inobudget import DWhoInotifyBudget, WATCH_BUDGET, get_watch_budget
+from dwho.classes.inocoalesce import COALESCE_MAX_DELAY, COALESCE_WINDOW, DWhoInotifyCoalescer
+from dwho.classes.inodedupe import DEDUPE_ALGORITHM, DEDUPE_CACHE_SIZE, FORGET_MASK, DWhoInotifyDedupe
+from dwho.classes.inoexclude import (DWhoInotifyExcludeFilter,
+                                     DWhoInotifyIncludeFilter,
+                                     DWhoInotifyWatchFilter,
+                                     glob_root)
+from dwho.classes.inojournal import (DWhoInotifyJournal,
+                                     JOURNAL_CHECKPOINT_INTERVAL,
+                                     JOURNAL_COMMIT_DELAY,
+                                     JOURNAL_MAX_PENDING,
+                                     JOURNAL_SEGMENT_SIZE)
+from dwho.classes.inolane import DWhoInotifyLanes, ORDERING, ORDERING_NONE, ORDERINGS
+from dwho.classes.inoplugs import CACHE_EXPIRE, INOPLUGS, LOCK_TIMEOUT, PLUGPOOL
+from dwho.classes.inopoll import (BACKEND_INOTIFY,
+                                  BACKEND_POLL,
+                                  BACKENDS,
+                                  DWhoInotifyPoller,
+                                  POLL_INTERVAL,
+                                  POLL_WORKERS)
+from dwho.classes.inoproc import DWhoInotifyProcessExecutor
+from dwho.classes.inoqueue import (DWhoInotifyDispatchQueue,
+                                   DWhoInotifyFairQueue,
+                                   QUEUE_POLICIES,
+                                   QUEUE_POLICY,
+                                   QUEUE_SIZE,
+                                   SCHEDULING,
+                                   SCHEDULING_FAIR,
+                                   SCHEDULINGS,
+                                   WEIGHT)
+from dwho.classes.inorate import DWhoInotifyRateLimiter, RATE_LIMIT, has_rate_limit
+from dwho.classes.inorename import DWhoInotifyRenamer, RENAME_WINDOW
+from dwho.classes.inosnapshot import DWhoInotifySnapshot, SYNC_INTERVAL, stat_key
+from dwho.classes.inostats import (DWhoInotifyStats,
+                                   STAGE_DISPATCH,
+                                   STAGE_LATENCY,
+                                   STAGE_PLUGIN,
+                                   STAGE_RUN,
+                                   STAGE_WAIT,
+                                   clock)
+from dwho.classes.inotrie import DWhoInotifyPathTrie
+from dwho.classes.inowalk import DWhoInotifyWalker, WALK_WORKERS
+from dwho.classes.inowatch import DWhoInotifyWatchTable
 
 LOG             = logging.getLogger('dwho.inotify')
 
@@ -27,9 +72,32 @@ DWHO_INOQ       = _queue.Queue()
 
 MODE_ADD        = 'MODE_ADD'
 MODE_REM        = 'MODE_REM'
+MODE_RESCAN     = 'MODE_RESCAN'
+MODE_RELOAD     = 'MODE_RELOAD'
+
+NOTIFIER_ASYNCIO    = 'asyncio'
+NOTIFIER_THREADED   = 'threaded'
+NOTIFIERS           = (NOTIFIER_ASYNCIO,
+                       NOTIFIER_THREADED)
 
 MAX_WORKERS     = 5
 
+# seconds stop waits for the workers to run the queued events
+STOP_TIMEOUT    = 10
+
+# maximum number of requests drained from DWHO_INOQ at once
+REQUEST_BATCH   = 1024
+
+# mtime granularity margin for rescans after an overflow
+RESCAN_MARGIN   = 2
+
+# synthetic event emitted on files found modified by a rescan,
+# the first one included in the cfg_path event mask is used
+RESCAN_EVENTS   = ('close_write',
+                   'create',
+                   'modify',
+                   'moved_to')
+
 ALL_EVENTS      = ('access',
                    'attrib',
                    'create',
@@ -55,20 +123,71 @@ DEFAULT_CONFIG  = {'plugins':   dict(zip(INOPLUGS.keys(),
 class DWhoInotifyCfgPath(object): # pylint: disable=useless-object-inheritance,too-few-public-methods
     def __init__(self,
                  path,
-                 event_mask     = 0,
-                 plugins        = None,
-                 do_glob        = False,
-                 exclude_filter = None):
-        self.path           = path
-        self.event_mask     = event_mask
-        self.plugins        = plugins
-        self.do_glob        = do_glob
-        self.exclude_filter = exclude_filter
+                 event_mask         = 0,
+                 plugins            = None,
+                 do_glob            = False,
+                 exclude_filter     = None,
+                 coalesce_window    = COALESCE_WINDOW,
+                 coalesce_max_delay = COALESCE_MAX_DELAY,
+                 shard              = None,
+                 backend            = BACKEND_INOTIFY,
+                 poll_interval      = None,
+                 dedupe             = False,
+                 rate_limit         = RATE_LIMIT,
+                 rate_burst         = None,
+                 weight             = WEIGHT,
+                 include_filter     = None):
+        self.path               = path
+        self.event_mask         = event_mask
+        self.plugins            = plugins
+        self.do_glob            = do_glob
+        self.exclude_filter     = exclude_filter
+        self.coalesce_window    = coalesce_window
+        self.coalesce_max_delay = coalesce_max_delay
+        self.shard              = shard
+        self.backend            = backend
+        self.poll_interval      = poll_interval
+        self.dedupe             = dedupe
+        self.rate_limit         = rate_limit
+        self.rate_burst         = rate_burst
+        self.weight             = weight
+        self.include_filter     = include_filter
+        self._watch_filter      = None
+
+    @property
+    def watch_filter(self):
+        """
+        Filter of the watched directories: exclude_filter, and the
+        directories pruned by include_filter.
+        """
+        if self.include_filter is None or not self.include_filter.dirs:
+            return self.exclude_filter
+
+        # the same instance is kept to share the watch profiles
+        watch_filter = self._watch_filter
+        if watch_filter is None \
+           or watch_filter.exclude_filter is not self.exclude_filter \
+           or watch_filter.include_filter is not self.include_filter:
+            watch_filter = self._watch_filter = DWhoInotifyWatchFilter(self.exclude_filter,
+                                                                      self.include_filter)
+
+        return watch_filter
+
+    def __getstate__(self):
+        # plugins are registered instances, only send their names
+        state = self.__dict__.copy()
+        state['plugins'] = [plugin.PLUGIN_NAME for plugin in self.plugins or ()]
+        state['_watch_filter'] = None
+        return state
+
+    def __setstate__(self, state):
+        state['plugins'] = [INOPLUGS[name] for name in state['plugins'] if name in INOPLUGS]
+        self.__dict__.update(state)
 
 
 class DWhoInotifyConfig(object): # pylint: disable=useless-object-inheritance
     @staticmethod
-    def load_exclude_patterns(exclude_files):
+    def load_exclude_patterns(exclude_files, path = None):
         r = set()
 
         if isinstance(exclude_files, string_types):
@@ -87,11 +206,23 @@ class DWhoInotifyConfig(object): # pylint: disable=useless-object-inheritance
             r.update(pattern)
 
         if r:
-            return pyinotify.ExcludeFilter(list(r))
+            return DWhoInotifyExcludeFilter(sorted(r),
+                                            glob_root(path) if path else None)
 
         return None
 
     def __call__(self, notifier, conf):
+        (conf, cfg_paths) = self.load(conf)
+
+        for cfg_path in cfg_paths:
+            notifier.add(cfg_path)
+
+        return conf
+
+    def load(self, conf):
+        """
+        Parse the inotify section, return it with its DWhoInotifyCfgPath list.
+        """
         if 'plugins' not in conf:
             conf['plugins'] = DEFAULT_CONFIG['plugins'].copy()
 
@@ -111,6 +242,10 @@ class DWhoInotifyConfig(object): # pylint: disable=useless-object-inheritance
         else:
             conf['exclude_files'] = []
 
+        for x, default in (('coalesce_window', COALESCE_WINDOW),
+                           ('coalesce_max_delay', COALESCE_MAX_DELAY)):
+            conf[x] = self.load_delay(x, conf.get(x, default))
+
         if 'paths' not in conf or not isinstance(conf['paths'], dict):
             raise DWhoConfigurationError("Missing paths configuration")
 
@@ -156,10 +291,59 @@ class DWhoInotifyConfig(object): # pylint: disable=useless-object-inheritance
                         value['exclude_files'].remove(exclude_file)
 
             if value['exclude_files']:
-                value['exclude_patterns'] = self.load_exclude_patterns(value['exclude_files'])
+                value['exclude_patterns'] = self.load_exclude_patterns(value['exclude_files'], path)
             else:
                 value['exclude_patterns'] = None
 
+            for x in ('include_files', 'include_dirs'):
+                value[x] = value.get(x, conf.get(x)) or []
+                if isinstance(value[x], string_types):
+                    value[x] = [value[x]]
+                elif not isinstance(value[x], list):
+                    raise DWhoConfigurationError("Invalid %s type. (%s: %r, path: %r)"
+                                                 % (x, x, value[x], path))
+
+            if value['include_files'] or value['include_dirs']:
+                value['include_patterns'] = DWhoInotifyIncludeFilter(path,
+                                                                     value['include_files'],
+                                                                     value['include_dirs'])
+            else:
+                value['include_patterns'] = None
+
+            for x in ('coalesce_window', 'coalesce_max_delay'):
+                value[x] = self.load_delay(x, value.get(x, conf[x]), path)
+
+            value['backend'] = value.get('backend') or conf.get('backend') or BACKEND_INOTIFY
+            if value['backend'] not in BACKENDS:
+                raise DWhoConfigurationError("Invalid backend: %r. (allowed: %r, path: %r)"
+                                             % (value['backend'], BACKENDS, path))
+
+            # the section poll_interval applies when unset
+            if value.get('poll_interval'):
+                value['poll_interval'] = self.load_delay('poll_interval', value['poll_interval'], path)
+            else:
+                value['poll_interval'] = None
+
+            value['dedupe'] = bool(value.get('dedupe', conf.get('dedupe', False)))
+
+            # the section rate_limit applies to every path on its own
+            for x in ('rate_limit', 'rate_burst'):
+                value[x] = self.load_delay(x, value.get(x, conf.get(x)), path) or None
+
+            value['weight'] = self.load_delay('weight', value.get('weight', conf.get('weight', WEIGHT)), path)
+            if not value['weight']:
+                raise DWhoConfigurationError("Invalid weight, must be greater than 0. (weight: %r, path: %r)"
+                                             % (value['weight'], path))
+
+            if value.get('shard') is not None:
+                try:
+                    value['shard'] = int(value['shard'])
+                except (TypeError, ValueError):
+                    raise DWhoConfigurationError("Invalid shard. (shard: %r, path: %r)"
+                                                 % (value['shard'], path))
+
+        cfg_paths = []
+
         for path, value in iteritems(conf['paths']):
             plugins = []
             if value['plugins']:
@@ -172,12 +356,37 @@ class DWhoInotifyConfig(object): # pylint: disable=useless-object-inheritance
             if not os.path.exists(path):
                 helpers.make_dirs(path)
 
-            notifier.add(DWhoInotifyCfgPath(path,
-                                            value['event_masks'],
-                                            plugins,
-                                            value.get('glob'),
-                                            value['exclude_patterns']))
-        return conf
+            cfg_paths.append(DWhoInotifyCfgPath(path,
+                                                value['event_masks'],
+                                                plugins,
+                                                value.get('glob'),
+                                                value['exclude_patterns'],
+                                                value['coalesce_window'],
+                                                value['coalesce_max_delay'],
+                                                value.get('shard'),
+                                                value['backend'],
+                                                value['poll_interval'],
+                                                value['dedupe'],
+                                                value['rate_limit'],
+                                                value['rate_burst'],
+                                                value['weight'],
+                                                value['include_patterns']))
+
+        return (conf, cfg_paths)
+
+    @staticmethod
+    def load_delay(name, value, path = None):
+        try:
+            value = float(value or 0)
+        except (TypeError, ValueError):
+            raise DWhoConfigurationError("Invalid %s. (%s: %r, path: %r)"
+                                         % (name, name, value, path))
+
+        if value < 0:
+            raise DWhoConfigurationError("Invalid %s, must be positive. (%s: %r, path: %r)"
+                                         % (name, name, value, path))
+
+        return value
 
     @staticmethod
     def valid_event(event):
@@ -185,8 +394,62 @@ class DWhoInotifyConfig(object): # pylint: disable=useless-object-inheritance
 
 
 class DWhoInotifyWatchManager(pyinotify.WatchManager):
-    def __init__(self, exclude_filter=lambda path: False):
+    def __init__(self, exclude_filter=lambda path: False, walk_workers=1):
         pyinotify.WatchManager.__init__(self, exclude_filter)
+        self.walk_workers   = walk_workers
+        self.scan_progress  = {}
+
+        # compact wd -> watch storage, paths are built on demand
+        self._wmd           = DWhoInotifyWatchTable()
+
+        # paths which couldn't be watched for lack of watches
+        self._index_lock    = threading.RLock()
+        self._failed        = []
+        self._failed_set    = set()
+
+    def move_subtree(self, src, dst):
+        """
+        Rename the watch of src to dst, the watches under it follow.
+        """
+        wd = self.get_wd(src)
+        if wd is None:
+            return 0
+
+        return self._wmd.move(wd, self.__format_path(dst))
+
+    def get_children(self, wd):
+        return self._wmd.get_children(wd)
+
+    def get_paths(self):
+        """
+        Return the (wd, path) of every watch.
+        """
+        return self._wmd.paths()
+
+    def pop_failed(self):
+        with self._index_lock:
+            r                 = self._failed
+            self._failed      = []
+            self._failed_set  = set()
+            return r
+
+    def get_wd(self, path):
+        """
+        Returns the watch descriptor associated to path, None if the
+        path is unknown.
+        """
+        return self._wmd.get_wd(self.__format_path(path))
+
+    def get_path(self, wd):
+        return self._wmd.get_path(wd)
+
+    def del_watch(self, wd):
+        if not self._wmd.remove(wd):
+            LOG.error("Cannot delete unknown watch descriptor %r", wd)
+
+    def __walk_progress(self, top, scanned):
+        self.scan_progress[top] = scanned
+        LOG.info("Scanning. (path: %r, directories: %r)", top, scanned)
 
     def __format_path(self, path):
         """
@@ -213,10 +476,9 @@ class DWhoInotifyWatchManager(pyinotify.WatchManager):
         wd = self._inotify_wrapper.inotify_add_watch(self._fd, path, mask)
         if wd < 0:
             return wd
-        watch = pyinotify.Watch(wd=wd, path=path, mask=mask, proc_fun=proc_fun,
-                                auto_add=auto_add, exclude_filter=exclude_filter)
-        self._wmd[wd] = watch
-        LOG.debug('Added watch on path: %r', watch)
+        self._wmd.add(wd, path, mask, proc_fun, auto_add, exclude_filter,
+                      os.path.isdir(path))
+        LOG.debug('Added watch on path: %r (wd: %r)', path, wd)
         return wd
 
     def __glob(self, path, do_glob):
@@ -281,65 +543,144 @@ class DWhoInotifyWatchManager(pyinotify.WatchManager):
         if exclude_filter is None:
             exclude_filter = self._exclude_filter
 
+        def add(rpath):
+            self.__add_one(ret_, rpath, mask, proc_fun, auto_add, exclude_filter, quiet)
+
         # normalize args as list elements
         for npath in self.__format_param(path):
             # unix pathname pattern expansion
             for apath in self.__glob(npath, do_glob):
+                if rec \
+                   and self.walk_workers > 1 \
+                   and not exclude_filter(apath) \
+                   and not os.path.islink(apath) \
+                   and os.path.isdir(apath):
+                    self.__walk_parallel(apath, add, exclude_filter, ret_)
+                    continue
+
                 # recursively list subdirs according to rec param
                 for rpath in self.__walk_rec(apath, rec, exclude_filter):
                     if not exclude_filter(rpath):
-                        wd = ret_[rpath] = self.__add_watch(rpath, mask,
-                                                            proc_fun,
-                                                            auto_add,
-                                                            exclude_filter)
-                        if wd < 0:
-                            err = ('add_watch: cannot watch %s WD=%d, %s' % \
-                                       (rpath, wd,
-                                        self._inotify_wrapper.str_errno()))
-                            if quiet:
-                                LOG.error(err)
-                            else:
-                                raise pyinotify.WatchManagerError(err, ret_)
+                        add(rpath)
                     else:
                         # Let's say -2 means 'explicitely excluded
                         # from watching'.
                         ret_[rpath] = -2
         return ret_
 
+    def __add_one(self, ret_, rpath, mask, proc_fun, auto_add, exclude_filter, quiet):
+        wd = ret_[rpath] = self.__add_watch(rpath, mask,
+                                            proc_fun,
+                                            auto_add,
+                                            exclude_filter)
+        if wd < 0:
+            if self._inotify_wrapper.get_errno() == errno.ENOSPC:
+                with self._index_lock:
+                    # subdirectories of a failed path are implied
+                    if os.path.dirname(rpath) not in self._failed_set:
+                        self._failed.append(rpath)
+                    self._failed_set.add(rpath)
+            err = ('add_watch: cannot watch %s WD=%d, %s' % \
+                       (rpath, wd,
+                        self._inotify_wrapper.str_errno()))
+            if quiet:
+                LOG.error(err)
+            else:
+                raise pyinotify.WatchManagerError(err, ret_)
+
+    def add_watch_tree(self, top, resolve, quiet=True):
+        """
+        Add watches on top and on its subdirectories in a single walk,
+        the mask, auto_add flag and exclude filter of each directory
+        being returned by resolve(path).
+
+        @param top: Path of the tree.
+        @type top: string
+        @param resolve: function returning (mask, auto_add, exclude_filter)
+                        of a path.
+        @type resolve: callable object
+        @return: dict of paths associated to watch descriptors, as
+                 add_watch.
+        @rtype: dict of {str: int}
+        """
+        ret_ = {} # return {path: wd, ...}
+        top  = self.__format_path(top)
+
+        def exclude(path):
+            exclude_filter = resolve(path)[2]
+            return bool(exclude_filter and exclude_filter(path))
+
+        def add(rpath):
+            (mask, auto_add, exclude_filter) = resolve(rpath)
+            self.__add_one(ret_, rpath, mask, None, auto_add,
+                           exclude_filter or self._exclude_filter, quiet)
+
+        if exclude(top):
+            ret_[top] = -2
+        elif os.path.islink(top) or not os.path.isdir(top):
+            add(top)
+        else:
+            self.__walk_parallel(top, add, exclude, ret_)
+
+        return ret_
+
+    def __walk_parallel(self, top, add, exclude_filter, ret_):
+        walker = DWhoInotifyWalker(self.walk_workers,
+                                   exclude_filter,
+                                   self.__walk_progress)
+        try:
+            walker.walk(top, add)
+        finally:
+            self.scan_progress.pop(top, None)
+            for xpath in walker.excluded:
+                ret_[xpath] = -2
+
     def __get_sub_rec(self, lpath):
         """
-        Get every wd from self._wmd if its path is under the path of
-        one (at least) of those in lpath. Doesn't follow symlinks.
+        Get every wd under the path of one (at least) of those in lpath,
+        from the children index. Doesn't follow symlinks.
 
         @param lpath: list of watch descriptor
         @type lpath: list of int
         @return: list of watch descriptor
         @rtype: list of int
         """
-        for d in lpath:
-            root = self.get_path(d)
-            if root is not None:
-                # always keep root
-                yield d
-            else:
-                # if invalid
-                continue
+        return self._wmd.get_subtree(lpath)
 
-            # nothing else to expect
-            if not os.path.isdir(root):
-                continue
+    def rm_watch(self, wd, rec=False, quiet=True):
+        """
+        Removes watch(s), see pyinotify.WatchManager.rm_watch. Recursive
+        removal only costs the size of the removed subtrees.
+        """
+        lwd = list(self.__format_param(wd))
+        if rec:
+            lwd = self.__get_sub_rec(lwd)
+
+        ret_ = {} # return {wd: bool, ...}
+        for awd in lwd:
+            wd_ = self._inotify_wrapper.inotify_rm_watch(self._fd, awd)
+            if wd_ < 0:
+                ret_[awd] = False
+                err = ('rm_watch: cannot remove WD=%d, %s' % \
+                           (awd, self._inotify_wrapper.str_errno()))
+                if quiet:
+                    LOG.error(err)
+                    continue
+                raise pyinotify.WatchManagerError(err, ret_)
+
+            self._wmd.remove(awd)
+            ret_[awd] = True
+            LOG.debug('Watch WD=%d removed', awd)
+        return ret_
 
-            # normalization
-            root = os.path.normpath(root)
-            # recursion
-            lend = len(root)
-            for iwd in self._wmd.items():
-                cur = iwd[1].path
-                pref = os.path.commonprefix([root, cur])
-                if root == os.sep or (len(pref) == lend and \
-                                      len(cur) > lend and \
-                                      cur[lend] == os.sep):
-                    yield iwd[1].wd
+    def update_watch(self, wd, mask=None, proc_fun=None, rec=False,
+                     auto_add=False, quiet=True):
+        lwd = list(self.__format_param(wd))
+        if rec:
+            lwd = self.__get_sub_rec(lwd)
+
+        return pyinotify.WatchManager.update_watch(self, lwd, mask, proc_fun,
+                                                   False, auto_add, quiet)
 
     def __format_param(self, param):
         """
@@ -364,27 +705,196 @@ class DWhoInotifyWatchManager(pyinotify.WatchManager):
                 yield root
 
 
+class DWhoInotifySysProcessEvent(pyinotify._SysProcessEvent): # pylint: disable=protected-access
+    """
+    Rename the watches of a moved directory when its IN_MOVED_TO is
+    read, from the watch manager index, rather than on IN_MOVE_SELF by
+    going through every watch: paths are right for the events which
+    follow even if move_self isn't in the event mask. With moved_out,
+    the directories moved out of the watched trees keep their path until
+    the rename window expires and they are unwatched.
+    """
+
+    def __init__(self, wm, notifier, moved_out = False):
+        pyinotify._SysProcessEvent.__init__(self, wm, notifier) # pylint: disable=protected-access
+        self.moved_out = moved_out
+        # wd -> time of the directories already renamed
+        self._moved = {}
+
+    def process_IN_MOVED_TO(self, raw_event): # pylint: disable=invalid-name
+        mv_   = self._mv_cookie.get(raw_event.cookie)
+        event = pyinotify._SysProcessEvent.process_IN_MOVED_TO(self, raw_event) # pylint: disable=protected-access
+
+        if mv_ is None or not raw_event.mask & pyinotify.IN_ISDIR: # pylint: disable=no-member
+            return event
+
+        wm  = self._watch_manager
+        src = mv_[0]
+        wd  = wm.get_wd(src)
+
+        if wd is not None:
+            wm.move_subtree(src, event.pathname)
+            self._moved[wd] = time.time()
+            self._mv.pop(src, None)
+            return event
+
+        # its watches have been removed meanwhile, e.g. rename window expired
+        watch_ = wm.get_watch(raw_event.wd)
+        if watch_ and watch_.auto_add and not watch_.exclude_filter(event.pathname):
+            wm.add_watch(event.pathname,
+                         watch_.mask,
+                         proc_fun       = watch_.proc_fun,
+                         rec            = True,
+                         auto_add       = True,
+                         exclude_filter = watch_.exclude_filter)
+
+        return event
+
+    def process_IN_MOVE_SELF(self, raw_event): # pylint: disable=invalid-name
+        if self._moved.pop(raw_event.wd, None) is not None:
+            return self.process_default(raw_event)
+
+        # the watches under the moved one follow, no need to go through
+        # every watch as pyinotify does
+        wm  = self._watch_manager
+        mv_ = self._mv.get(wm.get_path(raw_event.wd))
+        if mv_:
+            wm.get_watch(raw_event.wd).path = mv_[0]
+            return self.process_default(raw_event)
+
+        # IN_MOVED_FROM pending, unwatched by its path on expiry
+        if self.moved_out and self.is_moving(wm.get_path(raw_event.wd)):
+            return self.process_default(raw_event)
+
+        return pyinotify._SysProcessEvent.process_IN_MOVE_SELF(self, raw_event) # pylint: disable=protected-access
+
+    def is_moving(self, path):
+        for mv_ in self._mv_cookie.values():
+            if mv_[0] == path:
+                return True
+
+        return False
+
+    def cleanup(self):
+        pyinotify._SysProcessEvent.cleanup(self) # pylint: disable=protected-access
+
+        limit = time.time() - 60
+        for wd, moved in list(self._moved.items()):
+            if moved < limit:
+                del self._moved[wd]
+
+
 class DWhoInotify(threading.Thread):
     def __init__(self):
         threading.Thread.__init__(self)
 
         self.config      = None
         self.killed      = False
-        self.cfg_paths   = {}
+        self.cfg_paths   = DWhoInotifyPathTrie()
+        self.cfg_items   = {}
+        self.cfg_roots   = {}
+        self.coalescer   = None
+        self.dedupe      = None
+        self.executor    = None
+        self.handler     = None
+        self.journal     = None
+        self.limiter     = None
         self.name        = 'inotify'
         self.notifier    = None
+        self.overflows   = 0
+        self.rescans     = {}
+        self.rescan_lock = threading.Lock()
+        self.renamer     = None
+        self.replay      = None
+        self.batcher     = None
+        self.budget      = None
+        self.poller      = None
+        self.snapshot    = None
+        self.stats       = None
+        self.max_watches = None
+        self.stop_wait   = STOP_TIMEOUT
         self.wm          = None
         self.workerpool  = None
         self.scan_event  = threading.Event()
 
     def init(self, config):
         self.config     = config
-        self.workerpool = WorkerPool(max_workers = helpers.get_nb_workers(config['inotify'].get('max_workers'),
-                                                                          xmin    = 1,
-                                                                          default = MAX_WORKERS),
-                                     life_time   = config['inotify'].get('worker_lifetime'),
-                                     name        = 'inoworker',
-                                     max_tasks   = config['inotify'].get('max_tasks'))
+
+        queue_policy    = config['inotify'].get('queue_policy') or QUEUE_POLICY
+        if queue_policy not in QUEUE_POLICIES:
+            raise DWhoConfigurationError("Invalid queue_policy: %r. (allowed: %r)"
+                                         % (queue_policy, QUEUE_POLICIES))
+
+        ordering        = config['inotify'].get('ordering') or ORDERING
+        if ordering not in ORDERINGS:
+            raise DWhoConfigurationError("Invalid ordering: %r. (allowed: %r)"
+                                         % (ordering, ORDERINGS))
+
+        scheduling      = config['inotify'].get('scheduling') or SCHEDULING
+        if scheduling not in SCHEDULINGS:
+            raise DWhoConfigurationError("Invalid scheduling: %r. (allowed: %r)"
+                                         % (scheduling, SCHEDULINGS))
+
+        if scheduling == SCHEDULING_FAIR:
+            queue_class = DWhoInotifyFairQueue
+        else:
+            queue_class = DWhoInotifyDispatchQueue
+
+        queue_size      = int(config['inotify'].get('queue_size') or QUEUE_SIZE)
+        max_workers     = helpers.get_nb_workers(config['inotify'].get('max_workers'),
+                                                 xmin    = 1,
+                                                 default = MAX_WORKERS)
+
+        if ordering != ORDERING_NONE:
+            self.workerpool = DWhoInotifyLanes(max_workers,
+                                               queue_size,
+                                               queue_policy,
+                                               ordering    = ordering,
+                                               life_time   = config['inotify'].get('worker_lifetime'),
+                                               name        = 'inoworker',
+                                               max_tasks   = config['inotify'].get('max_tasks'),
+                                               queue_class = queue_class)
+        else:
+            self.workerpool = WorkerPool(queue       = queue_class(queue_size, queue_policy),
+                                         max_workers = max_workers,
+                                         life_time   = config['inotify'].get('worker_lifetime'),
+                                         name        = 'inoworker',
+                                         max_tasks   = config['inotify'].get('max_tasks'))
+
+        self.rename_window = DWhoInotifyConfig.load_delay('rename_window',
+                                                          config['inotify'].get('rename_window', RENAME_WINDOW))
+
+        self.stop_wait     = DWhoInotifyConfig.load_delay('stop_timeout',
+                                                          config['inotify'].get('stop_timeout', STOP_TIMEOUT))
+
+        if config['inotify'].get('stats', True):
+            self.stats  = DWhoInotifyStats()
+
+        self.max_watches = get_watch_budget(config['inotify'].get('watch_budget', WATCH_BUDGET),
+                                            int(config['inotify'].get('shards') or 1))
+
+        if [x for x in config['inotify'].get('paths', {}).values() if x.get('dedupe')]:
+            self.dedupe = DWhoInotifyDedupe(config['inotify'].get('dedupe_cache_size') or DEDUPE_CACHE_SIZE,
+                                            config['inotify'].get('dedupe_file'),
+                                            config['inotify'].get('dedupe_algorithm') or DEDUPE_ALGORITHM).load()
+
+        if config['inotify'].get('snapshot_file'):
+            self.snapshot = DWhoInotifySnapshot(config['inotify']['snapshot_file'],
+                                                float(config['inotify'].get('snapshot_sync_interval')
+                                                      or SYNC_INTERVAL)).load()
+
+        if config['inotify'].get('journal_dir'):
+            self.journal = DWhoInotifyJournal(config['inotify']['journal_dir'],
+                                              self.workerpool.run,
+                                              config['inotify'].get('journal_segment_size')
+                                              or JOURNAL_SEGMENT_SIZE,
+                                              config['inotify'].get('journal_max_pending')
+                                              or JOURNAL_MAX_PENDING,
+                                              config['inotify'].get('journal_checkpoint_interval')
+                                              or JOURNAL_CHECKPOINT_INTERVAL,
+                                              config['inotify'].get('journal_commit_delay',
+                                                                    JOURNAL_COMMIT_DELAY))
+            self.replay  = self.journal.load()
 
         return self
 
@@ -396,6 +906,130 @@ class DWhoInotify(threading.Thread):
     def rem(cfg_path):
         DWHO_INOQ.put((MODE_REM, cfg_path))
 
+    def submit_request(self, mode, cfg_path): # pylint: disable=no-self-use
+        DWHO_INOQ.put((mode, cfg_path))
+
+    def reload(self, conf):
+        """
+        Parse the inotify section conf and queue its differences with
+        the current configuration. Raise DWhoConfigurationError if conf
+        is invalid, the current configuration is then kept.
+        """
+        (conf, cfg_paths) = DWhoInotifyConfig().load(conf)
+        self.submit_request(MODE_RELOAD, (conf, cfg_paths))
+
+        return len(cfg_paths)
+
+    def process_request(self, mode, cfg_path):
+        if mode == MODE_ADD:
+            self.__add_watch(cfg_path)
+        elif mode == MODE_REM:
+            self.__rem_watch(cfg_path)
+        elif mode == MODE_RESCAN:
+            self.__rescan(cfg_path)
+        elif mode == MODE_RELOAD:
+            self.__reload(*cfg_path)
+        else:
+            raise DWhoInotifyError("Invalid mode: %r" % mode)
+
+    def process_requests(self, requests):
+        """
+        Process a batch of (mode, cfg_path) requests in order,
+        consecutive additions are watched with a single walk.
+        """
+        adds = []
+
+        for mode, cfg_path in requests:
+            if mode == MODE_ADD:
+                adds.append(cfg_path)
+                continue
+
+            if adds:
+                self.__add_watches(adds)
+                adds = []
+
+            self.process_request(mode, cfg_path)
+
+        if adds:
+            self.__add_watches(adds)
+
+    def rescan(self, cfg_path, since = None):
+        with self.rescan_lock:
+            if cfg_path.path in self.rescans:
+                prev = self.rescans[cfg_path.path]
+                if prev is not None and (since is None or since < prev):
+                    self.rescans[cfg_path.path] = since
+                return
+            self.rescans[cfg_path.path] = since
+
+        self.submit_request(MODE_RESCAN, cfg_path)
+
+    def overflow(self, since = None):
+        self.overflows += 1
+
+        cfg_paths = set()
+        for cfg_path in list(self.cfg_paths.values()):
+            if cfg_path not in cfg_paths:
+                cfg_paths.add(cfg_path)
+                self.rescan(cfg_path, since)
+
+    def get_queue_stats(self):
+        r = {'overflows': self.overflows,
+             'rescans':   len(self.rescans)}
+
+        if hasattr(self.workerpool, 'stats'):
+            r.update(self.workerpool.stats())
+        elif self.workerpool and hasattr(self.workerpool.tasks, 'stats'):
+            r.update(self.workerpool.tasks.stats())
+
+        if self.coalescer:
+            r['coalescer'] = {'pending': self.coalescer.pending(),
+                              'merged':  self.coalescer.merged}
+
+        if self.batcher:
+            r['batcher'] = {'pending': self.batcher.pending()}
+
+        if self.renamer:
+            r['renamer'] = {'pending': self.renamer.pending(),
+                            'paired':  self.renamer.paired}
+
+        if self.dedupe is not None:
+            r['dedupe'] = self.dedupe.get_stats()
+
+        if self.limiter is not None:
+            r['rate'] = self.limiter.get_stats()
+
+        if self.journal is not None:
+            r['journal'] = self.journal.get_stats()
+
+        return r
+
+    def get_stats(self):
+        r = {'queue':      self.get_queue_stats(),
+             'scan':       self.get_scan_progress(),
+             'watches':    len(self.wm.watches) if self.wm else 0,
+             'workers':    {},
+             'histograms': {}}
+
+        if self.workerpool:
+            r['workers'] = {'workers': self.workerpool.count_workers(),
+                            'working': self.workerpool.count_working()}
+
+        if self.stats:
+            r['histograms'] = self.stats.get_stats()
+
+        if self.wm:
+            r['watch_table'] = self.wm.watches.get_stats()
+
+        if self.poller:
+            r['poll'] = {'units': len(self.poller.units),
+                         'dirs':  self.poller.count_dirs()}
+
+        if self.budget:
+            r['budget'] = self.budget.get_stats()
+
+        return r
+
     def is_scanning(self):
         return self.scan_event.is_set() is not True
 
@@ -422,28 +1056,233 @@ class DWhoInotify(threading.Thread):
         return DWhoInotify.get_flag_value(name) is not None
 
     def get_cfg_path(self, path):
-        if path in self.cfg_paths:
-            LOG.debug("path: %r, wd_path: %r, common: %r",
-                      path,
-                      path.rstrip(os.sep),
-                      os.path.commonprefix([path, path]))
-            return self.cfg_paths[path]
+        return self.cfg_paths.longest_prefix_value(path)
 
-        try:
-            cfg_paths = self.cfg_paths.copy()
-            for wd_path in iterkeys(cfg_paths):
-                if os.path.commonprefix([path, wd_path]) == wd_path.rstrip(os.sep):
-                    LOG.debug("path: %r, wd_path: %r, common: %r",
-                              path,
-                              wd_path.rstrip(os.sep),
-                              os.path.commonprefix([path, wd_path]))
-                    return self.cfg_paths[wd_path]
-        finally:
-            cfg_paths = None
+    def move_roots(self, src, dst):
+        """
+        Follow the cfg_path roots moved with the directory src.
+        """
+        for root, cfg_path in list(self.cfg_paths.items(src)):
+            xroot = dst + root[len(src):]
+            del self.cfg_paths[root]
+            self.cfg_paths[xroot] = cfg_path
 
-        return None
+            roots = self.cfg_roots.get(cfg_path.path)
+            if roots is not None and root in roots:
+                roots.discard(root)
+                roots.add(xroot)
+
+            LOG.info("Root moved. (path: %r, src: %r, dst: %r)", cfg_path.path, root, xroot)
+
+    def moved_out(self, path):
+        """
+        Unwatch the directory path moved out of the watched trees, its
+        watches would report events under its former path.
+        """
+        wd = self.wm.get_wd(path)
+        if wd is not None:
+            LOG.info("Directory moved out, unwatched. (path: %r)", path)
+            self.wm.rm_watch(wd, rec = True)
+
+        for root, cfg_path in list(self.cfg_paths.items(path)):
+            del self.cfg_paths[root]
+            roots = self.cfg_roots.get(cfg_path.path)
+            if roots is not None:
+                roots.discard(root)
+
+    @staticmethod
+    def need_rewatch(old, new):
+        # include_dirs change the watched directories
+        return old.do_glob != new.do_glob \
+            or old.backend != new.backend \
+            or old.shard != new.shard \
+            or getattr(old.include_filter, 'patterns', None) != getattr(new.include_filter, 'patterns', None)
+
+    def __get_cfg_wds(self, cfg_path):
+        """
+        Return the wds under the cfg_path roots, nested cfg_paths excluded.
+        """
+        r     = []
+        stack = [x for x in [self.wm.get_wd(root) for root in self.cfg_roots.get(cfg_path.path, ())]
+                 if x is not None]
+
+        while stack:
+            wd   = stack.pop()
+            path = self.wm.get_path(wd)
+            if path is None:
+                continue
+            owner = self.cfg_paths.get(path)
+            if owner is not None and owner is not cfg_path:
+                continue
+            r.append(wd)
+            stack.extend(self.wm.get_children(wd))
+
+        return r
+
+    def __update_cfg_path(self, old, new):
+        """
+        Apply the options of new to old in place, without walking the
+        trees unless exclude patterns were removed.
+        """
+        updated = []
+
+        if old.event_mask != new.event_mask:
+            updated.append('events')
+            old.event_mask = new.event_mask
+            if old.backend != BACKEND_POLL:
+                # as added by add_watch with auto_add, watch.mask is
+                # inherited by the new subdirectories
+                mask = new.event_mask | pyinotify.IN_CREATE # pylint: disable=no-member
+                wds  = self.__get_cfg_wds(old)
+                if wds:
+                    self.wm.update_watch(wds, mask = mask, auto_add = True)
+                for wd in wds:
+                    watch = self.wm.watches.get(wd)
+                    if watch is not None:
+                        watch.mask = mask
+
+        old_patterns = set(getattr(old.exclude_filter, 'patterns', None) or ())
+        new_patterns = set(getattr(new.exclude_filter, 'patterns', None) or ())
+
+        if old_patterns != new_patterns:
+            updated.append('exclude')
+            old.exclude_filter = new.exclude_filter
+            if old.backend != BACKEND_POLL:
+                self.__update_exclude(old, old_patterns - new_patterns)
+
+        for attr in ('plugins',
+                     'coalesce_window',
+                     'coalesce_max_delay',
+                     'dedupe',
+                     'poll_interval',
+                     'rate_limit',
+                     'rate_burst',
+                     'weight'):
+            if getattr(old, attr) != getattr(new, attr):
+                updated.append(attr)
+                setattr(old, attr, getattr(new, attr))
+
+        if 'poll_interval' in updated:
+            for root in self.cfg_roots.get(old.path, ()):
+                unit = self.poller.get(root)
+                if unit is not None:
+                    unit.interval = old.poll_interval or self.poller.interval
+
+        if updated:
+            LOG.info("Watch updated. (path: %r, options: %r)", old.path, updated)
+
+        return updated
+
+    def __update_exclude(self, cfg_path, removed):
+        exclude_filter = cfg_path.watch_filter or (lambda path: False)
+        roots          = self.cfg_roots.get(cfg_path.path, ())
+        nb             = 0
+
+        for wd in self.__get_cfg_wds(cfg_path):
+            watch = self.wm.watches.get(wd)
+            if watch is None:
+                # removed with an excluded parent
+                continue
+            if watch.path not in roots and exclude_filter(watch.path):
+                nb += len(self.wm.rm_watch(wd, rec = True))
+                continue
+            watch.exclude_filter = exclude_filter
+
+        if nb:
+            LOG.info("Excluded directories unwatched. (path: %r, watches: %r)", cfg_path.path, nb)
+
+        if not removed:
+            return
+
+        # directories excluded so far aren't known, watched ones are kept
+        for root in list(roots):
+            self.wm.add_watch(root,
+                              cfg_path.event_mask,
+                              rec            = True,
+                              auto_add       = True,
+                              quiet          = True,
+                              exclude_filter = exclude_filter)
+
+    def __reload(self, conf, cfg_paths):
+        start   = clock()
+        new     = dict([(x.path, x) for x in cfg_paths])
+        changes = {'added':     [],
+                   'removed':   [],
+                   'rewatched': [],
+                   'updated':   []}
+
+        if self.config is not None:
+            # plugins keep a reference to the paths options
+            paths = self.config['inotify'].setdefault('paths', {})
+            paths.clear()
+            paths.update(conf['paths'])
+
+        for path in list(self.cfg_items.keys()):
+            if path not in new:
+                self.__rem_watch(self.cfg_items[path])
+                changes['removed'].append(path)
+
+        if self.dedupe is None and [x for x in cfg_paths if x.dedupe]:
+            self.dedupe = DWhoInotifyDedupe(conf.get('dedupe_cache_size') or DEDUPE_CACHE_SIZE,
+                                            conf.get('dedupe_file'),
+                                            conf.get('dedupe_algorithm') or DEDUPE_ALGORITHM).load()
+
+        if self.limiter is None and self.handler and [x for x in cfg_paths if x.rate_limit]:
+            self.init_limiter()
+
+        adds = []
+        for path, cfg_path in iteritems(new):
+            old = self.cfg_items.get(path)
+            if old is None:
+                adds.append(cfg_path)
+                changes['added'].append(path)
+            elif self.need_rewatch(old, cfg_path):
+                self.__rem_watch(old)
+                adds.append(cfg_path)
+                changes['rewatched'].append(path)
+            elif self.__update_cfg_path(old, cfg_path):
+                changes['updated'].append(path)
+
+        if adds:
+            self.__add_watches(adds)
+
+        LOG.info("Configuration reloaded. (duration: %.3fs, changes: %r)", clock() - start, changes)
+
+        return changes
+
+    def __add_poll(self, cfg_path):
+        LOG.info("Add poll. (path: %r, mask: %r, plugins: %r, glob: %r, interval: %r)",
+                 cfg_path.path,
+                 cfg_path.event_mask,
+                 cfg_path.plugins,
+                 cfg_path.do_glob,
+                 cfg_path.poll_interval or self.poller.interval)
+
+        if cfg_path.do_glob:
+            paths = sorted(glob.glob(cfg_path.path))
+        else:
+            paths = [cfg_path.path]
+
+        self.cfg_items[cfg_path.path] = cfg_path
+
+        roots = self.cfg_roots.setdefault(cfg_path.path, set())
+        for path in paths:
+            path = os.path.normpath(path)
+            if not os.path.isdir(path) \
+               or (cfg_path.watch_filter and cfg_path.watch_filter(path)):
+                LOG.debug("Path excluded or not a directory. (path: %r)", path)
+                continue
+
+            self.cfg_paths[path] = cfg_path
+            roots.add(path)
+            if path not in self.poller:
+                self.poller.add(cfg_path, path, cfg_path.poll_interval)
 
     def __add_watch(self, cfg_path):
+        if cfg_path.backend == BACKEND_POLL:
+            self.__add_poll(cfg_path)
+            return
+
         LOG.info("Add watch. (path: %r, mask: %r, plugins: %r, glob: %r)",
                  cfg_path.path,
                  cfg_path.event_mask,
@@ -451,28 +1290,139 @@ class DWhoInotify(threading.Thread):
                  cfg_path.do_glob)
 
         try:
+            # with a watch budget, subtrees which can't be watched are polled
             wdd = self.wm.add_watch(cfg_path.path,
                                     cfg_path.event_mask,
                                     rec             = True,
                                     auto_add        = True,
-                                    quiet           = False,
+                                    quiet           = self.budget is not None,
                                     do_glob         = cfg_path.do_glob,
-                                    exclude_filter  = cfg_path.exclude_filter)
+                                    exclude_filter  = cfg_path.watch_filter)
 
+            watched = set()
+            failed  = set()
             for wpath, wcode in iteritems(wdd):
                 if wcode == -2:
                     LOG.debug("Path excluded. (path: %r, code: %r)", wpath, wcode)
                 elif wcode < 0:
                     LOG.error("Unable to monitor. (path: %r, code: %r)", wpath, wcode)
+                    failed.add(wpath)
                 else:
+                    watched.add(wpath)
+
+            self.cfg_items[cfg_path.path] = cfg_path
+
+            # only roots are indexed, subdirectories are resolved
+            # by longest prefix in get_cfg_path
+            roots = self.cfg_roots.setdefault(cfg_path.path, set())
+            for wpath in watched:
+                if os.path.dirname(wpath) not in watched \
+                   or os.path.dirname(wpath) == wpath:
                     self.cfg_paths[wpath] = cfg_path
+                    roots.add(wpath)
+
+            if self.budget is not None:
+                # failed roots are polled, failed subdirectories of watched
+                # roots are demoted by the budget manager
+                for fpath in failed:
+                    if os.path.dirname(fpath) not in watched \
+                       and os.path.dirname(fpath) not in failed:
+                        self.cfg_paths[fpath] = cfg_path
+                        roots.add(fpath)
+                        if fpath not in self.poller:
+                            self.poller.add(cfg_path, fpath)
+
+            if self.snapshot is not None:
+                self.__catch_up(cfg_path)
         except pyinotify.WatchManagerError as e:
             LOG.exception("Unable to monitor. (path: %r, reason: %r)", cfg_path.path, e)
         finally:
             wdd = None
 
+    def __add_watches(self, cfg_paths):
+        """
+        Watch several cfg_paths with one walk per outermost root instead
+        of one walk per cfg_path, every directory getting the mask and
+        the exclude filter of its most specific cfg_path.
+        """
+        xcfg_paths = []
+        for cfg_path in cfg_paths:
+            if cfg_path.backend == BACKEND_POLL:
+                self.__add_poll(cfg_path)
+            else:
+                xcfg_paths.append(cfg_path)
+
+        if len(xcfg_paths) < 2:
+            for cfg_path in xcfg_paths:
+                self.__add_watch(cfg_path)
+            return
+
+        start = clock()
+        batch = DWhoInotifyPathTrie()
+        roots = []
+
+        for cfg_path in xcfg_paths:
+            LOG.info("Add watch. (path: %r, mask: %r, plugins: %r, glob: %r)",
+                     cfg_path.path,
+                     cfg_path.event_mask,
+                     cfg_path.plugins,
+                     cfg_path.do_glob)
+
+            if cfg_path.do_glob:
+                paths = sorted(glob.glob(cfg_path.path))
+            else:
+                paths = [cfg_path.path]
+
+            paths = [os.path.normpath(x) for x in paths]
+            roots.append((cfg_path, paths))
+            for path in paths:
+                batch[path] = cfg_path
+
+        def resolve(path):
+            (key, cfg_path)   = batch.longest_prefix(path)
+            (xkey, xcfg_path) = self.cfg_paths.longest_prefix(path)
+            if xkey is not None and (key is None or len(xkey) > len(key)):
+                cfg_path = xcfg_path
+            return (cfg_path.event_mask, True, cfg_path.watch_filter)
+
+        wdd = {}
+        # parents sort before their subdirectories, nested roots are
+        # already walked unless an exclude filter pruned them
+        for path in sorted(batch):
+            if path not in wdd:
+                wdd.update(self.wm.add_watch_tree(path, resolve))
+
+        for wpath, wcode in iteritems(wdd):
+            if wcode == -2:
+                LOG.debug("Path excluded. (path: %r, code: %r)", wpath, wcode)
+            elif wcode < 0:
+                LOG.error("Unable to monitor. (path: %r, code: %r)", wpath, wcode)
+
+        for cfg_path, paths in roots:
+            self.cfg_items[cfg_path.path] = cfg_path
+
+            xroots = self.cfg_roots.setdefault(cfg_path.path, set())
+            for path in paths:
+                wcode = wdd.get(path, -2)
+                if wcode >= 0:
+                    self.cfg_paths[path] = batch[path]
+                    xroots.add(path)
+                elif wcode != -2 and self.budget is not None:
+                    self.cfg_paths[path] = batch[path]
+                    xroots.add(path)
+                    if path not in self.poller:
+                        self.poller.add(batch[path], path)
+
+            if self.snapshot is not None:
+                self.__catch_up(cfg_path)
+
+        LOG.info("Batch watch done. (cfg_paths: %r, roots: %r, watches: %r, duration: %.3fs)",
+                 len(xcfg_paths), len(batch), len(wdd), clock() - start)
+
     def __rem_watch(self, cfg_path):
-        if cfg_path.path not in self.cfg_paths:
+        self.cfg_items.pop(cfg_path.path, None)
+
+        if cfg_path.path not in self.cfg_roots:
             return
 
         LOG.info("Remove watch. (path: %r, mask: %r, plugins: %r, glob: %r)",
@@ -481,84 +1431,439 @@ class DWhoInotify(threading.Thread):
                  cfg_path.plugins,
                  cfg_path.do_glob)
 
-        try:
-            self.wm.rm_watch(cfg_path.path, rec = True, quiet = False)
-        except pyinotify.WatchManagerError as e:
-            LOG.exception("Unable to unmonitor. (path: %r, reason: %r)", cfg_path.path, e)
+        for root in self.cfg_roots.pop(cfg_path.path):
+            if self.poller is not None:
+                prefix = root.rstrip(os.sep) + os.sep
+                for path in list(self.poller.units.keys()):
+                    if path == root or path.startswith(prefix):
+                        self.poller.remove(path)
+
+            try:
+                wd = self.wm.get_wd(root)
+                if wd is not None:
+                    self.wm.rm_watch(wd, rec = True, quiet = False)
+            except pyinotify.WatchManagerError as e:
+                LOG.exception("Unable to unmonitor. (path: %r, reason: %r)", root, e)
+
+            if self.cfg_paths.get(root) is cfg_path:
+                del self.cfg_paths[root]
+
+    def __walk_cfg_path(self, cfg_path, root, rewatch = False):
+        """
+        Yield (dirpath, files) of every not excluded directory under root,
+        and watch the directories not watched if rewatch.
+        """
+        watch_filter = cfg_path.watch_filter
+
+        for dirpath, dirs, files in os.walk(root, topdown = True):
+            if watch_filter and watch_filter(dirpath):
+                dirs[:] = []
+                continue
+
+            if rewatch and self.wm.get_wd(dirpath) is None:
+                # directory created while events were lost
+                self.wm.add_watch(dirpath,
+                                  cfg_path.event_mask,
+                                  auto_add       = True,
+                                  exclude_filter = watch_filter)
+
+            yield (dirpath, files)
+
+    def __rescan(self, cfg_path):
+        with self.rescan_lock:
+            since = self.rescans.pop(cfg_path.path, None)
+
+        roots = self.cfg_roots.get(cfg_path.path)
+        if not roots or cfg_path.backend == BACKEND_POLL:
+            # polled subtrees are diffed against their own state
+            return
+
+        if self.snapshot is not None:
+            self.__catch_up(cfg_path, True)
+            return
+
+        xmask = None
+        for x in RESCAN_EVENTS:
+            if cfg_path.event_mask & self.get_flag_value(x):
+                xmask = self.get_flag_value(x)
+                break
+
+        if since is not None:
+            since -= RESCAN_MARGIN
+
+        LOG.info("Rescan. (path: %r, since: %r)", cfg_path.path, since)
+
+        nb = 0
+
+        for root in roots:
+            for dirpath, files in self.__walk_cfg_path(cfg_path, root, True):
+                if not xmask:
+                    continue
+
+                for name in files:
+                    try:
+                        if since is not None \
+                           and os.lstat(os.path.join(dirpath, name)).st_mtime < since:
+                            continue
+                    except OSError:
+                        continue
+
+                    nb += 1
+                    self.handler.emit(self.handler.synthetic_event(xmask, dirpath, name))
+
+        LOG.info("Rescan done. (path: %r, events: %r)", cfg_path.path, nb)
+
+    def __catch_up(self, cfg_path, rewatch = False):
+        """
+        Diff the files under the cfg_path roots against the snapshot and
+        emit synthetic events for the differences only.
+        """
+        masks = {}
+        for x in ('create', 'close_write', 'modify', 'delete'):
+            masks[x] = self.get_flag_value(x) & cfg_path.event_mask
+
+        nb = 0
+
+        for root in self.cfg_roots.get(cfg_path.path) or ():
+            # nothing known about this root yet, only record it
+            baseline = not self.snapshot.loaded or not self.snapshot.has_paths_under(root)
+            seen     = set()
+
+            LOG.info("Snapshot catch-up. (path: %r, baseline: %r)", root, baseline)
+
+            for dirpath, files in self.__walk_cfg_path(cfg_path, root, rewatch):
+                for name in files:
+                    path = os.path.join(dirpath, name)
+                    try:
+                        key = stat_key(os.lstat(path))
+                    except OSError:
+                        continue
+
+                    seen.add(path)
+                    old = self.snapshot.get(path)
+                    if old == key:
+                        continue
+
+                    self.snapshot.set(path, key)
+                    if baseline:
+                        continue
+
+                    if old is None:
+                        xmasks = (masks['create'], masks['close_write'])
+                    else:
+                        xmasks = (masks['close_write'] or masks['modify'],)
+
+                    for xmask in xmasks:
+                        if xmask:
+                            nb += 1
+                            self.handler.emit(self.handler.synthetic_event(xmask, dirpath, name))
+
+            for path in self.snapshot.paths_under(root):
+                if path in seen:
+                    continue
+
+                self.snapshot.delete(path)
+                if masks['delete']:
+                    nb += 1
+                    self.handler.emit(self.handler.synthetic_event(masks['delete'],
+                                                                   os.path.dirname(path),
+                                                                   os.path.basename(path)))
+
+        LOG.info("Snapshot catch-up done. (path: %r, events: %r)", cfg_path.path, nb)
+
+    def get_scan_progress(self):
+        if not self.wm:
+            return {}
+
+        return dict(self.wm.scan_progress)
+
+    def init_pipeline(self):
+        walk_workers    = helpers.get_nb_workers(self.config['inotify'].get('walk_workers', WALK_WORKERS),
+                                                 xmin    = 1,
+                                                 default = 1)
+        # pool workers are started before the pipeline threads
+        self.executor   = DWhoInotifyProcessExecutor(self.config).start()
+        self.wm         = DWhoInotifyWatchManager(walk_workers = walk_workers)
+        self.handler    = DWhoInotifyEventHandler(**{'dw_inotify': self})
+        self.coalescer  = DWhoInotifyCoalescer(self.handler.dispatch)
+        self.coalescer.start()
+        if has_rate_limit(self.config['inotify']):
+            self.init_limiter()
+        if self.journal is not None:
+            self.journal.start()
+            self.batcher = DWhoInotifyBatcher(self.workerpool.run, done = self.journal_batch_done)
         else:
-            del self.cfg_paths[cfg_path.path]
+            self.batcher = DWhoInotifyBatcher(self.workerpool.run)
+        self.batcher.start()
+        if self.rename_window:
+            self.renamer = DWhoInotifyRenamer(self.handler.moved_out, self.rename_window)
+            self.renamer.start()
+        self.poller     = DWhoInotifyPoller(self.handler,
+                                        lambda path: self.wm.get_wd(path) is not None,
+                                        float(self.config['inotify'].get('poll_interval')
+                                              or POLL_INTERVAL),
+                                        helpers.get_nb_workers(self.config['inotify'].get('poll_workers'),
+                                                               xmin    = 1,
+                                                               default = POLL_WORKERS),
+                                        self.config['inotify'].get('poll_index_file')).load_index()
+        self.poller.start()
+        if self.max_watches:
+            self.budget = DWhoInotifyBudget(self, self.poller, self.max_watches)
+            self.budget.start()
+        if self.snapshot is not None:
+            self.snapshot.start()
+
+    def init_limiter(self):
+        self.limiter    = DWhoInotifyRateLimiter(self.handler.dispatch)
+        self.limiter.start()
 
     def run(self):
-        self.wm         = DWhoInotifyWatchManager()
-        self.notifier   = pyinotify.ThreadedNotifier(self.wm,
-                                                     DWhoInotifyEventHandler(**{'dw_inotify': self}))
+        self.init_pipeline()
+        self.notifier   = pyinotify.ThreadedNotifier(self.wm, self.handler)
+        self.notifier._sys_proc_fun = DWhoInotifySysProcessEvent(self.wm, # pylint: disable=protected-access
+                                                                 self.notifier,
+                                                                 self.renamer is not None)
         self.notifier.start()
 
         while not self.killed:
             try:
-                (mode, cfg_path) = DWHO_INOQ.get(True, 0.5)
-                self.scan_event.clear()
-                if mode == MODE_ADD:
-                    self.__add_watch(cfg_path)
-                elif mode == MODE_REM:
-                    self.__rem_watch(cfg_path)
-                else:
-                    raise DWhoInotifyError("Invalid mode: %r" % mode)
+                requests = [DWHO_INOQ.get(True, 0.5)]
             except _queue.Empty:
                 self.scan_event.set()
+                if self.replay is not None:
+                    self.replay_journal()
+                continue
+
+            self.scan_event.clear()
+            while len(requests) < REQUEST_BATCH:
+                try:
+                    requests.append(DWHO_INOQ.get_nowait())
+                except _queue.Empty:
+                    break
+
+            self.process_requests(requests)
 
         self.notifier.stop()
 
+    def journal_batch_done(self, plugin, items):
+        for item in items:
+            self.journal.done(getattr(item[1], 'journal_seq', None), (plugin.PLUGIN_NAME,))
+
+    def replay_journal(self):
+        """
+        Dispatch again the journal entries some plugins weren't done
+        with, once the configured paths are added.
+        """
+        (replay, self.replay) = (self.replay, None)
+        if replay is None:
+            return
+
+        nb = 0
+        for (seq, path, plugins, record, filepath) in replay:
+            cfg_path = self.cfg_items.get(path)
+            if not cfg_path:
+                LOG.warning("Journal entry of an unknown path dropped. (seq: %r, path: %r, filepath: %r)",
+                            seq, path, filepath)
+                continue
+
+            event          = pyinotify.Event(record)
+            event.replayed = True
+            self.handler.call_plugins(cfg_path, event, include_plugins = plugins, exclude_filter = False)
+            nb += 1
+
+        self.journal.replayed()
+
+        if replay:
+            LOG.info("Journal replayed. (entries: %r, dispatched: %r)", len(replay), nb)
+
+    def wait_workers(self, timeout):
+        """
+        Wait until the worker pools have run their queued tasks, return
+        False if some are left after timeout seconds.
+        """
+        deadline = clock() + timeout
+
+        for pool in getattr(self.workerpool, 'lanes', None) or [self.workerpool]:
+            with pool.tasks.all_tasks_done:
+                while pool.tasks.unfinished_tasks:
+                    remaining = deadline - clock()
+                    if remaining <= 0:
+                        return False
+                    pool.tasks.all_tasks_done.wait(remaining)
+
+        return True
+
     def stop(self):
         self.killed = True
         self.scan_event.set()
+        # the unpaired IN_MOVED_FROM events are dispatched
+        if self.renamer:
+            self.renamer.stop()
+            if self.renamer.is_alive():
+                self.renamer.join(5)
+            self.renamer.flush()
+        # the events held in the coalescing window are dispatched
+        if self.coalescer:
+            self.coalescer.stop()
+            if self.coalescer.is_alive():
+                self.coalescer.join(5)
+            self.coalescer.flush()
+        # the deferred events are dispatched over their rate limit
+        if self.limiter is not None:
+            self.limiter.stop()
+            if self.limiter.is_alive():
+                self.limiter.join(5)
+            self.limiter.flush()
+        if self.journal is not None:
+            self.journal.stop()
+            if self.journal.is_alive():
+                self.journal.join(5)
+        if self.workerpool and not self.wait_workers(self.stop_wait):
+            LOG.warning("Workers not done on stop, queued events dropped. (timeout: %r)", self.stop_wait)
+        # partial batches are run by the caller once the workers are done
+        if self.batcher:
+            self.batcher.stop()
+            if self.batcher.is_alive():
+                self.batcher.join(5)
+            self.batcher.flush()
+        if self.snapshot is not None:
+            self.snapshot.stop()
+            # the pending records are synced on exit
+            if self.snapshot.is_alive():
+                self.snapshot.join(5)
         if self.workerpool:
             self.workerpool.killall(0)
-        self.cfg_paths = {}
+        if self.executor:
+            self.executor.stop()
+        if self.dedupe is not None:
+            try:
+                self.dedupe.save()
+            except (IOError, OSError) as e:
+                LOG.error("Unable to save dedupe cache. (filepath: %r, error: %r)", self.dedupe.filepath, e)
+        if self.budget:
+            self.budget.stop()
+        if self.poller:
+            self.poller.stop()
+            # the poll index is written on exit
+            if self.poller.is_alive():
+                self.poller.join(5)
+        self.cfg_paths = DWhoInotifyPathTrie()
+        self.cfg_items = {}
+        self.cfg_roots = {}
+
+
+class DWhoInotifyPlugs(object): # pylint: disable=useless-object-inheritance
+    """
+    Task record of an event run by a worker, the plugins are run with
+    the worker copies from PLUGPOOL.
+    """
+
+    __slots__ = ('batcher',
+                 'cfg_path',
+                 'config',
+                 'dedupe',
+                 'dispatch_time',
+                 'event',
+                 'executor',
+                 'filepath',
+                 'journal',
+                 'stats')
+
+    def __init__(self, config, cfg_path, event, filepath, batcher = None, executor = None, stats = None, # pylint: disable=too-many-arguments
+                 dedupe = None, journal = None):
+        self.batcher       = batcher
+        self.cfg_path      = cfg_path
+        self.config        = config
+        self.dedupe        = dedupe
+        self.dispatch_time = None
+        self.event         = event
+        self.executor      = executor
+        self.filepath      = filepath
+        self.journal       = journal
+        self.stats         = stats
 
+    def run(self):
+        start = clock()
+        if self.stats and self.dispatch_time is not None:
+            self.stats.observe(STAGE_WAIT, self.cfg_path.path, start - self.dispatch_time)
+
+        if self.dedupe is not None and not self.dedupe.changed(self.filepath):
+            LOG.debug("Same content, plugins skipped. (filename: %r)", self.filepath)
+            if self.journal is not None:
+                self.journal.done(getattr(self.event, 'journal_seq', None),
+                                  [x.PLUGIN_NAME for x in self.cfg_path.plugins])
+            if hasattr(self.event, 'plugs_flag'):
+                self.event.plugs_flag.set()
+            return
 
-class DWhoInotifyPlugs(threading.Thread):
-    THREADNAME = 'inoplugs'
+        done = []
 
-    def __init__(self, config, cfg_path, event, filepath):
-        threading.Thread.__init__(self)
+        for plugin in self.cfg_path.plugins:
+            if self.batcher and getattr(plugin, 'has_batch', None) and plugin.has_batch():
+                batch = self.batcher.add(plugin, self.cfg_path, self.event, self.filepath)
+                if batch:
+                    batch()
+                continue
 
-        self.cache_expire = config['inotify'].get('cache_expire', CACHE_EXPIRE)
-        self.config       = config
-        self.cfg_path     = cfg_path
-        self.event        = event
-        self.filepath     = filepath
-        self.timeout      = config['inotify'].get('lock_timeout', LOCK_TIMEOUT)
-        self.server_id    = config['general']['server_id']
-        self.name         = self.THREADNAME
+            done.append(plugin.PLUGIN_NAME)
 
-    def run(self):
-        for plugin in self.cfg_path.plugins:
-            plug = None
             try:
-                plug      = copy.copy(plugin)
-                self.name = "%s:%s" % (self.THREADNAME, plug.PLUGIN_NAME)
+                plug = PLUGPOOL.get(plugin)
 
-                LOG.debug("Starting plugin %s. (filename: %r, thread: %r)",
+                LOG.debug("Starting plugin %s. (filename: %r)",
                           plug.PLUGIN_NAME,
-                          self.filepath,
-                          self.name)
+                          self.filepath)
 
-                plug(self.cfg_path, self.event, self.filepath)
+                plug_start = clock()
 
-                LOG.debug("Stopping plugin %s. (filename: %r, thread: %r)",
-                          plug.PLUGIN_NAME,
-                          self.filepath,
-                          self.name)
+                if self.executor and plug.PLUGIN_NAME in self.executor:
+                    self.executor(plug, self.cfg_path, self.event, self.filepath)
+                else:
+                    plug(self.cfg_path, self.event, self.filepath)
 
-                self.name = self.THREADNAME
+                if self.stats:
+                    self.stats.observe(STAGE_PLUGIN, plug.PLUGIN_NAME, clock() - plug_start)
+
+                LOG.debug("Stopping plugin %s. (filename: %r)",
+                          plug.PLUGIN_NAME,
+                          self.filepath)
             except Exception as e:
                 LOG.exception("Error during plugin. (error: %r, filename: %r)",
                               e,
                               self.filepath)
-            finally:
-                if plug:
-                    del plug
+
+        if self.journal is not None and done:
+            self.journal.done(getattr(self.event, 'journal_seq', None), done)
+
+        if self.stats:
+            end = clock()
+            self.stats.observe(STAGE_RUN, self.cfg_path.path, end - start)
+            if hasattr(self.event, 'read_time'):
+                self.stats.observe(STAGE_LATENCY, self.cfg_path.path, end - self.event.read_time)
+
+        if hasattr(self.event, 'plugs_flag'):
+            self.event.plugs_flag.set()
+
+    @property
+    def cache_expire(self):
+        return self.config['inotify'].get('cache_expire', CACHE_EXPIRE)
+
+    @property
+    def server_id(self):
+        return self.config['general']['server_id']
+
+    @property
+    def timeout(self):
+        return self.config['inotify'].get('lock_timeout', LOCK_TIMEOUT)
+
+    def discard(self):
+        """
+        The task won't run, e.g. dropped or superseded by a coalesced
+        one in the dispatch queue: its journal entry is done.
+        """
+        if self.journal is not None:
+            self.journal.done(getattr(self.event, 'journal_seq', None),
+                              [x.PLUGIN_NAME for x in self.cfg_path.plugins])
 
         if hasattr(self.event, 'plugs_flag'):
             self.event.plugs_flag.set()
@@ -569,23 +1874,28 @@ class DWhoInotifyPlugs(threading.Thread):
 
 class DWhoInotifyEventHandler(pyinotify.ProcessEvent):
     def my_init(self, dw_inotify, plugs_class = DWhoInotifyPlugs, workerpool = None): # pylint: disable=arguments-differ
-        self.dw_inotify  = dw_inotify
-        self.workerpool  = workerpool or dw_inotify.workerpool
-        self.plugs_class = plugs_class
+        self.dw_inotify      = dw_inotify
+        self.workerpool      = workerpool or dw_inotify.workerpool
+        self.plugs_class     = plugs_class
+        self.last_event_time = time.time()
 
     def call_plugins(self, cfg_path, event, include_plugins = None, exclude_filter = None):
         if not cfg_path.plugins:
             LOG.warning("No plugin enabled")
             return
 
+        if exclude_filter is not False \
+           and cfg_path.include_filter is not None \
+           and hasattr(event, 'pathname') \
+           and not cfg_path.include_filter(event.pathname, getattr(event, 'dir', False)):
+            return
+
         if not include_plugins:
             conf_path = cfg_path
         else:
+            # the plugins list is shared with the shallow copy
             conf_path = copy.copy(cfg_path)
-            plugins   = list(conf_path.plugins)
-            for plugin in plugins:
-                if plugin.PLUGIN_NAME not in include_plugins:
-                    conf_path.plugins.remove(plugin)
+            conf_path.plugins = [x for x in cfg_path.plugins if x.PLUGIN_NAME in include_plugins]
 
         if not conf_path.plugins:
             LOG.warning("No plugin included")
@@ -612,19 +1922,166 @@ class DWhoInotifyEventHandler(pyinotify.ProcessEvent):
                 LOG.debug("Exclude file from scan. (filepath: %r)", filepath)
                 return
 
-        self.workerpool.run(self.plugs_class(self.dw_inotify.config, conf_path, event, filepath))
+        if conf_path.coalesce_window and self.dw_inotify.coalescer:
+            self.dw_inotify.coalescer.push(conf_path,
+                                           event,
+                                           filepath,
+                                           conf_path.coalesce_window,
+                                           conf_path.coalesce_max_delay)
+        else:
+            self.dispatch(conf_path, event, filepath)
+
+    def dispatch(self, cfg_path, event, filepath, bucket = None):
+        if self.dw_inotify.limiter is not None:
+            cfg_path = self.dw_inotify.limiter.admit(cfg_path, event, filepath, bucket)
+            if cfg_path is None:
+                return
+
+        dedupe = None
+        # a replayed event may have been seen by dedupe before the crash,
+        # a released event was seen by dedupe before it was deferred
+        if cfg_path.dedupe and self.dw_inotify.dedupe is not None \
+           and bucket is None \
+           and not getattr(event, 'replayed', False):
+            if getattr(event, 'renamed', False):
+                self.dw_inotify.dedupe.forget(event.src_pathname)
+            elif event.mask & FORGET_MASK:
+                self.dw_inotify.dedupe.forget(filepath)
+            elif self.dw_inotify.dedupe.is_candidate(event):
+                if self.dw_inotify.dedupe.unchanged(filepath):
+                    LOG.debug("File unchanged, dispatch skipped. (filename: %r)", filepath)
+                    if hasattr(event, 'plugs_flag'):
+                        event.plugs_flag.set()
+                    return
+                # the content digest is computed by the worker
+                dedupe = self.dw_inotify.dedupe
+
+        stats = self.dw_inotify.stats
+        plugs = self.plugs_class(self.dw_inotify.config,
+                                 cfg_path,
+                                 event,
+                                 filepath,
+                                 batcher  = self.dw_inotify.batcher,
+                                 executor = self.dw_inotify.executor,
+                                 stats    = stats,
+                                 dedupe   = dedupe)
+
+        if stats:
+            plugs.dispatch_time = clock()
+            if hasattr(event, 'read_time'):
+                stats.observe(STAGE_DISPATCH, cfg_path.path, plugs.dispatch_time - event.read_time)
+
+        journal = self.dw_inotify.journal
+        if journal is not None and journal.is_alive():
+            # the task is submitted by the journal once its entry is fsynced
+            plugs.journal = journal
+            journal.append(plugs, [x.PLUGIN_NAME for x in cfg_path.plugins])
+            return
+
+        self.workerpool.run(plugs)
+
+    @staticmethod
+    def synthetic_event(mask, path, name, isdir = False):
+        if isdir:
+            mask |= pyinotify.IN_ISDIR # pylint: disable=no-member
+
+        event = pyinotify.Event({'wd':   -1,
+                                 'mask': mask,
+                                 'path': path,
+                                 'name': name,
+                                 'dir':  isdir})
+        event.synthetic = True
+
+        return event
+
+    def emit(self, event):
+        if not hasattr(event, 'read_time'):
+            event.read_time = clock()
+        if self.dw_inotify.budget and hasattr(event, 'path'):
+            self.dw_inotify.budget.touch(event.path)
+        event.plugs_flag  = threading.Event()
+        cfg_path          = self.dw_inotify.get_cfg_path(event.path)
+        if cfg_path:
+            self.call_plugins(cfg_path, event)
 
     def _process(self, xtype):
         def launch_plugins(event):
-            event.plugs_flag  = threading.Event()
-            cfg_path          = self.dw_inotify.get_cfg_path(event.path)
-            if cfg_path:
-                self.call_plugins(cfg_path, event)
+            self.last_event_time = time.time()
+            if self.dw_inotify.snapshot is not None:
+                self.dw_inotify.snapshot.update(event)
+            self.emit(event)
 
             LOG.debug("DWhoInotifyEvent reports that an event has occurred. (type: %r, event: %r)", xtype, event)
 
         return launch_plugins
 
+    def is_rename(self, src_event, event):
+        cfg_path = self.dw_inotify.get_cfg_path(event.path)
+        if cfg_path is None or cfg_path is not self.dw_inotify.get_cfg_path(src_event.path):
+            return False
+
+        if cfg_path.exclude_filter \
+           and (cfg_path.exclude_filter(src_event.pathname) or cfg_path.exclude_filter(event.pathname)):
+            return False
+
+        if cfg_path.include_filter is not None \
+           and not (cfg_path.include_filter(src_event.pathname, src_event.dir)
+                    and cfg_path.include_filter(event.pathname, event.dir)):
+            return False
+
+        return True
+
+    def process_IN_MOVED_FROM(self, event): # pylint: disable=invalid-name
+        if self.dw_inotify.renamer is None or not getattr(event, 'cookie', None):
+            return self._process('MOVED_FROM')(event)
+
+        self.last_event_time = time.time()
+        if self.dw_inotify.snapshot is not None:
+            self.dw_inotify.snapshot.update(event)
+
+        # dispatched with its IN_MOVED_TO or when the rename window expires
+        event.read_time = clock()
+        self.dw_inotify.renamer.push(event)
+
+        return None
+
+    def process_IN_MOVED_TO(self, event): # pylint: disable=invalid-name
+        src_event = None
+        if self.dw_inotify.renamer is not None and getattr(event, 'cookie', None):
+            src_event = self.dw_inotify.renamer.pop(event.cookie)
+
+        rename = src_event is not None and self.is_rename(src_event, event)
+
+        if getattr(event, 'dir', False) and getattr(event, 'src_pathname', None):
+            self.dw_inotify.move_roots(event.src_pathname, event.pathname)
+
+        if src_event is None:
+            return self._process('MOVED_TO')(event)
+
+        self.last_event_time = time.time()
+        if self.dw_inotify.snapshot is not None:
+            self.dw_inotify.snapshot.update(event)
+
+        if rename:
+            event.renamed      = True
+            event.src_pathname = src_event.pathname
+            event.read_time    = src_event.read_time
+            self.emit(event)
+        else:
+            self.emit(src_event)
+            self.emit(event)
+
+        return None
+
+    def moved_out(self, event):
+        self.emit(event)
+        if getattr(event, 'dir', False):
+            self.dw_inotify.moved_out(event.pathname)
+
+    def process_IN_Q_OVERFLOW(self, event): # pylint: disable=invalid-name
+        LOG.warning("Inotify queue overflow, events lost. (event: %r)", event)
+        self.dw_inotify.overflow(self.last_event_time)
+
     def __getattr__(self, attr):
         if attr.startswith("process_IN_"):
             return self._process(attr[11:])
@@ -633,3 +2090,25 @@ class DWhoInotifyEventHandler(pyinotify.ProcessEvent):
 
     def process_default(self, event):
         LOG.debug("DWhoInotifyEvent reports that an unsupported event has occurred. (event: %r)", event)
+
+
+def new_notifier(conf):
+    klass  = get_notifier_class(conf.get('notifier'))
+    shards = int(conf.get('shards') or 0)
+
+    if shards > 1:
+        from dwho.classes.inoshard import DWhoInotifySupervisor
+        return DWhoInotifySupervisor(shards, klass)
+
+    return klass()
+
+def get_notifier_class(name = None):
+    if not name or name == NOTIFIER_THREADED:
+        return DWhoInotify
+
+    if name == NOTIFIER_ASYNCIO:
+        from dwho.classes.inoasync import DWhoInotifyAsync
+        return DWhoInotifyAsync
+
+    raise DWhoConfigurationError("Invalid inotify notifier: %r. (allowed: %r)"
+                                 % (name, NOTIFIERS))
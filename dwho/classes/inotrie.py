@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""dwho.classes.inotrie"""
+
+import os
+import threading
+
+
+def split_path(path):
+    return [x for x in path.split(os.sep) if x and x != '.']
+
+
+class DWhoInotifyTrieNode(object): # pylint: disable=useless-object-inheritance,too-few-public-methods
+    __slots__ = ('children', 'key', 'value')
+
+    def __init__(self):
+        self.children = {}
+        self.key      = None
+        self.value    = None
+
+
+class DWhoInotifyPathTrie(object): # pylint: disable=useless-object-inheritance
+    """
+    Component-wise prefix tree mapping paths to values.
+    Lookups cost O(path depth) whatever the number of stored paths and
+    only whole components match: '/data/foo' is not a prefix of
+    '/data/foobar'.
+    """
+
+    def __init__(self):
+        self._root  = DWhoInotifyTrieNode()
+        self._len   = 0
+        self._lock  = threading.Lock()
+
+    def _find(self, path):
+        node = self._root
+        for x in split_path(path):
+            node = node.children.get(x)
+            if node is None:
+                return None
+        return node
+
+    def __setitem__(self, path, value):
+        with self._lock:
+            node = self._root
+            for x in split_path(path):
+                child = node.children.get(x)
+                if child is None:
+                    child = node.children[x] = DWhoInotifyTrieNode()
+                node = child
+
+            if node.key is None:
+                self._len += 1
+            node.key   = path
+            node.value = value
+
+    def __getitem__(self, path):
+        node = self._find(path)
+        if node is None or node.key is None:
+            raise KeyError(path)
+        return node.value
+
+    def __delitem__(self, path):
+        with self._lock:
+            nodes = [(None, self._root)]
+            for x in split_path(path):
+                child = nodes[-1][1].children.get(x)
+                if child is None:
+                    raise KeyError(path)
+                nodes.append((x, child))
+
+            node = nodes[-1][1]
+            if node.key is None:
+                raise KeyError(path)
+
+            node.key   = None
+            node.value = None
+            self._len -= 1
+
+            # prune branches which do not lead to any value anymore
+            while len(nodes) > 1:
+                (name, node) = nodes.pop()
+                if node.key is not None or node.children:
+                    break
+                del nodes[-1][1].children[name]
+
+    def __contains__(self, path):
+        node = self._find(path)
+        return node is not None and node.key is not None
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        for key, value in self.items(): # pylint: disable=unused-variable
+            yield key
+
+    def get(self, path, default = None):
+        node = self._find(path)
+        if node is None or node.key is None:
+            return default
+        return node.value
+
+    def items(self, path = None):
+        """
+        Yield (key, value) of every stored path, or only those under
+        |path| (included) if provided.
+        """
+        if path is None:
+            node = self._root
+        else:
+            node = self._find(path)
+            if node is None:
+                return
+
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.key is not None:
+                yield (node.key, node.value)
+            stack.extend(list(node.children.values()))
+
+    def values(self):
+        for key, value in self.items(): # pylint: disable=unused-variable
+            yield value
+
+    def longest_prefix(self, path):
+        """
+        Return (key, value) of the longest stored path which is
+        |path| itself or one of its ancestors, (None, None) otherwise.
+        """
+        node  = self._root
+        found = node if node.key is not None else None
+
+        for x in split_path(path):
+            node = node.children.get(x)
+            if node is None:
+                break
+            if node.key is not None:
+                found = node
+
+        if found is None:
+            return (None, None)
+
+        return (found.key, found.value)
+
+    def longest_prefix_value(self, path, default = None):
+        key, value = self.longest_prefix(path)
+        if key is None:
+            return default
+        return value
+
+    def has_descendants(self, path):
+        """
+        Return True if at least one stored path is strictly under |path|.
+        """
+        node = self._find(path)
+        return node is not None and bool(node.children)
+
+    def clear(self):
+        with self._lock:
+            self._root = DWhoInotifyTrieNode()
+            self._len  = 0
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""dwho.classes.inowalk"""
+
+import logging
+import os
+import threading
+
+from six.moves import queue as _queue
+
+from dwho.classes.inostats import clock
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+LOG                 = logging.getLogger('dwho.inowalk')
+
+WALK_WORKERS        = 'auto'
+PROGRESS_INTERVAL   = 10
+
+
+def list_subdirs(path):
+    """
+    Return the subdirectories of path, symlinks excluded.
+    """
+    if scandir is not None:
+        return [entry.path for entry in scandir(path)
+                if entry.is_dir(follow_symlinks = False)]
+
+    r = []
+    for name in os.listdir(path):
+        xpath = os.path.join(path, name)
+        if os.path.isdir(xpath) and not os.path.islink(xpath):
+            r.append(xpath)
+    return r
+
+
+class DWhoInotifyWalker(object): # pylint: disable=useless-object-inheritance
+    """
+    Walk a directory tree with a bounded pool of threads, each one
+    visiting a directory then listing it with scandir. Subdirectories
+    matched by exclude_filter are pruned before being descended.
+    """
+
+    def __init__(self, max_workers, exclude_filter = None, progress = None, name = 'inowalk'):
+        self.exclude_filter = exclude_filter
+        self.max_workers    = max(1, int(max_workers))
+        self.name           = name
+        self.progress       = progress
+        self.excluded       = []
+        self.scanned        = 0
+        self._lock          = threading.Lock()
+        self._last_report   = 0
+
+    def _report(self, top, force = False):
+        now = clock()
+        with self._lock:
+            self.scanned += 1
+            if not force and now - self._last_report < PROGRESS_INTERVAL:
+                return
+            self._last_report = now
+            scanned = self.scanned
+
+        if self.progress:
+            self.progress(top, scanned)
+
+    def _scan(self, top, path, visit, tasks):
+        visit(path)
+        self._report(top)
+
+        try:
+            subdirs = list_subdirs(path)
+        except OSError as e:
+            LOG.debug("Unable to list directory. (path: %r, error: %r)", path, e)
+            return
+
+        for subdir in subdirs:
+            if self.exclude_filter and self.exclude_filter(subdir):
+                with self._lock:
+                    self.excluded.append(subdir)
+                continue
+            tasks.put(subdir)
+
+    def _worker(self, top, visit, tasks, errors):
+        while True:
+            path = tasks.get()
+            try:
+                if path is None:
+                    return
+                if not errors:
+                    self._scan(top, path, visit, tasks)
+            except Exception as e: # pylint: disable=broad-except
+                errors.append(e)
+            finally:
+                tasks.task_done()
+
+    def walk(self, top, visit):
+        """
+        Call visit(path) on top and on each of its not excluded
+        subdirectories. Re-raise the first error raised by visit.
+        """
+        tasks   = _queue.Queue()
+        errors  = []
+        workers = []
+
+        self._last_report = clock()
+        tasks.put(top)
+
+        for i in range(self.max_workers):
+            worker = threading.Thread(target = self._worker,
+                                      args   = (top, visit, tasks, errors),
+                                      name   = "%s:%d" % (self.name, i + 1))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+
+        tasks.join()
+
+        for worker in workers:
+            tasks.put(None)
+        for worker in workers:
+            worker.join()
+
+        if self.progress:
+            self.progress(top, self.scanned)
+
+        if errors:
+            raise errors[0]
+
+        return self.scanned
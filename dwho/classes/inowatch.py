@@ -0,0 +1,532 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""dwho.classes.inowatch"""
+
+import array
+import logging
+import os
+import threading
+
+from six.moves import intern
+
+LOG         = logging.getLogger('dwho.inowatch')
+
+NO_PARENT   = -1
+
+# children of a directory are looked up by name through a dict beyond
+# this number, a linear scan of the siblings is cheaper below
+CHILDREN_INDEX  = 32
+
+_PROFILE_FIELDS = ('proc_fun', 'auto_add', 'exclude_filter', 'dir')
+
+
+class DWhoInotifyWatch(object): # pylint: disable=useless-object-inheritance
+    """
+    pyinotify.Watch interface over an entry of the watch table, built on
+    demand. Attributes are read from and written to the table while the
+    entry is the one the view was built on: once it is removed, even if
+    its wd is reused, attributes are None and writes are ignored.
+    """
+    __slots__ = ('_gen', '_table', 'wd')
+
+    def __init__(self, table, wd, gen = None):
+        self._gen   = gen
+        self._table = table
+        self.wd     = wd
+
+    @property
+    def path(self):
+        return self._table.get_path(self.wd, self._gen)
+
+    @path.setter
+    def path(self, value):
+        self._table.move(self.wd, value, self._gen)
+
+    @property
+    def mask(self):
+        return self._table.get_mask(self.wd, self._gen)
+
+    @mask.setter
+    def mask(self, value):
+        self._table.set_mask(self.wd, value, self._gen)
+
+    @property
+    def proc_fun(self):
+        return self._table.get_attr(self.wd, 'proc_fun', self._gen)
+
+    @proc_fun.setter
+    def proc_fun(self, value):
+        self._table.set_attr(self.wd, 'proc_fun', value, self._gen)
+
+    @property
+    def auto_add(self):
+        return self._table.get_attr(self.wd, 'auto_add', self._gen)
+
+    @auto_add.setter
+    def auto_add(self, value):
+        self._table.set_attr(self.wd, 'auto_add', value, self._gen)
+
+    @property
+    def exclude_filter(self):
+        return self._table.get_attr(self.wd, 'exclude_filter', self._gen)
+
+    @exclude_filter.setter
+    def exclude_filter(self, value):
+        self._table.set_attr(self.wd, 'exclude_filter', value, self._gen)
+
+    @property
+    def dir(self):
+        return self._table.get_attr(self.wd, 'dir', self._gen)
+
+    def is_valid(self):
+        return self._table.is_valid(self.wd, self._gen)
+
+    def __repr__(self):
+        return "<%s wd=%r path=%r mask=%r auto_add=%r>" % (self.__class__.__name__,
+                                                           self.wd,
+                                                           self.path,
+                                                           self.mask,
+                                                           self.auto_add)
+
+
+class DWhoInotifyWatchTable(object): # pylint: disable=useless-object-inheritance
+    """
+    Compact wd -> watch storage used as the watch manager dict. Entries
+    live in wd-indexed arrays: parent wd, first child and siblings wds,
+    interned name component, mask and profile id, a profile being a
+    (proc_fun, auto_add, exclude_filter, dir) tuple shared by the
+    watches of a cfg_path.
+    Paths are built from the parent chain when asked for, so renaming a
+    directory only updates its own entry. Entries whose parent directory
+    isn't watched are roots and keep their full path as name.
+
+    The kernel allocates wds increasingly, arrays are sized to the
+    highest wd seen. The generation of a wd changes when it is added or
+    removed, views check it so a reused wd isn't mistaken for theirs.
+    """
+
+    def __init__(self):
+        self._lock          = threading.RLock()
+        self._len           = 0
+        self._names         = []
+        self._parents       = array.array('i')
+        self._first         = array.array('i')
+        self._next          = array.array('i')
+        self._prev          = array.array('i')
+        self._masks         = array.array('I')
+        self._profs         = array.array('I')
+        self._gens          = array.array('I')
+        # wd -> {name: child wd}, only for directories with many children
+        self._index         = {}
+        # path -> root wd, parent directory path -> root wds
+        self._roots         = {}
+        self._orphans       = {}
+
+        self._profiles      = []
+        self._profile_ids   = {}
+        self._profile_refs  = []
+        self._profile_free  = []
+
+    def __len__(self):
+        return self._len
+
+    def __contains__(self, wd):
+        return 0 <= wd < len(self._names) and self._names[wd] is not None
+
+    def __iter__(self):
+        return self.keys()
+
+    def __getitem__(self, wd):
+        if wd not in self:
+            raise KeyError(wd)
+        return DWhoInotifyWatch(self, wd, self._gens[wd])
+
+    def __setitem__(self, wd, watch):
+        self.add(wd,
+                 watch.path,
+                 watch.mask,
+                 watch.proc_fun,
+                 watch.auto_add,
+                 watch.exclude_filter,
+                 getattr(watch, 'dir', True))
+
+    def __delitem__(self, wd):
+        if not self.remove(wd):
+            raise KeyError(wd)
+
+    def get(self, wd, default = None):
+        if wd is None or wd not in self:
+            return default
+        return DWhoInotifyWatch(self, wd, self._gens[wd])
+
+    def is_valid(self, wd, gen = None):
+        """
+        Return True if wd is watched and, if gen is set, is the entry
+        of this generation.
+        """
+        return wd in self and (gen is None or self._gens[wd] == gen)
+
+    def keys(self):
+        names = self._names
+        for wd in range(len(names)):
+            if names[wd] is not None:
+                yield wd
+
+    def values(self):
+        gens = self._gens
+        for wd in self.keys():
+            yield DWhoInotifyWatch(self, wd, gens[wd])
+
+    def items(self):
+        gens = self._gens
+        for wd in self.keys():
+            yield (wd, DWhoInotifyWatch(self, wd, gens[wd]))
+
+    def __grow(self, wd):
+        nb = wd + 1 - len(self._names)
+        if nb <= 0:
+            return
+
+        # grow by at least a quarter to amortize
+        nb = max(nb, len(self._names) // 4, 1024)
+        self._names.extend([None] * nb)
+        for x in (self._parents, self._first, self._next, self._prev):
+            x.extend(array.array('i', [NO_PARENT]) * nb)
+        self._masks.extend(array.array('I', [0]) * nb)
+        self._profs.extend(array.array('I', [0]) * nb)
+        self._gens.extend(array.array('I', [0]) * nb)
+
+    def __profile_acquire(self, profile):
+        key = tuple([id(x) for x in profile])
+        pid = self._profile_ids.get(key)
+
+        if pid is None:
+            if self._profile_free:
+                pid = self._profile_free.pop()
+                self._profiles[pid]     = profile
+                self._profile_refs[pid] = 0
+            else:
+                pid = len(self._profiles)
+                self._profiles.append(profile)
+                self._profile_refs.append(0)
+            self._profile_ids[key] = pid
+
+        self._profile_refs[pid] += 1
+
+        return pid
+
+    def __profile_release(self, pid):
+        self._profile_refs[pid] -= 1
+        if self._profile_refs[pid] > 0:
+            return
+
+        profile = self._profiles[pid]
+        del self._profile_ids[tuple([id(x) for x in profile])]
+        self._profiles[pid] = None
+        self._profile_free.append(pid)
+
+    def __children(self, wd):
+        nxt   = self._next
+        child = self._first[wd]
+        while child != NO_PARENT:
+            yield child
+            child = nxt[child]
+
+    def __find_child(self, wd, name):
+        index = self._index.get(wd)
+        if index is not None:
+            return index.get(name)
+
+        names = self._names
+        nxt   = self._next
+        child = self._first[wd]
+        nb    = 0
+        while child != NO_PARENT and names[child] != name:
+            child = nxt[child]
+            nb   += 1
+
+        if nb > CHILDREN_INDEX:
+            self._index[wd] = dict([(names[x], x) for x in self.__children(wd)])
+
+        if child == NO_PARENT:
+            return None
+
+        return child
+
+    def __link_child(self, parent, wd, name):
+        first               = self._first[parent]
+        self._names[wd]     = name
+        self._parents[wd]   = parent
+        self._prev[wd]      = NO_PARENT
+        self._next[wd]      = first
+        if first != NO_PARENT:
+            self._prev[first] = wd
+        self._first[parent] = wd
+
+        index = self._index.get(parent)
+        if index is not None:
+            index[name] = wd
+
+    def __unlink_child(self, wd):
+        parent = self._parents[wd]
+        prev   = self._prev[wd]
+        nxt    = self._next[wd]
+
+        if prev != NO_PARENT:
+            self._next[prev] = nxt
+        else:
+            self._first[parent] = nxt
+        if nxt != NO_PARENT:
+            self._prev[nxt] = prev
+
+        self._prev[wd] = NO_PARENT
+        self._next[wd] = NO_PARENT
+
+        index = self._index.get(parent)
+        if index is not None:
+            if index.get(self._names[wd]) == wd:
+                del index[self._names[wd]]
+            if self._first[parent] == NO_PARENT:
+                del self._index[parent]
+
+    def __path(self, wd):
+        names   = self._names
+        parents = self._parents
+        parts   = [names[wd]]
+        parent  = parents[wd]
+
+        while parent != NO_PARENT:
+            parts.append(names[parent])
+            parent = parents[parent]
+
+        if len(parts) == 1:
+            return parts[0]
+
+        parts.reverse()
+        return os.path.join(*parts)
+
+    def __lookup(self, path):
+        wd = self._roots.get(path)
+        if wd is not None:
+            return wd
+
+        names = []
+        head  = path
+        while True:
+            (head, tail) = os.path.split(head)
+            if not tail:
+                return None
+            names.append(tail)
+            wd = self._roots.get(head)
+            if wd is not None:
+                break
+
+        # the closest root is the only candidate, directories between
+        # two roots are not watched
+        for name in reversed(names):
+            wd = self.__find_child(wd, name)
+            if wd is None:
+                return None
+
+        return wd
+
+    def __attach(self, wd, path):
+        parent = None
+        head   = os.path.dirname(path)
+        if head != path:
+            parent = self.__lookup(head)
+
+        if parent is not None and parent != wd:
+            self.__link_child(parent, wd, intern(os.path.basename(path)))
+        else:
+            self._names[wd]     = path
+            self._parents[wd]   = NO_PARENT
+            self._roots[path]   = wd
+            self._orphans.setdefault(head, set()).add(wd)
+
+        # adopt the roots added before this one, e.g. nested cfg_paths
+        for orphan in self._orphans.pop(path, ()):
+            if orphan == wd:
+                continue
+            if self._roots.get(self._names[orphan]) == orphan:
+                del self._roots[self._names[orphan]]
+            self.__link_child(wd, orphan, intern(os.path.basename(self._names[orphan])))
+
+    def __detach(self, wd):
+        name = self._names[wd]
+
+        if self._parents[wd] != NO_PARENT:
+            self.__unlink_child(wd)
+            return
+
+        if self._roots.get(name) == wd:
+            del self._roots[name]
+
+        head    = os.path.dirname(name)
+        orphans = self._orphans.get(head)
+        if orphans is not None:
+            orphans.discard(wd)
+            if not orphans:
+                del self._orphans[head]
+
+    def add(self, wd, path, mask, proc_fun, auto_add, exclude_filter, isdir = True): # pylint: disable=too-many-arguments
+        profile = (proc_fun, auto_add, exclude_filter, isdir)
+
+        with self._lock:
+            self.__grow(wd)
+
+            if self._names[wd] is not None:
+                if self.__path(wd) == path:
+                    # same watch added again, e.g. with another mask
+                    self._masks[wd] = mask
+                    self.__set_profile(wd, profile)
+                    return
+                self.remove(wd)
+
+            self._masks[wd] = mask
+            self._profs[wd] = self.__profile_acquire(profile)
+            self._gens[wd]  = (self._gens[wd] + 1) & 0xffffffff
+            self._len      += 1
+            self.__attach(wd, path)
+
+    def remove(self, wd):
+        with self._lock:
+            if wd not in self:
+                return False
+
+            path = self.__path(wd)
+            self.__detach(wd)
+
+            # children are now roots, adopted back if path is watched again
+            for cwd in list(self.__children(wd)):
+                xpath               = os.path.join(path, self._names[cwd])
+                self._names[cwd]    = xpath
+                self._parents[cwd]  = NO_PARENT
+                self._prev[cwd]     = NO_PARENT
+                self._next[cwd]     = NO_PARENT
+                self._roots[xpath]  = cwd
+                self._orphans.setdefault(path, set()).add(cwd)
+            self._first[wd] = NO_PARENT
+            self._index.pop(wd, None)
+
+            self.__profile_release(self._profs[wd])
+            self._names[wd]     = None
+            self._parents[wd]   = NO_PARENT
+            self._masks[wd]     = 0
+            self._gens[wd]      = (self._gens[wd] + 1) & 0xffffffff
+            self._len          -= 1
+
+            return True
+
+    def move(self, wd, path, gen = None):
+        """
+        Rename the entry wd to path, its subdirectories follow. Roots
+        under the former path are renamed too.
+        """
+        with self._lock:
+            if not self.is_valid(wd, gen):
+                return 0
+
+            src = self.__path(wd)
+            if src == path:
+                return 0
+
+            self.__detach(wd)
+            self.__attach(wd, path)
+
+            prefix = src.rstrip(os.sep) + os.sep
+            for root in [x for x in self._roots if x.startswith(prefix)]:
+                rwd = self._roots[root]
+                self.__detach(rwd)
+                self.__attach(rwd, path + root[len(src):])
+
+            return 1
+
+    def get_path(self, wd, gen = None):
+        with self._lock:
+            if wd is None or not self.is_valid(wd, gen):
+                return None
+            return self.__path(wd)
+
+    def get_wd(self, path):
+        with self._lock:
+            return self.__lookup(path)
+
+    def get_mask(self, wd, gen = None):
+        with self._lock:
+            if not self.is_valid(wd, gen):
+                return None
+            return self._masks[wd]
+
+    def set_mask(self, wd, mask, gen = None):
+        with self._lock:
+            if self.is_valid(wd, gen):
+                self._masks[wd] = mask
+
+    def get_attr(self, wd, name, gen = None):
+        with self._lock:
+            if not self.is_valid(wd, gen):
+                return None
+            return self._profiles[self._profs[wd]][_PROFILE_FIELDS.index(name)]
+
+    def __set_profile(self, wd, profile):
+        pid = self.__profile_acquire(profile)
+        self.__profile_release(self._profs[wd])
+        self._profs[wd] = pid
+
+    def set_attr(self, wd, name, value, gen = None):
+        with self._lock:
+            if not self.is_valid(wd, gen):
+                return
+            profile = list(self._profiles[self._profs[wd]])
+            profile[_PROFILE_FIELDS.index(name)] = value
+            self.__set_profile(wd, tuple(profile))
+
+    def get_children(self, wd):
+        with self._lock:
+            if wd is None or wd not in self:
+                return []
+            return list(self.__children(wd))
+
+    def get_subtree(self, wds):
+        """
+        Return the wds of the entries wds and of every entry under them.
+        """
+        r = []
+
+        with self._lock:
+            for wd in wds:
+                if wd not in self:
+                    continue
+                stack = [wd]
+                while stack:
+                    xwd = stack.pop()
+                    r.append(xwd)
+                    stack.extend(self.__children(xwd))
+
+        return r
+
+    def paths(self):
+        """
+        Return the (wd, path) of every entry, paths being built once per
+        directory from their parent.
+        """
+        r = []
+
+        with self._lock:
+            stack = [(wd, path) for path, wd in self._roots.items()]
+            while stack:
+                (wd, path) = stack.pop()
+                r.append((wd, path))
+                for cwd in self.__children(wd):
+                    stack.append((cwd, os.path.join(path, self._names[cwd])))
+
+        return r
+
+    def get_stats(self):
+        return {'watches':  self._len,
+                'slots':    len(self._names),
+                'roots':    len(self._roots),
+                'indexes':  len(self._index),
+                'profiles': len(self._profile_ids)}
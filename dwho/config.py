@@ -5,6 +5,7 @@
 
 import os
 import signal
+import threading
 
 import logging
 from logging.handlers import WatchedFileHandler
@@ -37,6 +38,11 @@ SUBDIR_CHARS    = "abcdef0123456789"
 DWHO_SHARED     = keystore.Keystore()
 DWHO_THREADS    = []
 _INOTIFY        = None
+_CONF_SOURCE    = None
+_RELOADER       = None
+_RELOADING      = False
+_RELOAD_LOCK    = threading.Lock()
+_RELOAD_EVENT   = threading.Event()
 _SOFTNAME       = ""
 _SOFTVER        = ""
 
@@ -79,6 +85,68 @@ def get_server_id(conf = None):
 def get_inotify_instance():
     return _INOTIFY
 
+def reload_inotify():
+    """
+    Read and parse the configuration again as on startup and apply the
+    differences of its inotify section.
+    """
+    global _RELOADING
+
+    if not _INOTIFY or not _CONF_SOURCE:
+        return None
+
+    (xfile, envvar, custom_file, parse_conf_func, load_creds) = _CONF_SOURCE
+
+    with _RELOAD_LOCK:
+        _RELOADING = True
+        try:
+            conf = read_conf(xfile, envvar, custom_file)
+            if parse_conf_func:
+                conf = parse_conf_func(conf)
+            else:
+                conf = parse_conf(conf, load_creds)
+
+            for x in ('modules', 'plugins'):
+                conf = import_conf_files(x, conf)
+
+            if 'inotify' not in conf:
+                raise DWhoConfigurationError("Missing 'inotify' section in configuration")
+            nb   = _INOTIFY.reload(conf['inotify'])
+        except Exception as e:
+            LOG.exception("Unable to reload inotify configuration. (error: %r)", e)
+            raise
+        finally:
+            _RELOADING = False
+
+    LOG.info("Inotify configuration reload queued. (paths: %r)", nb)
+
+    return nb
+
+def request_reload(signum = None, stack_frame = None): # pylint: disable=unused-argument
+    """
+    SIGHUP handler, the reload is done by the inoreload thread.
+    """
+    _RELOAD_EVENT.set()
+
+def _reload_loop():
+    while True:
+        _RELOAD_EVENT.wait()
+        _RELOAD_EVENT.clear()
+        try:
+            reload_inotify()
+        except Exception as e: # pylint: disable=broad-except
+            LOG.error("Inotify configuration reload failed, current configuration kept. (error: %r)", e)
+
+def start_reloader():
+    global _RELOADER
+
+    if _RELOADER:
+        return
+
+    _RELOADER        = threading.Thread(target = _reload_loop, name = 'inoreload')
+    _RELOADER.daemon = True
+    _RELOADER.start()
+
 def parse_conf(conf, load_creds = False):
     global _INOTIFY
 
@@ -136,10 +204,11 @@ def parse_conf(conf, load_creds = False):
     else:
         conf['general']['web_directories'] = []
 
-    if 'inotify' in conf:
+    # the running notifier applies the inotify section on reload
+    if 'inotify' in conf and not _RELOADING:
         from dwho.classes import inotify
 
-        _INOTIFY = inotify.DWhoInotify()
+        _INOTIFY = inotify.new_notifier(conf['inotify'])
         DWHO_THREADS.append(_INOTIFY.stop)
         conf['inotify'] = inotify.DWhoInotifyConfig()(_INOTIFY, conf['inotify'])
 
@@ -229,10 +298,7 @@ def start_inotify():
     start_inoplugs()
     _INOTIFY.start()
 
-def load_conf(xfile, options = None, parse_conf_func = None, load_creds = False, envvar = None, custom_file = None):
-    signal.signal(signal.SIGTERM, stop)
-    signal.signal(signal.SIGINT, stop)
-
+def read_conf(xfile, envvar = None, custom_file = None):
     conf = {'_config_directory': None}
 
     if os.path.exists(xfile):
@@ -255,6 +321,17 @@ def load_conf(xfile, options = None, parse_conf_func = None, load_creds = False,
         c.close()
         conf['_config_directory'] = None
 
+    return conf
+
+def load_conf(xfile, options = None, parse_conf_func = None, load_creds = False, envvar = None, custom_file = None):
+    global _CONF_SOURCE
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    conf         = read_conf(xfile, envvar, custom_file)
+    _CONF_SOURCE = (xfile, envvar, custom_file, parse_conf_func, load_creds)
+
     if parse_conf_func:
         conf = parse_conf_func(conf)
     else:
@@ -268,6 +345,9 @@ def load_conf(xfile, options = None, parse_conf_func = None, load_creds = False,
 
     if _INOTIFY:
         init_inotify(conf)
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, request_reload)
+            start_reloader()
 
     if not options or not isinstance(options, object):
         return conf
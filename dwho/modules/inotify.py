@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""dwho.modules.inotify"""
+
+import logging
+
+from httpdis.httpdis import HttpReqError
+
+from dwho.classes.errors import DWhoConfigurationError
+from dwho.classes.modules import DWhoModuleBase, MODULES
+from dwho.config import get_inotify_instance, reload_inotify
+
+LOG = logging.getLogger('dwho.modules.inotify')
+
+
+class DWhoModuleInotify(DWhoModuleBase):
+    MODULE_NAME = 'inotify'
+
+    def stats(self, request): # pylint: disable=unused-argument,no-self-use
+        inotify = get_inotify_instance()
+        if not inotify:
+            return {}
+
+        return inotify.get_stats()
+
+    def reload(self, request): # pylint: disable=unused-argument,no-self-use
+        if not get_inotify_instance():
+            raise HttpReqError(404, "inotify is not enabled")
+
+        try:
+            nb = reload_inotify()
+        except DWhoConfigurationError as e:
+            raise HttpReqError(400, str(e))
+
+        return {'queued': True,
+                'paths':  nb}
+
+
+if __name__ != "__main__":
+    def _start():
+        MODULES.register(DWhoModuleInotify())
+    _start()
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""tests.conftest"""
+
+import copy
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from dwho.classes import inotify
+from dwho.classes.inoplugs import DWhoInoEventPlugBase, INOPLUGS
+
+
+def wait_for(predicate, timeout = 10, interval = 0.02):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(interval)
+
+    return bool(predicate())
+
+
+class DWhoTestRecorderPlug(DWhoInoEventPlugBase):
+    """
+    Record (plugin, maskname, filepath) of every event, the record list
+    is shared with the pooled copies.
+    """
+
+    PLUGIN_NAME = 'test_recorder'
+
+    def __init__(self, name = None):
+        DWhoInoEventPlugBase.__init__(self)
+        if name:
+            self.PLUGIN_NAME = name
+        self.records = []
+        self.lock    = threading.Lock()
+
+    def run(self, cfg_path, event, filepath):
+        with self.lock:
+            self.records.append((self.PLUGIN_NAME, event.maskname, filepath))
+
+    def paths(self, maskname = None):
+        with self.lock:
+            return [x[2] for x in self.records if maskname is None or x[1] == maskname]
+
+
+@pytest.fixture
+def tmpdir_path():
+    path = tempfile.mkdtemp(prefix = 'dwho-test-')
+    yield path
+    shutil.rmtree(path, True)
+
+
+@pytest.fixture
+def recorder():
+    plugin = DWhoTestRecorderPlug()
+    INOPLUGS.register(plugin)
+    yield plugin
+    INOPLUGS.unregister(plugin)
+
+
+@pytest.fixture
+def start_notifier():
+    """
+    Return a function starting a notifier on an inotify section, the
+    notifiers are stopped on teardown.
+    """
+    notifiers = []
+
+    def start(section, plugins = (), wait = True):
+        notifier = inotify.new_notifier(section)
+        conf     = {'general': {'server_id': 'test'},
+                    'inotify': copy.deepcopy(section)}
+        conf['inotify'] = inotify.DWhoInotifyConfig()(notifier, conf['inotify'])
+        notifier.init(conf)
+
+        for plugin in plugins:
+            plugin.init(conf)
+            plugin.safe_init()
+
+        notifier.start()
+        notifiers.append(notifier)
+
+        if wait:
+            wait_for(lambda: notifier.is_scanning() is False)
+
+        return notifier
+
+    yield start
+
+    for notifier in notifiers:
+        notifier.stop()
+        notifier.join(10)
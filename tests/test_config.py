@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""tests.test_config"""
+
+import os
+import threading
+
+import pytest
+
+pytest.importorskip('httpdis')
+pytest.importorskip('mako')
+
+# pylint: disable=wrong-import-position
+from dwho import config
+
+
+class FakeNotifier(object): # pylint: disable=useless-object-inheritance,too-few-public-methods
+    def __init__(self):
+        self.reloads = []
+
+    def reload(self, conf):
+        self.reloads.append(conf)
+        return len(conf.get('paths') or {})
+
+
+@pytest.fixture
+def notifier(tmpdir_path, monkeypatch):
+    xfile = os.path.join(tmpdir_path, 'dwho.yml')
+    with open(xfile, 'w') as f:
+        f.write("general:\n"
+                "  server_id: test.example.org\n"
+                "inotify:\n"
+                "  paths:\n"
+                "    /w: {}\n")
+
+    def parse_conf(conf):
+        conf = config.parse_conf(conf)
+        conf['inotify']['paths']['/x'] = {}
+        return conf
+
+    r = FakeNotifier()
+    monkeypatch.setattr(config, '_INOTIFY', r)
+    monkeypatch.setattr(config, '_CONF_SOURCE', (xfile, None, None, parse_conf, False))
+    return r
+
+
+def test_reload_uses_parse_conf_func(notifier):
+    assert config.reload_inotify() == 2
+    assert sorted(notifier.reloads[0]['paths'].keys()) == ['/w', '/x']
+
+    # the running notifier is kept
+    assert config.get_inotify_instance() is notifier
+
+
+def test_request_reload_is_deferred(notifier, monkeypatch):
+    monkeypatch.setattr(config, '_RELOAD_EVENT', threading.Event())
+
+    config.request_reload()
+    assert config._RELOAD_EVENT.is_set() # pylint: disable=protected-access
+    assert notifier.reloads == []
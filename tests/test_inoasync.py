@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""tests.test_inoasync"""
+
+import os
+import struct
+
+import pyinotify
+
+from dwho.classes.inoasync import DWhoInotifyAsync, decode_events
+from dwho.classes.inotify import NOTIFIER_ASYNCIO, DWhoInotifyCfgPath
+
+from conftest import wait_for
+
+
+def test_decode_events():
+    # pylint: disable=no-member
+    buf = struct.pack('iIII', 1, pyinotify.IN_CREATE, 0, 8) + b'a\0\0\0\0\0\0\0' \
+          + struct.pack('iIII', 2, pyinotify.IN_DELETE_SELF, 0, 0)
+
+    assert decode_events(buf) == [(1, pyinotify.IN_CREATE, 0, 'a'),
+                                  (2, pyinotify.IN_DELETE_SELF, 0, '')]
+
+
+def test_asyncio_notifier(tmpdir_path, recorder, start_notifier):
+    (a, b) = [os.path.join(tmpdir_path, x) for x in ('a', 'b')]
+    for path in (a, b):
+        os.makedirs(path)
+
+    notifier = start_notifier({'notifier': NOTIFIER_ASYNCIO,
+                               'plugins':  {recorder.PLUGIN_NAME: True},
+                               'paths':    {a: {}},
+                               'events':   ['close_write']},
+                              [recorder])
+    assert isinstance(notifier, DWhoInotifyAsync)
+    assert notifier.wm.get_wd(a) is not None
+
+    # requests are futures once the loop runs
+    future = notifier.add(DWhoInotifyCfgPath(b,
+                                             event_mask = notifier.get_flag_value('close_write'),
+                                             plugins    = [recorder]))
+    future.result(10)
+    assert notifier.wm.get_wd(b) is not None
+
+    for path in (a, b):
+        with open(os.path.join(path, 'f'), 'w') as f:
+            f.write('x')
+
+    assert wait_for(lambda: sorted(recorder.paths('IN_CLOSE_WRITE')) == [os.path.join(a, 'f'),
+                                                                          os.path.join(b, 'f')])
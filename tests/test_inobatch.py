@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""tests.test_inobatch"""
+
+import os
+
+import pytest
+
+from dwho.classes.inobatch import DWhoInotifyBatcher
+from dwho.classes.inoplugs import INOPLUGS
+from dwho.classes.inotify import DWhoInotifyCfgPath
+
+from conftest import DWhoTestRecorderPlug, wait_for
+
+
+class DWhoTestBatchPlug(DWhoTestRecorderPlug):
+    PLUGIN_NAME = 'test_batch'
+
+    def __init__(self, name = None):
+        DWhoTestRecorderPlug.__init__(self, name)
+        self.batches = []
+
+    def run_batch(self, items):
+        with self.lock:
+            self.batches.append([x[2] for x in items])
+
+
+@pytest.fixture
+def batch_plugin():
+    plugin = DWhoTestBatchPlug()
+    INOPLUGS.register(plugin)
+    yield plugin
+    INOPLUGS.unregister(plugin)
+
+
+def test_full_batch_returned(batch_plugin):
+    done      = []
+    batcher   = DWhoInotifyBatcher(lambda batch: batch(), done = lambda plugin, items: done.extend(items))
+    cfg_path  = DWhoInotifyCfgPath('/w', plugins = [batch_plugin])
+    batch_plugin.batch_size = 2
+
+    assert batcher.add(batch_plugin, cfg_path, None, '/w/a') is None
+    batch = batcher.add(batch_plugin, cfg_path, None, '/w/b')
+    assert batch is not None
+    assert batcher.pending() == 0
+
+    batch()
+    assert batch_plugin.batches == [['/w/a', '/w/b']]
+    assert [x[2] for x in done] == ['/w/a', '/w/b']
+
+
+def test_timeout_submits(batch_plugin):
+    batcher  = DWhoInotifyBatcher(lambda batch: batch())
+    cfg_path = DWhoInotifyCfgPath('/w', plugins = [batch_plugin])
+    batch_plugin.batch_size    = 100
+    batch_plugin.batch_timeout = 0.05
+    batcher.start()
+
+    try:
+        batcher.add(batch_plugin, cfg_path, None, '/w/a')
+        assert wait_for(lambda: batch_plugin.batches == [['/w/a']])
+    finally:
+        batcher.stop()
+        batcher.join(5)
+
+
+def test_stop_flushes_batches(tmpdir_path, batch_plugin, start_notifier):
+    notifier = start_notifier({'plugins':       {batch_plugin.PLUGIN_NAME: True},
+                               'paths':         {tmpdir_path: {}},
+                               'events':        ['create'],
+                               'batch_size':    100,
+                               'batch_timeout': 60},
+                              [batch_plugin])
+
+    filepaths = [os.path.join(tmpdir_path, "f%d" % i) for i in range(3)]
+    for filepath in filepaths:
+        with open(filepath, 'w') as f:
+            f.write('x')
+    assert wait_for(lambda: notifier.batcher.pending() == len(filepaths))
+
+    notifier.stop()
+    notifier.join(10)
+
+    assert [sorted(x) for x in batch_plugin.batches] == [sorted(filepaths)]
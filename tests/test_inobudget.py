@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""tests.test_inobudget"""
+
+import os
+
+from dwho.classes.inobudget import DWhoInotifyBudget, get_watch_budget
+from dwho.classes.inotrie import DWhoInotifyPathTrie
+
+from conftest import wait_for
+
+
+class FakeInotify(object): # pylint: disable=useless-object-inheritance,too-few-public-methods
+    def __init__(self, paths):
+        self.cfg_paths = DWhoInotifyPathTrie()
+        for path in paths:
+            self.cfg_paths[path] = path
+
+
+def test_get_watch_budget():
+    assert get_watch_budget(100) == 100
+    assert get_watch_budget('100', 4) == 25
+    assert get_watch_budget(0) is None
+    # opt-in
+    assert get_watch_budget(None) is None
+    assert get_watch_budget(-1) is None
+
+
+def test_get_unit():
+    budget = DWhoInotifyBudget(FakeInotify(['/w']), None, 100)
+
+    assert budget.get_unit('/w') == ('/w', '/w')
+    assert budget.get_unit('/w/a') == ('/w', '/w/a')
+    assert budget.get_unit('/w/a/b/c') == ('/w', '/w/a')
+
+
+def test_get_unit_outside_cfg_paths():
+    budget = DWhoInotifyBudget(FakeInotify(['/w']), None, 100)
+
+    assert budget.get_unit('/other/a') == (None, None)
+    assert budget.get_unit('/wx') == (None, None)
+
+
+def test_touch_outside_cfg_paths():
+    budget = DWhoInotifyBudget(FakeInotify(['/w']), None, 100)
+
+    budget.touch('/other/a')
+    assert budget.activity == {}
+
+    budget.touch('/w/a/b')
+    assert list(budget.activity.keys()) == ['/w/a']
+
+
+def test_renamed_root_keeps_notifier_alive(tmpdir_path, recorder, start_notifier):
+    root  = os.path.join(tmpdir_path, 'root')
+    other = os.path.join(tmpdir_path, 'other')
+    os.makedirs(root)
+    os.makedirs(other)
+
+    notifier = start_notifier({'plugins':      {recorder.PLUGIN_NAME: True},
+                               'paths':        {root: {}, other: {}},
+                               'events':       ['close_write', 'move_self'],
+                               'watch_budget': 1000},
+                              [recorder])
+    assert notifier.budget is not None
+
+    # events of the moved root are reported outside every cfg_path
+    os.rename(root, os.path.join(tmpdir_path, 'moved'))
+    with open(os.path.join(tmpdir_path, 'moved', 'f'), 'w') as f:
+        f.write('x')
+
+    filepath = os.path.join(other, 'g')
+    with open(filepath, 'w') as f:
+        f.write('x')
+
+    assert wait_for(lambda: filepath in recorder.paths('IN_CLOSE_WRITE'))
+    assert notifier.notifier.is_alive()
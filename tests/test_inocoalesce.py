@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""tests.test_inocoalesce"""
+
+import os
+
+import pyinotify
+
+from dwho.classes.inocoalesce import DWhoInotifyCoalescer
+from dwho.classes.inotify import DWhoInotifyCfgPath
+
+from conftest import wait_for
+
+
+class FakeEvent(object): # pylint: disable=useless-object-inheritance,too-few-public-methods
+    def __init__(self, mask):
+        self.mask = mask
+
+
+def new_coalescer():
+    dispatched = []
+    coalescer  = DWhoInotifyCoalescer(lambda cfg_path, event, filepath: dispatched.append((event, filepath)))
+    return (coalescer, dispatched)
+
+
+def test_merge():
+    (coalescer, dispatched) = new_coalescer()
+    cfg_path = DWhoInotifyCfgPath('/w', plugins = [])
+
+    coalescer.push(cfg_path, FakeEvent(pyinotify.IN_MODIFY), '/w/a', 10, 20) # pylint: disable=no-member
+    last = FakeEvent(pyinotify.IN_CLOSE_WRITE) # pylint: disable=no-member
+    coalescer.push(cfg_path, last, '/w/a', 10, 20)
+    coalescer.push(cfg_path, FakeEvent(pyinotify.IN_MODIFY), '/w/b', 10, 20) # pylint: disable=no-member
+
+    assert coalescer.pending() == 2
+    assert coalescer.merged == 1
+
+    coalescer.flush()
+    assert coalescer.pending() == 0
+    assert sorted([x[1] for x in dispatched]) == ['/w/a', '/w/b']
+
+    event = [x[0] for x in dispatched if x[1] == '/w/a'][0]
+    assert event is last
+    assert event.mask == pyinotify.IN_CLOSE_WRITE # pylint: disable=no-member
+    assert event.coalesced_count == 2
+    assert event.coalesced_mask == pyinotify.IN_MODIFY | pyinotify.IN_CLOSE_WRITE # pylint: disable=no-member
+
+
+def test_disabled_by_default():
+    assert not DWhoInotifyCfgPath('/w').coalesce_window
+
+
+def test_window():
+    (coalescer, dispatched) = new_coalescer()
+    cfg_path = DWhoInotifyCfgPath('/w', plugins = [])
+    coalescer.start()
+
+    try:
+        coalescer.push(cfg_path, FakeEvent(pyinotify.IN_MODIFY), '/w/a', 0.05, 1) # pylint: disable=no-member
+        assert wait_for(lambda: len(dispatched) == 1)
+        assert coalescer.pending() == 0
+    finally:
+        coalescer.stop()
+        coalescer.join(5)
+
+
+def test_stop_flushes_window(tmpdir_path, recorder, start_notifier):
+    notifier = start_notifier({'plugins':         {recorder.PLUGIN_NAME: True},
+                               'paths':           {tmpdir_path: {}},
+                               'events':          ['create'],
+                               'coalesce_window': 60},
+                              [recorder])
+
+    filepath = os.path.join(tmpdir_path, 'a')
+    with open(filepath, 'w') as f:
+        f.write('x')
+    assert wait_for(lambda: notifier.coalescer.pending() == 1)
+
+    notifier.stop()
+    notifier.join(10)
+
+    assert recorder.paths('IN_CREATE') == [filepath]
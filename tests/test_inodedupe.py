@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""tests.test_inodedupe"""
+
+import os
+
+import pyinotify
+
+from dwho.classes.inodedupe import DWhoInotifyDedupe
+
+from conftest import wait_for
+
+
+class FakeEvent(object): # pylint: disable=useless-object-inheritance,too-few-public-methods
+    def __init__(self, mask, isdir = False):
+        self.dir  = isdir
+        self.mask = mask
+
+
+def write(filepath, data, mtime = None):
+    with open(filepath, 'w') as f:
+        f.write(data)
+    if mtime is not None:
+        os.utime(filepath, (mtime, mtime))
+
+
+def test_is_candidate():
+    dedupe = DWhoInotifyDedupe()
+
+    # pylint: disable=no-member
+    assert dedupe.is_candidate(FakeEvent(pyinotify.IN_CLOSE_WRITE))
+    assert not dedupe.is_candidate(FakeEvent(pyinotify.IN_CREATE))
+    assert not dedupe.is_candidate(FakeEvent(pyinotify.IN_ATTRIB))
+    assert not dedupe.is_candidate(FakeEvent(pyinotify.IN_CLOSE_WRITE, True))
+
+
+def test_changed(tmpdir_path):
+    dedupe   = DWhoInotifyDedupe()
+    filepath = os.path.join(tmpdir_path, 'a')
+
+    write(filepath, 'x', 1000)
+    assert dedupe.changed(filepath)
+    assert dedupe.unchanged(filepath)
+    assert not dedupe.changed(filepath)
+
+    # rewritten with the same content
+    write(filepath, 'x', 2000)
+    assert not dedupe.unchanged(filepath)
+    assert not dedupe.changed(filepath)
+    assert dedupe.unchanged(filepath)
+
+    write(filepath, 'y', 3000)
+    assert dedupe.changed(filepath)
+
+    dedupe.forget(filepath)
+    assert dedupe.changed(filepath)
+
+    # plugins run on what can't be read
+    assert dedupe.changed(os.path.join(tmpdir_path, 'none'))
+    assert dedupe.changed(tmpdir_path)
+    assert len(dedupe) == 1
+
+
+def test_lru(tmpdir_path):
+    dedupe = DWhoInotifyDedupe(2)
+
+    for name in ('a', 'b', 'c'):
+        write(os.path.join(tmpdir_path, name), name)
+        dedupe.changed(os.path.join(tmpdir_path, name))
+
+    assert len(dedupe) == 2
+    assert not dedupe.unchanged(os.path.join(tmpdir_path, 'a'))
+    assert dedupe.unchanged(os.path.join(tmpdir_path, 'c'))
+
+
+def test_save_load(tmpdir_path):
+    cachefile = os.path.join(tmpdir_path, 'dedupe.cache')
+    filepath  = os.path.join(tmpdir_path, 'a')
+    write(filepath, 'x')
+
+    dedupe = DWhoInotifyDedupe(filepath = cachefile)
+    dedupe.changed(filepath)
+    dedupe.save()
+
+    assert DWhoInotifyDedupe(filepath = cachefile).load().unchanged(filepath)
+    assert not DWhoInotifyDedupe(filepath = cachefile, algorithm = 'md5').load().unchanged(filepath)
+
+    with open(cachefile, 'wb') as f:
+        f.write(b'x')
+    assert len(DWhoInotifyDedupe(filepath = cachefile).load()) == 0
+
+
+def test_same_content_skipped(tmpdir_path, recorder, start_notifier):
+    root = os.path.join(tmpdir_path, 'root')
+    os.makedirs(root)
+
+    notifier = start_notifier({'plugins': {recorder.PLUGIN_NAME: True},
+                               'paths':   {root: {'dedupe': True}},
+                               'events':  ['close_write']},
+                              [recorder])
+    assert notifier.dedupe is not None
+
+    filepath = os.path.join(root, 'a')
+    write(filepath, 'x')
+    assert wait_for(lambda: recorder.paths('IN_CLOSE_WRITE') == [filepath])
+
+    write(filepath, 'x')
+    assert wait_for(lambda: notifier.dedupe.hits == 1)
+
+    write(filepath, 'y')
+    assert wait_for(lambda: len(recorder.paths('IN_CLOSE_WRITE')) == 2)
+
+
+def test_attrib_not_skipped(tmpdir_path, recorder, start_notifier):
+    root = os.path.join(tmpdir_path, 'root')
+    os.makedirs(root)
+
+    notifier = start_notifier({'plugins': {recorder.PLUGIN_NAME: True},
+                               'paths':   {root: {'dedupe': True}},
+                               'events':  ['close_write', 'attrib']},
+                              [recorder])
+
+    filepath = os.path.join(root, 'a')
+    write(filepath, 'x')
+    assert wait_for(lambda: recorder.paths('IN_CLOSE_WRITE') == [filepath])
+
+    os.chmod(filepath, 0o600)
+    assert wait_for(lambda: recorder.paths('IN_ATTRIB') == [filepath])
+
+    os.chmod(filepath, 0o640)
+    assert wait_for(lambda: recorder.paths('IN_ATTRIB') == [filepath, filepath])
+    assert notifier.dedupe.hits == 0
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""tests.test_inoexclude"""
+
+import os
+import pickle
+
+import pyinotify
+import pytest
+
+from dwho.classes.inoexclude import (DWhoInotifyExcludeFilter,
+                                     DWhoInotifyIncludeFilter,
+                                     DWhoInotifyWatchFilter,
+                                     glob_root,
+                                     literal_prefix)
+
+from conftest import wait_for
+
+
+@pytest.mark.parametrize('pattern,prefix', [(r'^/w/a\.tmp$', '/w/a.tmp'),
+                                            (r'/w/cache/.*', '/w/cache/'),
+                                            (r'/w/ab?c', '/w/a'),
+                                            (r'/w/\d+', '/w/'),
+                                            (r'/w/a|/x', ''),
+                                            (r'.*\.swp$', '')])
+def test_literal_prefix(pattern, prefix):
+    assert literal_prefix(pattern) == prefix
+
+
+def test_glob_root():
+    assert glob_root('/w/*/a') == '/w'
+    assert glob_root('/w/a') == '/w/a'
+
+
+@pytest.mark.parametrize('path', ['/w/a.tmp', '/w/b', '/w/cache', '/w/cache/x',
+                                  '/x/cache/x', '/w/aa', '/w/ab/ab', '/w/a.swp'])
+def test_same_verdicts_as_pyinotify(path):
+    patterns = [r'/w/cache/.*', r'.*\.tmp$', r'/w/(a)b/\1', r'/w/a\.swp']
+
+    assert DWhoInotifyExcludeFilter(patterns)(path) == pyinotify.ExcludeFilter(patterns)(path)
+
+
+def test_excluded_directory_content():
+    exclude = DWhoInotifyExcludeFilter([r'^/w/cache$'], '/w')
+
+    assert exclude('/w/cache')
+    assert exclude('/w/cache/a/b')
+    assert not exclude('/w/cached/a')
+    # content of an excluded directory outside root is matched as is
+    assert not DWhoInotifyExcludeFilter([r'^/w/cache$'], '/x')('/w/cache/a')
+
+
+def test_cache_size():
+    exclude = DWhoInotifyExcludeFilter([r'^/w/cache$'], '/w', cache_size = 2)
+
+    for name in ('a', 'b', 'c'):
+        exclude("/w/%s/f" % name)
+
+    # the root verdict is used by every lookup
+    assert list(exclude._cache.keys()) == ['/w', '/w/c'] # pylint: disable=protected-access
+
+
+def test_picklable():
+    exclude  = DWhoInotifyExcludeFilter([r'^/w/cache$', r'/w/(a)b/\1'], '/w')
+    xexclude = pickle.loads(pickle.dumps(exclude))
+
+    assert xexclude.root == '/w'
+    assert xexclude('/w/cache/a')
+    assert xexclude('/w/ab/a')
+    assert not xexclude('/w/a')
+
+
+def test_include_files():
+    include = DWhoInotifyIncludeFilter('/w', files = ['*.txt', 'a?'])
+
+    assert include('/w/x/b.txt')
+    assert include('/w/ab')
+    assert not include('/w/abc')
+    assert not include('/w/x', isdir = True)
+    assert not include.prune('/w/x')
+
+
+def test_include_dirs():
+    include = DWhoInotifyIncludeFilter('/w', dirs = ['data/*/in', 'logs/**/raw'])
+
+    assert include('/w/data/a/in/f')
+    assert include('/w/data/a/in/x/f')
+    assert not include('/w/data/a/out/f')
+    assert include('/w/logs/raw/f')
+    assert include('/w/logs/a/b/raw/f')
+
+    assert include.dir_verdict('/w/data/a') is None
+    assert not include.prune('/w/data/a')
+    assert include.prune('/w/data/a/out')
+    assert include.prune('/w/other')
+    assert not include.prune('/w/logs/a/b')
+
+    assert include('/w/data/a/in', isdir = True)
+    assert not include('/w/data/a', isdir = True)
+
+
+def test_watch_filter():
+    watch_filter = DWhoInotifyWatchFilter(DWhoInotifyExcludeFilter([r'^/w/data/tmp$'], '/w'),
+                                          DWhoInotifyIncludeFilter('/w', dirs = ['data']))
+
+    assert not watch_filter('/w/data')
+    assert watch_filter('/w/data/tmp')
+    assert watch_filter('/w/other')
+
+
+def test_include_picklable():
+    include  = DWhoInotifyIncludeFilter('/w', files = ['*.txt'], dirs = ['data'])
+    xinclude = pickle.loads(pickle.dumps(include))
+
+    assert xinclude.patterns == include.patterns
+    assert xinclude('/w/data/a.txt')
+    assert not xinclude('/w/data/a.log')
+
+
+def test_include_dirs_pruned_at_watch_time(tmpdir_path, recorder, start_notifier):
+    root = os.path.join(tmpdir_path, 'root')
+    for x in ('data/in', 'other/sub'):
+        os.makedirs(os.path.join(root, x))
+
+    notifier = start_notifier({'plugins': {recorder.PLUGIN_NAME: True},
+                               'paths':   {root: {'include_dirs':  ['data'],
+                                                  'include_files': ['*.txt']}},
+                               'events':  ['close_write']},
+                              [recorder])
+
+    assert notifier.wm.get_wd(os.path.join(root, 'data', 'in')) is not None
+    assert notifier.wm.get_wd(os.path.join(root, 'other')) is None
+
+    for x in ('other/a.txt', 'data/in/a.log', 'data/in/a.txt'):
+        with open(os.path.join(root, x), 'w') as f:
+            f.write('x')
+
+    filepath = os.path.join(root, 'data', 'in', 'a.txt')
+    assert wait_for(lambda: filepath in recorder.paths('IN_CLOSE_WRITE'))
+    assert recorder.paths('IN_CLOSE_WRITE') == [filepath]
+
+
+def test_include_files_only(tmpdir_path, recorder, start_notifier):
+    root = os.path.join(tmpdir_path, 'root')
+    os.makedirs(root)
+
+    notifier = start_notifier({'plugins': {recorder.PLUGIN_NAME: True},
+                               'paths':   {root: {'include_files': ['*.txt']}},
+                               'events':  ['create']},
+                              [recorder])
+
+    os.makedirs(os.path.join(root, 'sub'))
+    assert wait_for(lambda: notifier.wm.get_wd(os.path.join(root, 'sub')) is not None)
+
+    filepath = os.path.join(root, 'sub', 'a.txt')
+    for x in ('sub/a.log', 'sub/a.txt'):
+        with open(os.path.join(root, x), 'w') as f:
+            f.write('x')
+
+    # the directory events are dropped, the directories still watched
+    assert wait_for(lambda: filepath in recorder.paths())
+    assert recorder.paths() == [filepath]
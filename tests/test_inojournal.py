@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""tests.test_inojournal"""
+
+import os
+
+import pyinotify
+import pytest
+
+from dwho.classes.inojournal import SEGMENT_SUFFIX, DWhoInotifyJournal
+
+
+class FakeCfgPath(object): # pylint: disable=useless-object-inheritance,too-few-public-methods
+    def __init__(self, path):
+        self.path = path
+
+
+class FakeTask(object): # pylint: disable=useless-object-inheritance,too-few-public-methods
+    def __init__(self, filepath):
+        self.cfg_path = FakeCfgPath('/w')
+        self.event    = pyinotify.Event({'wd':       1,
+                                         'mask':     pyinotify.IN_CLOSE_WRITE, # pylint: disable=no-member
+                                         'path':     '/w',
+                                         'name':     os.path.basename(filepath),
+                                         'pathname': filepath})
+        self.filepath = filepath
+
+
+@pytest.fixture
+def new_journal(tmpdir_path):
+    """
+    Return a function starting a journal on tmpdir_path, the journals
+    are stopped on teardown.
+    """
+    journals = []
+
+    def start(submit = None, **kwargs):
+        journal = DWhoInotifyJournal(os.path.join(tmpdir_path, 'journal'),
+                                     submit or (lambda task: None),
+                                     **kwargs)
+        replay  = journal.load()
+        journal.start()
+        journals.append(journal)
+        return (journal, replay)
+
+    yield start
+
+    for journal in journals:
+        journal.stop()
+        journal.join(5)
+
+
+def stop(journal):
+    journal.stop()
+    journal.join(5)
+    assert not journal.is_alive()
+
+
+def get_segments(journal):
+    return sorted([x for x in os.listdir(journal.path) if x.endswith(SEGMENT_SUFFIX)])
+
+
+def test_submit_once_committed(new_journal):
+    submitted      = []
+    (journal, _)   = new_journal(submitted.append)
+
+    tasks = [FakeTask("/w/%d" % i) for i in range(5)]
+    for task in tasks:
+        journal.append(task, ['a'])
+
+    assert journal.flush(5)
+    assert journal.committed == 5
+    assert [x.event.journal_seq for x in tasks] == [1, 2, 3, 4, 5]
+
+    stop(journal)
+    assert submitted == tasks
+
+
+def test_replay_not_done(new_journal):
+    (journal, replay) = new_journal()
+    assert replay == []
+
+    seqs = [journal.append(FakeTask("/w/%d" % i), ['a', 'b']) for i in range(3)]
+    assert journal.flush(5)
+
+    journal.done(seqs[0], ['a', 'b'])
+    journal.done(seqs[1], ['a'])
+    journal.done(seqs[2], ['a', 'b'])
+    assert journal.get_offsets() == {'b': 1}
+    stop(journal)
+
+    # b is replayed from its offset on: at least once
+    (journal, replay) = new_journal()
+    assert [(x[0], x[2], x[4]) for x in replay] == [(2, ['b'], '/w/1'), (3, ['b'], '/w/2')]
+    assert pyinotify.Event(replay[0][3]).pathname == '/w/1'
+
+    # new entries follow the former ones
+    assert journal.append(FakeTask('/w/3'), ['a']) == 4
+
+
+def test_torn_entry(new_journal):
+    (journal, _) = new_journal()
+
+    for i in range(2):
+        journal.append(FakeTask("/w/%d" % i), ['a'])
+    assert journal.flush(5)
+    stop(journal)
+
+    filepath = os.path.join(journal.path, get_segments(journal)[-1])
+    with open(filepath, 'ab') as f:
+        f.write(b'\x00\x00\x01')
+
+    (journal, replay) = new_journal()
+    assert [x[4] for x in replay] == ['/w/0', '/w/1']
+
+
+def test_segments_removed_when_done(new_journal):
+    (journal, _) = new_journal(segment_size = 1, checkpoint_interval = 60)
+
+    seqs = []
+    for i in range(3):
+        seqs.append(journal.append(FakeTask("/w/%d" % i), ['a']))
+        assert journal.flush(5)
+    assert len(get_segments(journal)) == 3
+
+    for seq in seqs:
+        journal.done(seq, ['a'])
+    journal.checkpoint()
+
+    # the current segment is kept
+    assert len(get_segments(journal)) == 1
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""tests.test_inolane"""
+
+import os
+import time
+
+import pytest
+
+from dwho.classes.inolane import ORDERING_DIR, ORDERING_FILE, DWhoInotifyLanes, get_task_key
+from dwho.classes.inoplugs import INOPLUGS
+from dwho.classes.inoqueue import POLICY_BLOCK
+
+from conftest import DWhoTestRecorderPlug, wait_for
+
+
+class FakeCfgPath(object): # pylint: disable=useless-object-inheritance,too-few-public-methods
+    def __init__(self, path):
+        self.path = path
+
+
+class FakeEvent(object): # pylint: disable=useless-object-inheritance,too-few-public-methods
+    def __init__(self, pathname):
+        self.pathname = pathname
+
+
+class FakeTask(object): # pylint: disable=useless-object-inheritance,too-few-public-methods
+    def __init__(self, filepath, event = True):
+        self.cfg_path = FakeCfgPath('/w')
+        self.event    = FakeEvent(filepath) if event else None
+        self.filepath = filepath
+
+
+class DWhoTestSlowCreatePlug(DWhoTestRecorderPlug):
+    """
+    Record the events, IN_CREATE ones being slow to run.
+    """
+
+    PLUGIN_NAME = 'test_slow_create'
+
+    def run(self, cfg_path, event, filepath):
+        if event.maskname == 'IN_CREATE':
+            time.sleep(0.05)
+        DWhoTestRecorderPlug.run(self, cfg_path, event, filepath)
+
+
+@pytest.fixture
+def slow_plugin():
+    plugin = DWhoTestSlowCreatePlug()
+    INOPLUGS.register(plugin)
+    yield plugin
+    INOPLUGS.unregister(plugin)
+
+
+def test_get_task_key():
+    assert get_task_key(FakeTask('/w/d/a')) == '/w/d/a'
+    assert get_task_key(FakeTask('/w/d/a'), ORDERING_DIR) == '/w/d'
+    # batches are ordered per cfg_path
+    assert get_task_key(FakeTask('/w/d/a', False)) == '/w'
+
+
+def test_get_lane():
+    lanes = DWhoInotifyLanes(4, 0, POLICY_BLOCK, ORDERING_FILE)
+    try:
+        assert len(lanes.lanes) == 4
+        assert lanes.get_lane(FakeTask('/w/a')) is lanes.get_lane(FakeTask('/w/a'))
+        assert len(set([lanes.get_lane(FakeTask("/w/%d" % i)) for i in range(32)])) > 1
+        assert lanes.stats()['lanes'] == 4
+    finally:
+        lanes.killall(0)
+
+
+def test_per_file_order(tmpdir_path, slow_plugin, start_notifier):
+    root = os.path.join(tmpdir_path, 'root')
+    os.makedirs(root)
+
+    start_notifier({'plugins':     {slow_plugin.PLUGIN_NAME: True},
+                    'paths':       {root: {}},
+                    'events':      ['create', 'close_write', 'delete'],
+                    'ordering':    ORDERING_FILE,
+                    'max_workers': 4},
+                   [slow_plugin])
+
+    filepaths = [os.path.join(root, "f%d" % i) for i in range(8)]
+    for filepath in filepaths:
+        with open(filepath, 'w') as f:
+            f.write('x')
+        os.unlink(filepath)
+
+    assert wait_for(lambda: len(slow_plugin.records) == 3 * len(filepaths))
+
+    for filepath in filepaths:
+        assert [x[1] for x in slow_plugin.records if x[2] == filepath] == \
+            ['IN_CREATE', 'IN_CLOSE_WRITE', 'IN_DELETE']
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""tests.test_inoplugs"""
+
+import threading
+
+import pyinotify
+
+from dwho.classes.inoplugs import CACHE_EXPIRE, PLUGPOOL
+from dwho.classes.inotify import DWhoInotifyCfgPath, DWhoInotifyPlugs
+
+from conftest import DWhoTestRecorderPlug
+
+
+CONFIG = {'general': {'server_id': 'test'},
+          'inotify': {'lock_timeout': 5}}
+
+
+def new_event():
+    return pyinotify.Event({'wd':       1,
+                            'mask':     pyinotify.IN_CLOSE_WRITE, # pylint: disable=no-member
+                            'maskname': 'IN_CLOSE_WRITE',
+                            'path':     '/w',
+                            'name':     'a',
+                            'pathname': '/w/a'})
+
+
+def test_plugpool_reuses_copies():
+    plugin = DWhoTestRecorderPlug()
+
+    copy1  = PLUGPOOL.get(plugin)
+    assert copy1 is not plugin
+    assert PLUGPOOL.get(plugin) is copy1
+
+    r = []
+    thread = threading.Thread(target = lambda: r.append(PLUGPOOL.get(plugin)))
+    thread.start()
+    thread.join()
+    assert r[0] is not copy1
+
+    # a plugin registered again gets a new copy
+    assert PLUGPOOL.get(DWhoTestRecorderPlug()) is not copy1
+
+
+def test_plugs_positional_signature():
+    plugin   = DWhoTestRecorderPlug()
+    cfg_path = DWhoInotifyCfgPath('/w', plugins = [plugin])
+    event    = new_event()
+    event.plugs_flag = threading.Event()
+
+    plugs = DWhoInotifyPlugs(CONFIG, cfg_path, event, '/w/a')
+    assert plugs.config is CONFIG
+    assert plugs.server_id == 'test'
+    assert plugs.timeout == 5
+    assert plugs.cache_expire == CACHE_EXPIRE
+
+    plugs()
+    assert plugin.records == [('test_recorder', 'IN_CLOSE_WRITE', '/w/a')]
+    assert event.plugs_flag.is_set()
+
+
+def test_plugs_subclass_attributes():
+    class DWhoTestPlugs(DWhoInotifyPlugs):
+        def __init__(self, config, cfg_path, event, filepath, **kwargs):
+            DWhoInotifyPlugs.__init__(self, config, cfg_path, event, filepath, **kwargs)
+            self.custom = True
+
+    plugs = DWhoTestPlugs(CONFIG, DWhoInotifyCfgPath('/w', plugins = []), new_event(), '/w/a')
+    assert plugs.custom
+
+
+def test_get_event_mask():
+    event = new_event()
+    assert DWhoTestRecorderPlug.get_event_mask(event) == pyinotify.IN_CLOSE_WRITE # pylint: disable=no-member
+
+    event.coalesced_mask = pyinotify.IN_MODIFY | pyinotify.IN_CLOSE_WRITE # pylint: disable=no-member
+    assert DWhoTestRecorderPlug.get_event_mask(event) == event.coalesced_mask
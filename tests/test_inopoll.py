@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""tests.test_inopoll"""
+
+import os
+
+from dwho.classes.inopoll import BACKEND_POLL, list_dir
+
+from conftest import wait_for
+
+
+def write(filepath, mtime = None):
+    with open(filepath, 'w') as f:
+        f.write('x')
+    if mtime is not None:
+        os.utime(filepath, (mtime, mtime))
+
+
+def test_list_dir(tmpdir_path):
+    os.makedirs(os.path.join(tmpdir_path, 'd'))
+    write(os.path.join(tmpdir_path, 'a'))
+    os.symlink(os.path.join(tmpdir_path, 'd'), os.path.join(tmpdir_path, 'l'))
+
+    (files, subdirs) = list_dir(tmpdir_path)
+    assert sorted(files.keys()) == ['a', 'l']
+    assert subdirs == set(['d'])
+
+
+def test_poll_backend(tmpdir_path, recorder, start_notifier):
+    root = os.path.join(tmpdir_path, 'root')
+    os.makedirs(os.path.join(root, 'd'))
+    write(os.path.join(root, 'a'))
+
+    notifier = start_notifier({'plugins': {recorder.PLUGIN_NAME: True},
+                               'paths':   {root: {'backend':       BACKEND_POLL,
+                                                  'poll_interval': 0.1}},
+                               'events':  ['create', 'close_write', 'delete']},
+                              [recorder])
+    assert root in notifier.poller
+    assert notifier.wm.get_wd(root) is None
+
+    # the files found on start are the baseline
+    write(os.path.join(root, 'd', 'b'))
+    assert wait_for(lambda: len(recorder.records) == 2)
+    assert sorted([x[1:] for x in recorder.records]) == \
+        [('IN_CLOSE_WRITE', os.path.join(root, 'd', 'b')),
+         ('IN_CREATE', os.path.join(root, 'd', 'b'))]
+
+    write(os.path.join(root, 'a'), 1000)
+    assert wait_for(lambda: os.path.join(root, 'a') in recorder.paths('IN_CLOSE_WRITE'))
+
+    os.unlink(os.path.join(root, 'd', 'b'))
+    assert wait_for(lambda: recorder.paths('IN_DELETE') == [os.path.join(root, 'd', 'b')])
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""tests.test_inoproc"""
+
+import os
+import pickle
+
+import pyinotify
+import pytest
+
+from dwho.classes.inoexclude import DWhoInotifyExcludeFilter
+from dwho.classes.inoplugs import DWhoInoEventPlugBase, INOPLUGS
+from dwho.classes.inoproc import DWhoInotifyProcessExecutor, event_record
+from dwho.classes.inotify import DWhoInotifyCfgPath
+
+from conftest import wait_for
+
+
+class DWhoTestProcessPlug(DWhoInoEventPlugBase):
+    """
+    Write the pid of the pool worker and the filepath of every event
+    next to the cfg_path.
+    """
+
+    PLUGIN_NAME = 'test_process'
+
+    def run(self, cfg_path, event, filepath):
+        with open(os.path.join(os.path.dirname(cfg_path.path), 'process.log'), 'a') as f:
+            f.write("%d %s %s\n" % (os.getpid(), event.maskname, filepath))
+
+
+# registered on import, as in the pool workers
+PLUGIN = DWhoTestProcessPlug()
+INOPLUGS.register(PLUGIN)
+
+
+@pytest.fixture
+def process_plugin():
+    if PLUGIN.PLUGIN_NAME not in INOPLUGS:
+        INOPLUGS.register(PLUGIN)
+    yield PLUGIN
+    INOPLUGS.unregister(PLUGIN)
+
+
+def read_log(path):
+    if not os.path.exists(path):
+        return []
+
+    with open(path, 'r') as f:
+        return [x.split() for x in f.read().splitlines()]
+
+
+def test_event_record():
+    event = pyinotify.Event({'wd':       1,
+                             'mask':     pyinotify.IN_CLOSE_WRITE, # pylint: disable=no-member
+                             'path':     '/w',
+                             'name':     'a',
+                             'pathname': '/w/a'})
+    event.plugs_flag = object()
+
+    record = event_record(event)
+    assert 'plugs_flag' not in record
+    assert pyinotify.Event(record).pathname == '/w/a'
+
+
+def test_cfg_path_picklable():
+    cfg_path = DWhoInotifyCfgPath('/w',
+                                  exclude_filter = DWhoInotifyExcludeFilter([r'.*\.tmp$'], '/w'),
+                                  plugins        = [PLUGIN])
+    cfg_path.watch_filter # pylint: disable=pointless-statement
+
+    xcfg_path = pickle.loads(pickle.dumps(cfg_path))
+    assert xcfg_path.exclude_filter('/w/a.tmp')
+    assert not xcfg_path.exclude_filter('/w/a')
+
+
+def test_get_key():
+    executor = DWhoInotifyProcessExecutor({})
+    cfg_path = DWhoInotifyCfgPath('/w', plugins = [PLUGIN])
+
+    key = executor.get_key(cfg_path)
+    assert executor.get_key(cfg_path) == key
+
+    # copies with a subset of the plugins share the key
+    xcfg_path         = DWhoInotifyCfgPath('/w', plugins = [])
+    assert executor.get_key(xcfg_path) == key
+
+    # sent again to the workers once changed
+    cfg_path.coalesce_window = 10
+    assert executor.get_key(cfg_path) != key
+
+
+def test_process_executor(tmpdir_path, process_plugin, start_notifier):
+    root = os.path.join(tmpdir_path, 'root')
+    os.makedirs(root)
+
+    notifier = start_notifier({'plugins':       {process_plugin.PLUGIN_NAME: {'enabled':          True,
+                                                                             'executor':         'process',
+                                                                             'executor_workers': 2}},
+                               'paths':         {root: {}},
+                               'exclude_files': [],
+                               'events':        ['close_write']},
+                              [process_plugin])
+    assert wait_for(lambda: notifier.executor is not None)
+    assert process_plugin.PLUGIN_NAME in notifier.executor
+
+    filepaths = [os.path.join(root, "f%d" % i) for i in range(10)]
+    for filepath in filepaths:
+        with open(filepath, 'w') as f:
+            f.write('x')
+
+    logfile = os.path.join(tmpdir_path, 'process.log')
+    def get_lines():
+        return [x for x in read_log(logfile) if x[1] == 'IN_CLOSE_WRITE']
+
+    assert wait_for(lambda: len(get_lines()) == len(filepaths))
+
+    lines = get_lines()
+    assert sorted([x[2] for x in lines]) == sorted(filepaths)
+    assert os.getpid() not in [int(x[0]) for x in lines]
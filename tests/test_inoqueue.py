@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""tests.test_inoqueue"""
+
+import os
+import time
+
+import pytest
+import pyinotify
+
+from dwho.classes.inojournal import DWhoInotifyJournal
+from dwho.classes.inoqueue import (POLICY_COALESCE,
+                                   POLICY_DROP_OLDEST,
+                                   DWhoInotifyDispatchQueue,
+                                   DWhoInotifyFairQueue)
+from dwho.classes.inotify import DWhoInotifyPlugs
+
+from conftest import wait_for
+
+
+class FakeCfgPath(object): # pylint: disable=useless-object-inheritance,too-few-public-methods
+    def __init__(self, path, plugins = (), weight = None):
+        self.path    = path
+        self.plugins = list(plugins)
+        self.weight  = weight
+
+
+class FakePlugin(object): # pylint: disable=useless-object-inheritance,too-few-public-methods
+    PLUGIN_NAME = 'fake'
+
+
+class FakeEvent(object): # pylint: disable=useless-object-inheritance,too-few-public-methods
+    def __init__(self, mask = pyinotify.IN_CLOSE_WRITE): # pylint: disable=no-member
+        self.mask = mask
+
+
+def new_task(cfg_path, filepath, mask = pyinotify.IN_CLOSE_WRITE): # pylint: disable=no-member
+    return (DWhoInotifyPlugs(None, cfg_path, FakeEvent(mask), filepath), None, None, (), {})
+
+
+def get_filepaths(q):
+    r = []
+    while not q.empty():
+        r.append(q.get_nowait()[0].filepath)
+    return r
+
+
+@pytest.mark.parametrize('klass', [DWhoInotifyDispatchQueue, DWhoInotifyFairQueue])
+def test_drop_oldest(klass):
+    cfg_path = FakeCfgPath('/w')
+    q        = klass(2, POLICY_DROP_OLDEST)
+
+    for name in ('a', 'b', 'c'):
+        q.put(new_task(cfg_path, '/w/' + name))
+
+    assert q.stats()['dropped'] == 1
+    assert get_filepaths(q) == ['/w/b', '/w/c']
+
+
+@pytest.mark.parametrize('klass', [DWhoInotifyDispatchQueue, DWhoInotifyFairQueue])
+def test_coalesce(klass):
+    cfg_path = FakeCfgPath('/w')
+    q        = klass(2, POLICY_COALESCE)
+
+    q.put(new_task(cfg_path, '/w/a', pyinotify.IN_MODIFY)) # pylint: disable=no-member
+    q.put(new_task(cfg_path, '/w/b'))
+    q.put(new_task(cfg_path, '/w/a'))
+
+    assert q.stats()['coalesced'] == 1
+    items = []
+    while not q.empty():
+        items.append(q.get_nowait()[0])
+
+    assert [x.filepath for x in items] == ['/w/a', '/w/b']
+    assert items[0].event.coalesced_count == 2
+    assert items[0].event.coalesced_mask == pyinotify.IN_MODIFY | pyinotify.IN_CLOSE_WRITE # pylint: disable=no-member
+
+
+def test_fair_scheduling():
+    busy  = FakeCfgPath('/busy')
+    quiet = FakeCfgPath('/quiet', weight = 2)
+    q     = DWhoInotifyFairQueue()
+
+    for i in range(4):
+        q.put(new_task(busy, "/busy/%d" % i))
+    q.put(new_task(quiet, '/quiet/0'))
+    q.put(new_task(quiet, '/quiet/1'))
+
+    assert get_filepaths(q) == ['/busy/0', '/quiet/0', '/quiet/1', '/busy/1', '/busy/2', '/busy/3']
+
+
+@pytest.mark.parametrize('klass', [DWhoInotifyDispatchQueue, DWhoInotifyFairQueue])
+@pytest.mark.parametrize('policy', [POLICY_DROP_OLDEST, POLICY_COALESCE])
+def test_journal_done_when_discarded(tmpdir_path, klass, policy):
+    journal  = DWhoInotifyJournal(tmpdir_path, lambda task: None)
+    journal.load()
+
+    cfg_path = FakeCfgPath('/w', [FakePlugin()])
+    q        = klass(1, policy)
+
+    for _ in range(3):
+        task = new_task(cfg_path, '/w/a')
+        task[0].journal = journal
+        journal.append(task[0], ['fake'])
+        q.put(task)
+
+    # only the queued task is pending, the others won't run
+    assert journal.pending() == 1
+    assert journal.get_offsets() == {'fake': 2}
+
+    task = q.get_nowait()[0]
+    task.discard()
+    assert journal.pending() == 0
+    assert journal.get_offsets() == {}
+
+
+def test_overflow_rescan(tmpdir_path, recorder, start_notifier):
+    root = os.path.join(tmpdir_path, 'root')
+    sub  = os.path.join(root, 'sub')
+    os.makedirs(sub)
+    for name, mtime in (('old', 1000), ('new', None)):
+        with open(os.path.join(sub, name), 'w') as f:
+            f.write('x')
+        if mtime:
+            os.utime(os.path.join(sub, name), (mtime, mtime))
+
+    notifier = start_notifier({'plugins': {recorder.PLUGIN_NAME: True},
+                               'paths':   {root: {}},
+                               'events':  ['close_write']},
+                              [recorder])
+
+    # events of sub lost with its watch
+    notifier.wm.rm_watch(notifier.wm.get_wd(sub))
+    assert notifier.wm.get_wd(sub) is None
+
+    notifier.overflow(time.time() - 60)
+    assert wait_for(lambda: recorder.paths('IN_CLOSE_WRITE') == [os.path.join(sub, 'new')])
+    assert notifier.wm.get_wd(sub) is not None
+    assert notifier.get_queue_stats()['overflows'] == 1
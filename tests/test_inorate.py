@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""tests.test_inorate"""
+
+import os
+
+import pyinotify
+
+from dwho.classes.inoplugs import INOPLUGS
+from dwho.classes.inorate import DWhoInotifyRateLimiter, DWhoInotifyTokenBucket, get_burst, has_rate_limit
+
+from conftest import DWhoTestRecorderPlug, wait_for
+
+
+class FakeCfgPath(object): # pylint: disable=useless-object-inheritance,too-few-public-methods
+    def __init__(self, path, plugins, rate_limit = None, rate_burst = None):
+        self.path       = path
+        self.plugins    = list(plugins)
+        self.rate_limit = rate_limit
+        self.rate_burst = rate_burst
+
+
+class FakePlugin(object): # pylint: disable=useless-object-inheritance,too-few-public-methods
+    def __init__(self, name, rate_limit = None, rate_burst = None):
+        self.PLUGIN_NAME = name
+        self.rate_limit  = rate_limit
+        self.rate_burst  = rate_burst
+
+
+class FakeEvent(object): # pylint: disable=useless-object-inheritance,too-few-public-methods
+    def __init__(self, mask = pyinotify.IN_CLOSE_WRITE): # pylint: disable=no-member
+        self.mask = mask
+
+
+def test_has_rate_limit():
+    assert not has_rate_limit({'paths': {'/w': {}}, 'plugins': {'a': True}})
+    assert has_rate_limit({'paths': {'/w': {'rate_limit': 10}}})
+    assert has_rate_limit({'plugins': {'a': {'rate_limit': 10}}})
+
+
+def test_token_bucket():
+    assert get_burst(0.5) == 1.0
+    assert get_burst(10, 3) == 3.0
+
+    bucket = DWhoInotifyTokenBucket('/w', 10, 2)
+    now    = bucket.updated
+
+    assert bucket.take(now)
+    assert bucket.take(now)
+    assert not bucket.take(now)
+    assert round(bucket.delay(now), 3) == 0.1
+    assert bucket.take(now + 0.1)
+
+
+def test_path_limit_coalesces():
+    dispatched = []
+    limiter    = DWhoInotifyRateLimiter(lambda *args: dispatched.append(args))
+    cfg_path   = FakeCfgPath('/w', [FakePlugin('a')], 0.001, 1)
+
+    assert limiter.admit(cfg_path, FakeEvent(), '/w/a') is cfg_path
+    assert limiter.admit(cfg_path, FakeEvent(pyinotify.IN_MODIFY), '/w/b') is None # pylint: disable=no-member
+    assert limiter.admit(cfg_path, FakeEvent(), '/w/b') is None
+    assert limiter.admit(cfg_path, FakeEvent(), '/w/c') is None
+    assert limiter.pending() == 2
+    assert limiter.get_stats()['merged'] == 1
+
+    limiter.flush()
+    assert [x[2] for x in dispatched] == ['/w/b', '/w/c']
+    assert dispatched[0][1].coalesced_count == 2
+    assert dispatched[0][1].coalesced_mask == pyinotify.IN_MODIFY | pyinotify.IN_CLOSE_WRITE # pylint: disable=no-member
+    assert limiter.pending() == 0
+
+
+def test_plugin_limit():
+    dispatched = []
+    limiter    = DWhoInotifyRateLimiter(lambda *args: dispatched.append(args))
+    slow       = FakePlugin('slow', 5, 1)
+    cfg_path   = FakeCfgPath('/w', [FakePlugin('fast'), slow])
+    limiter.start()
+
+    try:
+        assert limiter.admit(cfg_path, FakeEvent(), '/w/a') is cfg_path
+
+        # the other plugins run at once
+        xcfg_path = limiter.admit(cfg_path, FakeEvent(), '/w/b')
+        assert [x.PLUGIN_NAME for x in xcfg_path.plugins] == ['fast']
+
+        # released for the limited plugin only
+        assert wait_for(lambda: len(dispatched) == 1)
+        (xcfg_path, event, filepath, bucket) = dispatched[0] # pylint: disable=unused-variable
+        assert filepath == '/w/b'
+        assert xcfg_path.plugins == [slow]
+        assert limiter.admit(xcfg_path, event, filepath, bucket) is xcfg_path
+    finally:
+        limiter.stop()
+        limiter.join(5)
+
+
+def test_flush_plugin_deferred_again():
+    dispatched = []
+    limiter    = DWhoInotifyRateLimiter(None)
+    slow       = FakePlugin('slow', 0.001, 1)
+    cfg_path   = FakeCfgPath('/w', [slow], 0.001, 1)
+
+    def dispatch(cfg_path, event, filepath, bucket):
+        if limiter.admit(cfg_path, event, filepath, bucket) is not None:
+            dispatched.append(filepath)
+
+    limiter.dispatch = dispatch
+
+    # takes the tokens of both buckets
+    dispatch(cfg_path, FakeEvent(), '/w/a', None)
+    dispatch(cfg_path, FakeEvent(), '/w/b', None)
+    assert dispatched == ['/w/a']
+
+    # released by the path bucket then deferred by the plugin bucket
+    limiter.flush()
+    assert dispatched == ['/w/a', '/w/b']
+    assert limiter.pending() == 0
+
+
+def test_deferred_plugin_with_dedupe(tmpdir_path, recorder, start_notifier):
+    slow = DWhoTestRecorderPlug('test_slow')
+    INOPLUGS.register(slow)
+
+    try:
+        start_notifier({'plugins': {recorder.PLUGIN_NAME: True,
+                                    slow.PLUGIN_NAME:     {'enabled':    True,
+                                                           'rate_limit': 2,
+                                                           'rate_burst': 1}},
+                        'paths':   {tmpdir_path: {'dedupe': True}},
+                        'events':  ['close_write']},
+                       [recorder, slow])
+
+        filepaths = [os.path.join(tmpdir_path, x) for x in ('a', 'b')]
+        for filepath in filepaths:
+            with open(filepath, 'w') as f:
+                f.write(filepath)
+
+        assert wait_for(lambda: recorder.paths('IN_CLOSE_WRITE') == filepaths)
+        # the released event is not checked again by dedupe
+        assert wait_for(lambda: slow.paths('IN_CLOSE_WRITE') == filepaths)
+    finally:
+        INOPLUGS.unregister(slow)
+
+
+def test_stop_flushes_deferred(tmpdir_path, recorder, start_notifier):
+    notifier = start_notifier({'plugins': {recorder.PLUGIN_NAME: True},
+                               'paths':   {tmpdir_path: {'rate_limit': 0.001,
+                                                         'rate_burst': 1}},
+                               'events':  ['close_write']},
+                              [recorder])
+
+    filepaths = [os.path.join(tmpdir_path, x) for x in ('a', 'b')]
+    for filepath in filepaths:
+        with open(filepath, 'w') as f:
+            f.write('x')
+    # the IN_CREATE event of auto_add takes the token
+    assert wait_for(lambda: notifier.limiter.pending() == 2)
+
+    notifier.stop()
+    notifier.join(10)
+
+    assert recorder.paths('IN_CLOSE_WRITE') == filepaths
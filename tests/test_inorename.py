@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""tests.test_inorename"""
+
+import os
+import time
+
+from dwho.classes.inorename import DWhoInotifyRenamer
+
+from conftest import wait_for
+
+
+class FakeEvent(object): # pylint: disable=useless-object-inheritance,too-few-public-methods
+    def __init__(self, cookie):
+        self.cookie = cookie
+
+
+def test_renamer_pop():
+    expired = []
+    renamer = DWhoInotifyRenamer(expired.append, window = 10)
+
+    event = FakeEvent(1)
+    renamer.push(event)
+    assert renamer.pending() == 1
+    assert renamer.pop(2) is None
+    assert renamer.pop(1) is event
+    assert renamer.paired == 1
+    assert renamer.pending() == 0
+    assert expired == []
+
+
+def test_renamer_expire():
+    expired = []
+    renamer = DWhoInotifyRenamer(expired.append, window = 0.05)
+    renamer.start()
+
+    try:
+        event = FakeEvent(1)
+        renamer.push(event)
+        assert wait_for(lambda: expired == [event])
+        assert renamer.pop(1) is None
+    finally:
+        renamer.stop()
+        renamer.join(5)
+
+
+def test_renamer_flush():
+    expired = []
+    renamer = DWhoInotifyRenamer(expired.append, window = 10)
+
+    events = [FakeEvent(1), FakeEvent(2)]
+    for event in events:
+        renamer.push(event)
+    renamer.flush()
+
+    assert expired == events
+    assert renamer.pending() == 0
+
+
+def test_rename_paired(tmpdir_path, recorder, start_notifier):
+    start_notifier({'plugins': {recorder.PLUGIN_NAME: True},
+                    'paths':   {tmpdir_path: {}},
+                    'events':  ['moved_from', 'moved_to']},
+                   [recorder])
+
+    src = os.path.join(tmpdir_path, 'a')
+    dst = os.path.join(tmpdir_path, 'b')
+    with open(src, 'w') as f:
+        f.write('x')
+    os.rename(src, dst)
+
+    # run_rename runs the IN_MOVED_FROM then the IN_MOVED_TO event
+    assert wait_for(lambda: dst in recorder.paths('IN_MOVED_TO'))
+    assert recorder.paths('IN_MOVED_FROM') == [src]
+
+
+def test_directory_moved_out(tmpdir_path, recorder, start_notifier):
+    root    = os.path.join(tmpdir_path, 'root')
+    outside = os.path.join(tmpdir_path, 'outside')
+    os.makedirs(os.path.join(root, 'e1', 'd2'))
+    os.makedirs(outside)
+
+    notifier = start_notifier({'plugins':       {recorder.PLUGIN_NAME: True},
+                               'paths':         {root: {}},
+                               'events':        ['close_write', 'moved_from', 'moved_to', 'move_self'],
+                               'rename_window': 0.1},
+                              [recorder])
+    assert notifier.wm.get_wd(os.path.join(root, 'e1', 'd2')) is not None
+
+    os.rename(os.path.join(root, 'e1'), os.path.join(outside, 'e1'))
+    assert wait_for(lambda: os.path.join(root, 'e1') in recorder.paths('IN_MOVED_FROM|IN_ISDIR'))
+    assert wait_for(lambda: not [x for x in notifier.wm.watches.values()
+                                 if x.path.startswith(os.path.join(root, 'e1'))])
+
+    with open(os.path.join(outside, 'e1', 'd2', 'y'), 'w') as f:
+        f.write('x')
+
+    # an event of the tree to be sure the former one was read
+    filepath = os.path.join(root, 'z')
+    with open(filepath, 'w') as f:
+        f.write('x')
+    assert wait_for(lambda: filepath in recorder.paths('IN_CLOSE_WRITE'))
+    time.sleep(0.1)
+
+    assert recorder.paths('IN_CLOSE_WRITE') == [filepath]
+
+
+def test_stop_flushes_moved_from(tmpdir_path, recorder, start_notifier):
+    root    = os.path.join(tmpdir_path, 'root')
+    outside = os.path.join(tmpdir_path, 'outside')
+    os.makedirs(root)
+    os.makedirs(outside)
+
+    notifier = start_notifier({'plugins':       {recorder.PLUGIN_NAME: True},
+                               'paths':         {root: {}},
+                               'events':        ['moved_from', 'moved_to'],
+                               'rename_window': 60},
+                              [recorder])
+
+    src = os.path.join(root, 'a')
+    with open(src, 'w') as f:
+        f.write('x')
+    os.rename(src, os.path.join(outside, 'a'))
+    assert wait_for(lambda: notifier.renamer.pending() == 1)
+
+    notifier.stop()
+    notifier.join(10)
+
+    assert recorder.paths('IN_MOVED_FROM') == [src]
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""tests.test_inoshard"""
+
+import os
+import signal
+
+import pytest
+
+from dwho.classes.inoplugs import DWhoInoEventPlugBase, INOPLUGS
+from dwho.classes.inoshard import DWhoInotifySupervisor, get_shard
+from dwho.classes.inotify import DWhoInotifyCfgPath
+
+from conftest import wait_for
+
+
+class DWhoTestShardPlug(DWhoInoEventPlugBase):
+    """
+    Write the pid of the shard and the filepath of every event to the
+    log file of the plugin configuration.
+    """
+
+    PLUGIN_NAME = 'test_shard'
+
+    def safe_init(self):
+        with open(self.plugconf['logfile'], 'a') as f:
+            f.write("%d init\n" % os.getpid())
+
+    def run(self, cfg_path, event, filepath):
+        with open(self.plugconf['logfile'], 'a') as f:
+            f.write("%d %s %s\n" % (os.getpid(), event.maskname, filepath))
+
+
+# registered on import, as in the shard processes
+PLUGIN = DWhoTestShardPlug()
+INOPLUGS.register(PLUGIN)
+
+
+@pytest.fixture
+def shard_plugin():
+    if PLUGIN.PLUGIN_NAME not in INOPLUGS:
+        INOPLUGS.register(PLUGIN)
+    yield PLUGIN
+    INOPLUGS.unregister(PLUGIN)
+
+
+def read_log(path, kind = 'IN_CLOSE_WRITE'):
+    if not os.path.exists(path):
+        return []
+
+    with open(path, 'r') as f:
+        return [x.split() for x in f.read().splitlines() if x.split()[1] == kind]
+
+
+def test_get_shard():
+    cfg_path = DWhoInotifyCfgPath('/w/a')
+    assert get_shard(cfg_path, 4) == get_shard(DWhoInotifyCfgPath('/w/a'), 4)
+    assert len(set([get_shard(DWhoInotifyCfgPath("/w/%d" % i), 4) for i in range(32)])) == 4
+
+    cfg_path.shard = 5
+    assert get_shard(cfg_path, 4) == 1
+
+
+def test_shards(tmpdir_path, shard_plugin, start_notifier):
+    (a, b)  = [os.path.join(tmpdir_path, x) for x in ('a', 'b')]
+    for path in (a, b):
+        os.makedirs(path)
+    logfile = os.path.join(tmpdir_path, 'shard.log')
+
+    notifier = start_notifier({'plugins': {shard_plugin.PLUGIN_NAME: {'enabled': True,
+                                                                      'logfile': logfile}},
+                               'paths':   {a: {'shard': 0}, b: {'shard': 1}},
+                               'events':  ['close_write'],
+                               'shards':  2},
+                              [shard_plugin])
+    assert isinstance(notifier, DWhoInotifySupervisor)
+    assert wait_for(lambda: not notifier.is_scanning() and all([x['alive'] for x in notifier.get_shards()]))
+
+    def write_files(name):
+        for path in (a, b):
+            with open(os.path.join(path, name), 'w') as f:
+                f.write('x')
+
+    write_files('f')
+    assert wait_for(lambda: len(read_log(logfile)) == 2)
+
+    pids = dict([(x[2], int(x[0])) for x in read_log(logfile)])
+    assert pids[os.path.join(a, 'f')] == notifier.shards[0].process.pid
+    assert pids[os.path.join(b, 'f')] == notifier.shards[1].process.pid
+
+    # the plugin is initialized again in every shard
+    inits = [int(x[0]) for x in read_log(logfile, 'init')]
+    assert os.getpid() in inits
+    for shard in notifier.shards:
+        assert shard.process.pid in inits
+
+    # a dead shard is restarted with its paths
+    os.kill(notifier.shards[0].process.pid, signal.SIGKILL)
+    assert wait_for(lambda: notifier.shards[0].restarts == 1)
+    assert wait_for(lambda: notifier.shards[0].process.is_alive() and notifier.shards[0].scanned.is_set())
+
+    write_files('g')
+    assert wait_for(lambda: os.path.join(a, 'g') in [x[2] for x in read_log(logfile)])
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""tests.test_inosnapshot"""
+
+import os
+
+from dwho.classes.inosnapshot import DWhoInotifySnapshot, stat_key
+
+from conftest import wait_for
+
+
+def new_snapshot(tmpdir_path):
+    return DWhoInotifySnapshot(os.path.join(tmpdir_path, 'snapshot')).load()
+
+
+def test_load_records(tmpdir_path):
+    snapshot = new_snapshot(tmpdir_path)
+    assert not snapshot.loaded
+
+    snapshot.set('/w/a', (1, 2, 3))
+    snapshot.set('/w/b', (4, 5, 6))
+    snapshot.set('/w/a', (1, 2, 4))
+    snapshot.delete('/w/b')
+    snapshot.set('/w/c', (7, 8, 9))
+    snapshot.sync()
+
+    snapshot = new_snapshot(tmpdir_path)
+    assert snapshot.loaded
+    assert len(snapshot) == 2
+    assert snapshot.get('/w/a') == (1, 2, 4)
+    assert snapshot.get('/w/b') is None
+    assert sorted(snapshot.paths_under('/w/')) == ['/w/a', '/w/c']
+
+    # the slot of /w/b is reused
+    assert len(snapshot.paths) == 2
+
+
+def test_paths_under(tmpdir_path):
+    snapshot = new_snapshot(tmpdir_path)
+    for path in ('/w/a', '/w/a/b', '/w/a/c/d', '/w/ab', '/x/a'):
+        snapshot.set(path, (1, 2, 3))
+
+    # whole components only, the root itself is not listed
+    assert sorted(snapshot.paths_under('/w/a')) == ['/w/a/b', '/w/a/c/d']
+    assert snapshot.has_paths_under('/w/a')
+    assert not snapshot.has_paths_under('/w/ab')
+    assert not snapshot.has_paths_under('/y')
+
+    snapshot.delete('/w/a/b')
+    snapshot.delete('/w/a/c/d')
+    assert snapshot.paths_under('/w/a') == []
+    assert not snapshot.has_paths_under('/w/a')
+    assert snapshot.get('/w/a') == (1, 2, 3)
+
+
+def test_truncated_record(tmpdir_path):
+    snapshot = new_snapshot(tmpdir_path)
+    snapshot.set('/w/a', (1, 2, 3))
+    snapshot.set('/w/b', (4, 5, 6))
+    snapshot.sync()
+
+    with open(snapshot.filepath, 'rb+') as f:
+        f.truncate(os.path.getsize(snapshot.filepath) - 1)
+
+    snapshot = new_snapshot(tmpdir_path)
+    assert snapshot.get('/w/a') == (1, 2, 3)
+    assert '/w/b' not in snapshot
+
+
+def test_compact(tmpdir_path):
+    snapshot = new_snapshot(tmpdir_path)
+    for i in range(1000):
+        snapshot.set('/w/a', (1, 2, i))
+    snapshot.sync()
+
+    size = os.path.getsize(snapshot.filepath)
+    assert new_snapshot(tmpdir_path).get('/w/a') == (1, 2, 999)
+
+    # obsolete records are dropped past 1024 records
+    for i in range(100):
+        snapshot.set('/w/a', (1, 2, i))
+    snapshot.sync()
+    assert os.path.getsize(snapshot.filepath) < size / 100
+    assert new_snapshot(tmpdir_path).get('/w/a') == (1, 2, 99)
+
+
+def test_catch_up(tmpdir_path, recorder, start_notifier):
+    root    = os.path.join(tmpdir_path, 'root')
+    os.makedirs(root)
+    section = {'plugins':       {recorder.PLUGIN_NAME: True},
+               'paths':         {root: {}},
+               'events':        ['create', 'close_write', 'delete'],
+               'snapshot_file': os.path.join(tmpdir_path, 'snapshot')}
+
+    for name in ('a', 'b', 'c'):
+        with open(os.path.join(root, name), 'w') as f:
+            f.write('x')
+
+    # the first run only records the files
+    notifier = start_notifier(section, [recorder])
+    assert wait_for(lambda: len(notifier.snapshot) == 3)
+    notifier.stop()
+    notifier.join(10)
+    assert not notifier.snapshot.is_alive()
+    assert recorder.records == []
+
+    os.utime(os.path.join(root, 'a'), (1000, 1000))
+    os.unlink(os.path.join(root, 'b'))
+    with open(os.path.join(root, 'd'), 'w') as f:
+        f.write('x')
+
+    notifier = start_notifier(section, [recorder])
+    assert wait_for(lambda: len(recorder.records) == 4)
+    assert sorted([x[1:] for x in recorder.records]) == \
+        [('IN_CLOSE_WRITE', os.path.join(root, 'a')),
+         ('IN_CLOSE_WRITE', os.path.join(root, 'd')),
+         ('IN_CREATE', os.path.join(root, 'd')),
+         ('IN_DELETE', os.path.join(root, 'b'))]
+    assert notifier.snapshot.get(os.path.join(root, 'a')) == stat_key(os.lstat(os.path.join(root, 'a')))
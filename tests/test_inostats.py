@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""tests.test_inostats"""
+
+import os
+
+from dwho.classes.inostats import STAGE_LATENCY, STAGE_PLUGIN, DWhoInotifyHistogram, DWhoInotifyStats
+
+from conftest import wait_for
+
+
+def test_histogram():
+    histogram = DWhoInotifyHistogram()
+    assert histogram.get_stats() == {'count': 0, 'mean': 0.0, 'max': 0.0,
+                                     'p50': 0.0, 'p90': 0.0, 'p99': 0.0}
+
+    for _ in range(90):
+        histogram.add(0.000003)
+    for _ in range(10):
+        histogram.add(0.5)
+
+    r = histogram.get_stats()
+    assert r['count'] == 100
+    assert r['max'] == 0.5
+    # upper bounds of the [2, 4[ and [2^18, 2^19[ usec buckets
+    assert r['p50'] == 0.000004
+    assert r['p90'] == 0.000004
+    assert r['p99'] == 0.5
+
+
+def test_histogram_bounds():
+    histogram = DWhoInotifyHistogram()
+    histogram.add(0)
+    histogram.add(10 ** 6)
+
+    assert histogram.buckets[0] == 1
+    assert histogram.buckets[-1] == 1
+
+
+def test_stats():
+    stats = DWhoInotifyStats()
+    stats.observe(STAGE_PLUGIN, 'a', 0.001)
+    stats.observe(STAGE_PLUGIN, 'a', -1)
+    stats.observe(STAGE_PLUGIN, 'b', 0.001)
+
+    r = stats.get_stats()
+    assert sorted(r[STAGE_PLUGIN].keys()) == ['a', 'b']
+    assert r[STAGE_PLUGIN]['a']['count'] == 2
+
+    stats.reset()
+    assert stats.get_stats() == {}
+
+
+def test_pipeline_stats(tmpdir_path, recorder, start_notifier):
+    notifier = start_notifier({'plugins': {recorder.PLUGIN_NAME: True},
+                               'paths':   {tmpdir_path: {}},
+                               'events':  ['close_write']},
+                              [recorder])
+
+    filepath = os.path.join(tmpdir_path, 'a')
+    with open(filepath, 'w') as f:
+        f.write('x')
+
+    def get_count():
+        plugins = notifier.get_stats()['histograms'].get(STAGE_PLUGIN) or {}
+        return (plugins.get(recorder.PLUGIN_NAME) or {}).get('count')
+
+    # every plugin run is observed, the IN_CREATE one included
+    assert wait_for(lambda: filepath in recorder.paths('IN_CLOSE_WRITE'))
+    assert wait_for(lambda: get_count() == len(recorder.records))
+    assert notifier.get_stats()['histograms'][STAGE_LATENCY][tmpdir_path]['count'] >= 1
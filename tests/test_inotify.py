@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""tests.test_inotify"""
+
+import copy
+import os
+import re
+
+import pyinotify
+import pytest
+
+from dwho.classes.errors import DWhoConfigurationError
+from dwho.classes.inoplugs import INOPLUGS
+from dwho.classes.inotify import DWhoInotifyWatchManager
+
+from conftest import DWhoTestRecorderPlug, wait_for
+
+
+def test_reload(tmpdir_path, recorder, start_notifier):
+    (a, b, c) = [os.path.join(tmpdir_path, x) for x in ('a', 'b', 'c')]
+    for path in (a, os.path.join(b, 'tmp'), c):
+        os.makedirs(path)
+
+    section  = {'plugins': {recorder.PLUGIN_NAME: True},
+                'paths':   {a: {}, b: {}},
+                'events':  ['close_write']}
+    notifier = start_notifier(section, [recorder])
+    wd       = notifier.wm.get_wd(b)
+    assert notifier.wm.get_wd(os.path.join(b, 'tmp')) is not None
+    assert notifier.wm.get_wd(c) is None
+
+    exclude_file = os.path.join(tmpdir_path, 'exclude')
+    with open(exclude_file, 'w') as f:
+        f.write("^%s$\n" % re.escape(os.path.join(b, 'tmp')))
+
+    section  = copy.deepcopy(section)
+    section['paths'] = {b: {'exclude_files': [exclude_file]},
+                        c: {}}
+    assert notifier.reload(section) == 2
+
+    assert wait_for(lambda: notifier.wm.get_wd(c) is not None)
+    assert wait_for(lambda: notifier.wm.get_wd(a) is None)
+    assert wait_for(lambda: notifier.wm.get_wd(os.path.join(b, 'tmp')) is None)
+    # updated in place
+    assert notifier.wm.get_wd(b) == wd
+
+    for path in (a, os.path.join(b, 'tmp'), b, c):
+        with open(os.path.join(path, 'f'), 'w') as f:
+            f.write('x')
+
+    assert wait_for(lambda: len(recorder.paths('IN_CLOSE_WRITE')) == 2)
+    assert sorted(recorder.paths('IN_CLOSE_WRITE')) == [os.path.join(b, 'f'), os.path.join(c, 'f')]
+
+
+def test_reload_invalid(tmpdir_path, recorder, start_notifier):
+    section  = {'plugins': {recorder.PLUGIN_NAME: True},
+                'paths':   {tmpdir_path: {}},
+                'events':  ['close_write']}
+    notifier = start_notifier(section, [recorder])
+
+    section  = copy.deepcopy(section)
+    section['paths'][tmpdir_path]['backend'] = 'none'
+    with pytest.raises(DWhoConfigurationError):
+        notifier.reload(section)
+
+    assert notifier.wm.get_wd(tmpdir_path) is not None
+
+
+def test_nested_cfg_paths(tmpdir_path, start_notifier):
+    outer = DWhoTestRecorderPlug('test_outer')
+    inner = DWhoTestRecorderPlug('test_inner')
+    for plugin in (outer, inner):
+        INOPLUGS.register(plugin)
+
+    try:
+        root = os.path.join(tmpdir_path, 'root')
+        sub  = os.path.join(root, 'sub')
+        os.makedirs(os.path.join(sub, 'd'))
+        os.makedirs(os.path.join(root, 'other'))
+
+        notifier = start_notifier({'plugins': {outer.PLUGIN_NAME: True, inner.PLUGIN_NAME: True},
+                                   'paths':   {root: {'plugins': {outer.PLUGIN_NAME: True}},
+                                               sub:  {'plugins': {inner.PLUGIN_NAME: True}}},
+                                   'events':  ['close_write']},
+                                  [outer, inner])
+
+        # walked once, every directory has a single watch
+        assert sorted([x.path for x in notifier.wm.watches.values()]) == \
+            sorted([root, os.path.join(root, 'other'), sub, os.path.join(sub, 'd')])
+
+        for path in (root, os.path.join(root, 'other'), os.path.join(sub, 'd')):
+            with open(os.path.join(path, 'f'), 'w') as f:
+                f.write('x')
+
+        assert wait_for(lambda: len(outer.paths('IN_CLOSE_WRITE')) == 2
+                        and len(inner.paths('IN_CLOSE_WRITE')) == 1)
+        assert inner.paths('IN_CLOSE_WRITE') == [os.path.join(sub, 'd', 'f')]
+    finally:
+        for plugin in (outer, inner):
+            INOPLUGS.unregister(plugin)
+
+
+def test_rm_watch_subtree(tmpdir_path):
+    for x in ('d1/a/b', 'd10/a', 'd2'):
+        os.makedirs(os.path.join(tmpdir_path, x))
+
+    wm = DWhoInotifyWatchManager()
+    try:
+        wm.add_watch(tmpdir_path, pyinotify.IN_CLOSE_WRITE, rec = True) # pylint: disable=no-member
+        assert len(wm.watches) == 7
+
+        r = wm.rm_watch(wm.get_wd(os.path.join(tmpdir_path, 'd1')), rec = True)
+        assert len(r) == 3 and all(r.values())
+
+        # d10 shares the d1 prefix but is not under it
+        assert sorted([x.path for x in wm.watches.values()]) == \
+            sorted([tmpdir_path] + [os.path.join(tmpdir_path, x) for x in ('d10', 'd10/a', 'd2')])
+        assert wm.get_wd(os.path.join(tmpdir_path, 'd1', 'a')) is None
+    finally:
+        wm.close()
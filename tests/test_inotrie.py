@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""tests.test_inotrie"""
+
+import pytest
+
+from dwho.classes.inotrie import DWhoInotifyPathTrie, split_path
+
+
+def new_trie(paths):
+    trie = DWhoInotifyPathTrie()
+    for path in paths:
+        trie[path] = path.upper()
+    return trie
+
+
+def test_split_path():
+    assert split_path('/data//foo/./bar/') == ['data', 'foo', 'bar']
+    assert split_path('/') == []
+
+
+def test_items():
+    trie = new_trie(['/data', '/data/foo', '/other'])
+
+    assert len(trie) == 3
+    assert trie['/data/foo'] == '/DATA/FOO'
+    assert '/data/foo/' in trie
+    assert '/data/fo' not in trie
+    assert trie.get('/data/bar', 'x') == 'x'
+    assert sorted(trie) == ['/data', '/data/foo', '/other']
+    assert sorted(trie.items('/data')) == [('/data', '/DATA'), ('/data/foo', '/DATA/FOO')]
+    assert list(trie.items('/none')) == []
+
+    with pytest.raises(KeyError):
+        trie['/data/bar'] # pylint: disable=pointless-statement
+
+    trie['/data'] = 'x'
+    assert len(trie) == 3
+    assert trie['/data'] == 'x'
+
+
+def test_longest_prefix():
+    trie = new_trie(['/data', '/data/foo'])
+
+    assert trie.longest_prefix('/data/foo/a/b') == ('/data/foo', '/DATA/FOO')
+    assert trie.longest_prefix('/data/foobar') == ('/data', '/DATA')
+    assert trie.longest_prefix('/data') == ('/data', '/DATA')
+    assert trie.longest_prefix('/dat') == (None, None)
+    assert trie.longest_prefix_value('/other', 'x') == 'x'
+
+    assert new_trie(['/']).longest_prefix('/a/b') == ('/', '/')
+
+
+def test_delete_prunes():
+    trie = new_trie(['/data', '/data/foo/bar'])
+
+    assert trie.has_descendants('/data')
+    del trie['/data/foo/bar']
+    assert len(trie) == 1
+    assert not trie.has_descendants('/data')
+    assert trie.longest_prefix('/data/foo/bar') == ('/data', '/DATA')
+
+    with pytest.raises(KeyError):
+        del trie['/data/foo']
+
+    trie.clear()
+    assert len(trie) == 0
+    assert trie.longest_prefix('/data') == (None, None)
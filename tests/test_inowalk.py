@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""tests.test_inowalk"""
+
+import os
+import threading
+
+import pytest
+
+from dwho.classes.inowalk import DWhoInotifyWalker, list_subdirs
+
+
+def make_tree(root, depth = 3, width = 3):
+    r = [root]
+    for i in range(width):
+        path = os.path.join(root, "d%d" % i)
+        os.makedirs(path)
+        if depth > 1:
+            r.extend(make_tree(path, depth - 1, width))
+        else:
+            r.append(path)
+    return r
+
+
+def test_list_subdirs(tmpdir_path):
+    os.makedirs(os.path.join(tmpdir_path, 'a'))
+    os.symlink(os.path.join(tmpdir_path, 'a'), os.path.join(tmpdir_path, 'b'))
+    with open(os.path.join(tmpdir_path, 'c'), 'w') as f:
+        f.write('x')
+
+    assert list_subdirs(tmpdir_path) == [os.path.join(tmpdir_path, 'a')]
+
+
+@pytest.mark.parametrize('max_workers', [1, 4])
+def test_walk(tmpdir_path, max_workers):
+    paths    = make_tree(tmpdir_path)
+    visited  = []
+    lock     = threading.Lock()
+    progress = []
+
+    def visit(path):
+        with lock:
+            visited.append(path)
+
+    walker = DWhoInotifyWalker(max_workers, progress = lambda top, nb: progress.append(nb))
+    assert walker.walk(tmpdir_path, visit) == len(paths)
+    assert sorted(visited) == sorted(paths)
+    assert progress[-1] == len(paths)
+
+
+def test_walk_excluded(tmpdir_path):
+    make_tree(tmpdir_path, 2, 2)
+    excluded = os.path.join(tmpdir_path, 'd1')
+    visited  = []
+
+    walker = DWhoInotifyWalker(2, exclude_filter = lambda path: path == excluded)
+    walker.walk(tmpdir_path, visited.append)
+
+    assert walker.excluded == [excluded]
+    assert not [x for x in visited if x.startswith(excluded)]
+    assert len(visited) == 4
+
+
+def test_walk_error(tmpdir_path):
+    make_tree(tmpdir_path, 2, 2)
+
+    def visit(path):
+        if path.endswith('d1'):
+            raise ValueError(path)
+
+    with pytest.raises(ValueError):
+        DWhoInotifyWalker(2).walk(tmpdir_path, visit)
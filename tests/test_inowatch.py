@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2019 Adrien Delle Cave
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""tests.test_inowatch"""
+
+from dwho.classes.inowatch import DWhoInotifyWatchTable
+
+
+def proc_fun():
+    pass
+
+
+def new_table(paths):
+    table = DWhoInotifyWatchTable()
+    for wd, path in enumerate(paths, 1):
+        table.add(wd, path, 8, proc_fun, True, None)
+    return table
+
+
+def test_paths():
+    table = new_table(['/w', '/w/a', '/w/a/b', '/x'])
+
+    assert len(table) == 4
+    assert table.get_path(3) == '/w/a/b'
+    assert table.get_wd('/w/a/b') == 3
+    assert table.get_wd('/w/c') is None
+    assert table.get_children(1) == [2]
+    assert sorted(table.get_subtree([1])) == [1, 2, 3]
+    assert sorted(table.paths()) == [(1, '/w'), (2, '/w/a'), (3, '/w/a/b'), (4, '/x')]
+
+
+def test_move():
+    table = new_table(['/w', '/w/a', '/w/a/b', '/w/c'])
+
+    assert table.move(2, '/w/c/d') == 1
+    assert table.get_path(3) == '/w/c/d/b'
+    assert table.get_wd('/w/c/d/b') == 3
+    assert table.get_wd('/w/a/b') is None
+
+
+def test_remove_keeps_children():
+    table = new_table(['/w', '/w/a', '/w/a/b'])
+
+    assert table.remove(2)
+    assert not table.remove(2)
+    assert table.get_path(3) == '/w/a/b'
+
+    # adopted back when the parent is watched again
+    table.add(5, '/w/a', 8, proc_fun, True, None)
+    assert table.get_children(5) == [3]
+    assert table.get_path(3) == '/w/a/b'
+
+
+def test_nested_roots():
+    table = DWhoInotifyWatchTable()
+    table.add(1, '/w/a/b', 8, proc_fun, True, None)
+    table.add(2, '/w/a', 8, proc_fun, True, None)
+
+    assert table.get_children(2) == [1]
+    assert table.get_wd('/w/a/b') == 1
+
+
+def test_watch_view():
+    table = new_table(['/w', '/w/a'])
+    watch = table[2]
+
+    assert watch.path == '/w/a'
+    assert watch.mask == 8
+    assert watch.proc_fun is proc_fun
+    assert watch.auto_add is True
+
+    watch.auto_add = False
+    assert table.get_attr(2, 'auto_add') is False
+    assert table.get_attr(1, 'auto_add') is True
+
+    watch.path = '/w/b'
+    assert table.get_wd('/w/b') == 2
+
+
+def test_stale_view():
+    table = new_table(['/w', '/w/a'])
+    watch = table[2]
+
+    table.remove(2)
+    assert not watch.is_valid()
+    assert watch.path is None
+    assert watch.mask is None
+    assert watch.proc_fun is None
+    assert watch.exclude_filter is None
+    repr(watch)
+
+    # the wd and the profile slot are reused by another watch
+    table.add(2, '/x', 16, proc_fun, False, None)
+    assert not watch.is_valid()
+    assert watch.path is None
+    assert watch.auto_add is None
+
+    watch.auto_add = True
+    watch.mask     = 4
+    watch.path     = '/y'
+    assert table.get_path(2) == '/x'
+    assert table.get_mask(2) == 16
+    assert table.get_attr(2, 'auto_add') is False
+
+    assert table[2].is_valid()
+    assert table[2].path == '/x'
+
+
+def test_same_watch_added_again():
+    table = new_table(['/w'])
+    watch = table[1]
+
+    table.add(1, '/w', 4, proc_fun, False, None)
+    assert watch.is_valid()
+    assert watch.mask == 4
+    assert watch.auto_add is False